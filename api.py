@@ -0,0 +1,334 @@
+import json
+from datetime import datetime, timedelta
+from flask import Blueprint, abort, current_app, request
+from sqlalchemy import func, select
+from models import db, Venue, Artist, Show
+from forms import SHOW_MINUTES, DEFAULT_SHOW_MINUTES
+import queries
+import intervals
+import matching
+import calendars
+import writequeue
+
+try:
+    import orjson
+except ImportError:  # optional, the stdlib encoder is used without it
+    orjson = None
+
+#----------------------------------------------------------------------------#
+# JSON API, /api/v1.
+#
+#   GET /api/v1/venues            ?after= ?before= ?limit=
+#   GET /api/v1/venues/<id>
+#   GET /api/v1/venues/<id>/availability  ?from= ?to= ?duration=
+#   GET /api/v1/venues/<id>/recommended-artists   ?limit=
+#   GET /api/v1/artists[/<id>]
+#   GET /api/v1/artists/<id>/recommended-venues   ?limit=
+#   GET /api/v1/shows             ?from= ?to= ?city= ?state= ?genre=
+#   GET /api/v1/shows/<id>
+#   GET /api/v1/writes/<key>      a queued write's state, see writequeue.py
+#
+# Venue and artist payloads are the dicts the HTML pages render (see
+# queries.venue_data). `fields=name,city` narrows a payload, and the
+# columns selected for it; `fields[shows]=` does the same for shows.
+# `include=shows` embeds shows: on a list, the latest INCLUDE_LIMIT of
+# each entry, fetched for the whole page in one IN query; on a single
+# venue or artist, the past/upcoming partitions of its page.
+#----------------------------------------------------------------------------#
+
+blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MAX_LIMIT = 200
+
+# Shows embedded per venue or artist in a list with include=shows.
+INCLUDE_LIMIT = 20
+
+# Longest from..to range of an availability request, and the default one.
+MAX_AVAILABILITY_DAYS = 92
+AVAILABILITY_DAYS = 7
+
+# kind -> (model, payload fields, listing order, show owner column, shows select)
+RESOURCES = {
+    'venues': (Venue, queries.VENUE_FIELDS, (Venue.name, Venue.id), Show.venue_id, queries.venue_shows_select),
+    'artists': (Artist, queries.ARTIST_FIELDS, queries.ARTIST_KEYS, Show.artist_id, queries.artist_shows_select),
+}
+
+
+#  Responses
+#  ----------------------------------------------------------------
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'cannot serialize {value!r}')
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, default=_default, separators=(',', ':')).encode()
+
+
+def respond(payload, status=200):
+    return current_app.response_class(dumps(payload), status=status, mimetype='application/json')
+
+
+@blueprint.errorhandler(400)
+@blueprint.errorhandler(404)
+def error(error):
+    return respond({'error': error.name, 'message': error.description}, error.code)
+
+
+#  Parameters
+#  ----------------------------------------------------------------
+
+def requested_fields(name, available, primary=True):
+    # fields[name]=a,b or, for the resource itself, fields=a,b; None is all
+    value = request.args.get(f'fields[{name}]')
+    if value is None and primary:
+        value = request.args.get('fields')
+    if value is None:
+        return None
+    fields = [field for field in value.split(',') if field]
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        abort(400, f"unknown fields for {name}: {', '.join(unknown)}")
+    return fields
+
+
+def includes():
+    included = {name for name in request.args.get('include', '').split(',') if name}
+    if included - {'shows'}:
+        abort(400, f"unknown include: {', '.join(sorted(included - {'shows'}))}")
+    return included
+
+
+def page_args(keys):
+    after, before = request.args.get('after'), request.args.get('before')
+    for cursor in (after, before):
+        if cursor is not None:
+            try:
+                queries.decode_cursor(cursor, keys)
+            except ValueError:
+                abort(400, 'invalid cursor')
+    try:
+        limit = int(request.args.get('limit', current_app.config['PAGE_SIZE']))
+    except ValueError:
+        abort(400, 'limit must be a number')
+    return after, before, max(1, min(limit, MAX_LIMIT))
+
+
+def time_arg(name, default):
+    # an ISO 8601 date or time; an offset is dropped, like the forms do
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return datetime.fromisoformat(value).replace(tzinfo=None)
+    except ValueError:
+        abort(400, f'{name} must be an ISO 8601 date or time')
+
+
+def pick(data, fields):
+    # id and the requested fields of data; all of it when fields is None
+    if fields is None:
+        return data
+    keep = {'id', *fields}
+    return {key: value for key, value in data.items() if key in keep}
+
+
+def selected(all_fields, fields):
+    return {field: all_fields[field] for field in ['id'] + (fields or list(all_fields))}
+
+
+def paged(data, page):
+    return {'data': data, 'next': page.next_cursor, 'prev': page.prev_cursor}
+
+
+#  Venues and artists
+#  ----------------------------------------------------------------
+
+def show_fields(kind):
+    shows_select = RESOURCES[kind][4]
+    return requested_fields('shows', list(shows_select().selected_columns.keys()), primary=False)
+
+
+def included_shows(kind, ids, fields):
+    # {id: [show, ...]} for every venue or artist in ids, in one query:
+    # the latest INCLUDE_LIMIT shows of each
+    _, _, _, owner, shows_select = RESOURCES[kind]
+    position = func.row_number().over(
+        partition_by=owner, order_by=(Show.start_time.desc(), Show.id.desc())
+    )
+    ranked = (
+        shows_select()
+        .add_columns(owner.label('owner'), position.label('position'))
+        .where(owner.in_(ids))
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(ranked)
+        .where(ranked.c.position <= INCLUDE_LIMIT)
+        .order_by(ranked.c.owner, ranked.c.position)
+    )
+    shows = {id: [] for id in ids}
+    for row in rows:
+        show = dict(row._mapping)
+        owner_id = show.pop('owner')
+        del show['position']
+        shows[owner_id].append(pick(show, fields))
+    return shows
+
+
+def list_resource(kind):
+    _, all_fields, keys, _, _ = RESOURCES[kind]
+    fields = selected(all_fields, requested_fields(kind, all_fields))
+    after, before, limit = page_args(keys)
+    columns = list(fields.values())
+    page = queries.keyset_page(
+        select(*columns, *[key for key in keys if key not in columns]), keys, after, before, limit
+    )
+    data = [queries.fields_data(row, fields) for row in page]
+    if 'shows' in includes() and data:
+        shows = included_shows(kind, [item['id'] for item in data], show_fields(kind))
+        for item in data:
+            item['shows'] = shows[item['id']]
+    return respond(paged(data, page))
+
+
+def get_resource(kind, id):
+    model, all_fields, _, owner, shows_select = RESOURCES[kind]
+    fields = selected(all_fields, requested_fields(kind, all_fields))
+    row = db.session.execute(select(*fields.values()).where(model.id == id)).one_or_none()
+    if row is None:
+        abort(404, f'no {kind[:-1]} {id}')
+    data = queries.fields_data(row, fields)
+    if 'shows' in includes():
+        wanted = show_fields(kind)
+        queries.add_show_partitions(
+            data, shows_select().where(owner == id), datetime.now(), current_app.config['DETAIL_SHOWS_LIMIT']
+        )
+        for partition in queries.PARTITIONS:
+            data[f'{partition}_shows'] = [pick(show, wanted) for show in data[f'{partition}_shows']]
+    return respond({'data': data})
+
+
+@blueprint.route('/venues')
+def venues():
+    return list_resource('venues')
+
+
+@blueprint.route('/venues/<int:venue_id>')
+def venue(venue_id):
+    return get_resource('venues', venue_id)
+
+
+@blueprint.route('/venues/<int:venue_id>/availability')
+def venue_availability(venue_id):
+    # the venue's free periods between from and to that fit a show of
+    # duration minutes
+    start = time_arg('from', datetime.now().replace(second=0, microsecond=0))
+    end = time_arg('to', start + timedelta(days=AVAILABILITY_DAYS))
+    if end <= start:
+        abort(400, 'to must be after from')
+    if end - start > timedelta(days=MAX_AVAILABILITY_DAYS):
+        abort(400, f'from..to spans more than {MAX_AVAILABILITY_DAYS} days')
+    try:
+        duration = int(request.args.get('duration', DEFAULT_SHOW_MINUTES))
+    except ValueError:
+        abort(400, 'duration must be a number')
+    if not SHOW_MINUTES[0] <= duration <= SHOW_MINUTES[1]:
+        abort(400, 'duration must be between %d and %d minutes' % SHOW_MINUTES)
+    if db.session.execute(select(Venue.id).where(Venue.id == venue_id)).scalar() is None:
+        abort(404, f'no venue {venue_id}')
+    free = intervals.free_slots(venue_id, start, end, duration)
+    return respond({'data': {
+        'venue_id': venue_id, 'from': start, 'to': end, 'duration': duration,
+        'free': [{'start': slot_start, 'end': slot_end} for slot_start, slot_end in free],
+    }})
+
+
+@blueprint.route('/artists')
+def artists():
+    return list_resource('artists')
+
+
+@blueprint.route('/artists/<int:artist_id>')
+def artist(artist_id):
+    return get_resource('artists', artist_id)
+
+
+#  Recommendations
+#  ----------------------------------------------------------------
+
+def recommendations(model, id):
+    # the other side's seeking candidates for a venue or artist, best first
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        abort(400, 'limit must be a number')
+    ranked = matching.recommend(model, id, max(1, min(limit, matching.MAX_LIMIT)))
+    if ranked is None:
+        abort(404, f'no {model.__name__.lower()} {id}')
+    return respond({'data': [
+        {
+            'id': candidate.id, 'name': candidate.name, 'city': candidate.city, 'state': candidate.state,
+            'genres': candidate.genres, 'score': score, 'past_shows_together': together,
+        }
+        for candidate, score, together in ranked
+    ]})
+
+
+@blueprint.route('/venues/<int:venue_id>/recommended-artists')
+def recommended_artists(venue_id):
+    return recommendations(Venue, venue_id)
+
+
+@blueprint.route('/artists/<int:artist_id>/recommended-venues')
+def recommended_venues(artist_id):
+    return recommendations(Artist, artist_id)
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+SHOW_FIELDS = list(queries.shows_query().selected_columns.keys())
+
+
+@blueprint.route('/shows')
+def shows():
+    fields = requested_fields('shows', SHOW_FIELDS)
+    after, before, limit = page_args(queries.SHOW_KEYS)
+    filters = ()
+    if any(arg in request.args for arg in calendars.FILTER_ARGS):
+        try:
+            filters = calendars.ShowQuery.from_args(request.args, calendars.bucket()).filters()
+        except calendars.BadRange as error:
+            abort(400, str(error))
+    page = queries.shows_page(after, before, limit, filters)
+    return respond(paged([pick(dict(row._mapping), fields) for row in page], page))
+
+
+@blueprint.route('/shows/<int:show_id>')
+def show(show_id):
+    fields = requested_fields('shows', SHOW_FIELDS)
+    row = db.session.execute(queries.shows_query().where(Show.id == show_id)).one_or_none()
+    if row is None:
+        abort(404, f'no show {show_id}')
+    return respond({'data': pick(dict(row._mapping), fields)})
+
+
+#  Queued writes
+#  ----------------------------------------------------------------
+
+@blueprint.route('/writes/<key>')
+def write_status(key):
+    # state is queued, running, done or failed (with error)
+    write = writequeue.queue.status(key) if writequeue.enabled() else None
+    if write is None:
+        abort(404, f'no write {key}')
+    return respond({'data': write._asdict()})
+
+
+def init_app(app):
+    app.register_blueprint(blueprint)
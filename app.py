@@ -2,11 +2,10 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import io
 import json
 from os import name
 from click import Choice
-import dateutil.parser 
-import babel
 from flask import (
     Flask, 
     render_template, 
@@ -14,7 +13,11 @@ from flask import (
     Response, 
     flash, 
     redirect, 
-    url_for
+    url_for,
+    abort,
+    jsonify,
+    make_response,
+    stream_with_context
 )
 from flask_moment import Moment
 import logging
@@ -25,7 +28,26 @@ from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 import sys
 from models import db, Venue, Artist, Show
-from datetime import datetime
+import queries
+import search
+import suggest
+import facets
+import matching
+import cache
+import etags
+import formatting
+import importer
+import exporter
+import api
+import intervals
+import writequeue
+import events
+import calendars
+import counters
+import commands
+import instrumentation
+import replicas
+from datetime import datetime, timedelta
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -34,7 +56,18 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 db.init_app(app)
+replicas.init_app(app)
+writequeue.init_app(app)
 migrate = Migrate(app, db)
+commands.init_app(app)
+instrumentation.init_app(app)
+events.init_app(app)
+counters.init_app(app)
+suggest.init_app(app)
+facets.init_app(app)
+matching.init_app(app)
+cache.init_app(app)
+api.init_app(app)
 
 
 
@@ -43,15 +76,87 @@ migrate = Migrate(app, db)
 #----------------------------------------------------------------------------#
 
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format, locale='en')
+  # see formatting.py: compiled patterns and memoized output
+  return formatting.format_datetime(value, format)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Listing helpers.
+#----------------------------------------------------------------------------#
+
+def page_cursors(keys):
+  # keyset cursors from ?after= / ?before= into a listing ordered by keys,
+  # a bad cursor is a bad request
+  after = request.args.get('after')
+  before = request.args.get('before')
+  for cursor in (after, before):
+    if cursor is not None:
+      try:
+        queries.decode_cursor(cursor, keys)
+      except ValueError:
+        abort(400)
+  return after, before
+
+def wants_stream():
+  stream = request.args.get('stream')
+  if stream is None:
+    return app.config['STREAM_LISTINGS']
+  return stream not in ('', '0', 'false')
+
+def stream_template(template_name, **context):
+  # renders the template as it iterates, so rows are sent while the
+  # database cursor is still being read
+  app.update_template_context(context)
+  template = app.jinja_env.get_template(template_name)
+  stream = template.stream(**context)
+  stream.enable_buffering(app.config['STREAM_BUFFER'])
+  return Response(stream_with_context(stream), mimetype='text/html')
+
+def show_partition_json(stmt, partition):
+  after, _ = page_cursors(queries.SHOW_KEYS)
+  page = queries.show_partition(stmt, partition, datetime.now(), after, app.config['DETAIL_SHOWS_LIMIT'])
+  shows = []
+  for row in page:
+    show = queries.show_row(row)
+    show['start_time_display'] = format_datetime(show['start_time'], 'full')
+    show['start_time'] = show['start_time'].isoformat()
+    shows.append(show)
+  return jsonify(shows=shows, next=page.next_cursor)
+
+#----------------------------------------------------------------------------#
+# Queued writes.
+#----------------------------------------------------------------------------#
+
+def idempotency_key():
+  return request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or None
+
+def queue_form(model, target=None):
+  # WRITE_QUEUE mode: the form is checked with the importer's rules and
+  # its write queued (see writequeue.py); returns the Write, or None after
+  # flashing what is wrong with the form
+  record = request.form.to_dict()
+  record['genres'] = request.form.getlist('genres')
+  try:
+    values = importer.clean(model, record)
+    return writequeue.queue.submit('update' if target else 'insert', model, values, target, idempotency_key())
+  except importer.Reject as reject:
+    flash('Could not be saved: ' + '; '.join(f'{field}: {message}' for field, message in reject.args[0].items()))
+  except writequeue.BadKey as error:
+    abort(400, str(error))
+  except writequeue.KeyReused as error:
+    abort(422, str(error))
+  return None
+
+def queued(response, write):
+  # the view's usual response, as 202 Accepted with where to poll the write
+  response = make_response(response)
+  if write is not None:
+    if response.status_code == 200:
+      response.status_code = 202
+    response.headers['X-Write-Status'] = url_for('api.write_status', key=write.key)
+  return response
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -65,87 +170,55 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@etags.conditional(etags.venues_version)
+@cache.cached('venues')
 def venues():
-  # TODO: replace with real venues data.
-  #       num_upcoming_shows should be aggregated based on number of upcoming shows per venue.
-  data=[]
-  cities = Venue.query.distinct(Venue.city, Venue.state).all()
-  for city in cities:
-    city_data = {
-      "city": city.city,
-      "state": city.state,
-      "venues": []
-    }
-    venues = Venue.query.filter_by(city=city.city, state=city.state).all()
-    for venue in venues:
-      num_upcoming_shows = 0
-      for show in venue.shows:
-        if show.start_time > datetime.now():
-          num_upcoming_shows += 1
-      venue_data = {
-        "id": venue.id,
-        "name": venue.name,
-        "num_upcoming_shows": num_upcoming_shows
-      }
-      city_data["venues"].append(venue_data)
-    data.append(city_data)
-    
-  return render_template('pages/venues.html', areas=data);
+  # cities, venues and num_upcoming_shows all come from the Venue table
+  # ?genre= and ?state= narrow the listing, see facets.py
+  after, before = page_cursors(queries.VENUE_AREA_KEYS)
+  selection = facets.Selection.from_args(request.args)
+  filters = selection.filters(Venue)
+  facet_list = facets.facet_list(facets.counts(Venue, selection), selection)
+  if wants_stream():
+    areas = queries.venue_areas_stream(after, filters)
+    return stream_template('pages/venues.html', areas=areas, selection=selection, facets=facet_list)
+  page = queries.venue_areas_page(after, before, app.config['PAGE_SIZE'], filters)
+  return render_template('pages/venues.html', areas=page.items, page=page, selection=selection, facets=facet_list)
 
 @app.route('/venues/search', methods=['POST'])
 def search_venues():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for Hop should return "The Musical Hop".
   # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  response = {}
   search_term = request.form.get('search_term', '')
-  venues = Venue.query.filter(Venue.name.ilike(f'%{search_term}%')).all()
-  response['count'] = len(venues)
-  response['data'] = venues
+  response = search.search(Venue, search_term, app.config['SEARCH_LIMIT'])
   return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
+@app.route('/api/suggest')
+def suggestions():
+  # as-you-type suggestions for the venue and artist search boxes
+  kind = request.args.get('type')
+  limit = min(request.args.get('limit', 10, type=int), 50)
+  matches = suggest.suggest(request.args.get('q', ''), limit, kind)
+  return jsonify(suggestions=[
+    {"type": kind, "id": id, "name": name, "url": url_for(f'show_{kind}', **{f'{kind}_id': id})}
+    for kind, id, name in matches
+  ])
+
 @app.route('/venues/<int:venue_id>')
+@etags.conditional(etags.venue_version)
+@cache.cached('venue:{venue_id}')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
-  venue = Venue.query.get_or_404(venue_id)
-  data = {
-    "id": venue.id, 
-    "name": venue.name,
-    "genres": venue.genres,
-    "address": venue.address,
-    "city": venue.city,
-    "state": venue.state,
-    "phone": venue.phone,
-    "website": venue.website,
-    "facebook_link": venue.facebook_link,
-    "seeking_talent": venue.talent,
-    "seeking_description": venue.description,
-    "image_link": venue.image_link,
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 0
-  }
-  
-  for show in venue.shows:
-    if show.start_time <= datetime.now():
-      data['past_shows'].append({
-        "artist_id": show.artist_id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": show.start_time.strftime('%d-%m-%Y, %H:%M')
-      })
-      data['past_shows_count'] += 1
-    else:
-      data['upcoming_shows'].append({
-        "artist_id": show.artist_id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": show.start_time.strftime('%d-%m-%Y, %H:%M')
-      })
-      data['upcoming_shows_count'] += 1
-   
+  venue = Venue.query.options(*queries.load_profile('none')).get_or_404(venue_id)
+  data = queries.venue_detail(venue, datetime.now(), app.config['DETAIL_SHOWS_LIMIT'])
+  cache.tag(*(f"artist:{show['artist_id']}" for show in data['past_shows'] + data['upcoming_shows']))
   return render_template('pages/show_venue.html', venue=data)
+
+@app.route('/venues/<int:venue_id>/shows/<any(past, upcoming):partition>')
+def venue_shows(venue_id, partition):
+  # "load more" for a partition of the venue page, as JSON
+  return show_partition_json(queries.venue_shows_query(venue_id), partition)
   
 #  Create Venue
 #  ----------------------------------------------------------------
@@ -160,6 +233,11 @@ def create_venue_submission():
 
   # TODO: insert form data as a new Venue record in the db, instead
   # TODO: modify data to be the data object returned from db insertion
+  if writequeue.enabled():
+    write = queue_form(Venue)
+    if write:
+      flash('Venue ' + request.form.get('name', '') + ' will be listed shortly.')
+    return queued(render_template('pages/home.html'), write)
   error = False
   formdata = VenueForm(request.form)
   try:
@@ -182,7 +260,7 @@ def create_venue_submission():
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('%s failed', request.endpoint)
   finally:
     db.session.close()
     if error:
@@ -200,7 +278,7 @@ def delete_venue(venue_id):
   # SQLAlchemy ORM to delete a record. Handle cases where the session commit could fail.
   error = False
   try:
-    venue = Venue.Venue.query.get_or_404(venue_id)
+    venue = Venue.query.get_or_404(venue_id)
     db.session.delete(venue)
     db.session.commit()
     flash('Venue ' + venue.name + ' was successfully deleted!')
@@ -208,7 +286,7 @@ def delete_venue(venue_id):
     error = True
     flash('An error occurred. Venue ' + venue.name + ' could not be deleted.')
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('%s failed', request.endpoint)
   finally:
     db.session.close()
   return render_template('pages/home.html')
@@ -219,7 +297,7 @@ def delete_venue(venue_id):
 def edit_venue(venue_id):
   form = VenueForm()
   # TODO: populate form with values from venue with ID <venue_id>
-  venue = Venue.query.get_or_404(venue_id)
+  venue = Venue.query.options(*queries.load_profile('raise')).get_or_404(venue_id)
   form.name.data = venue.name
   form.city.data = venue.city
   form.state.data = venue.state
@@ -238,10 +316,17 @@ def edit_venue(venue_id):
 def edit_venue_submission(venue_id):
   # TODO: take values from the form submitted, and update existing
   # venue record with ID <venue_id> using the new attributes
+  if writequeue.enabled():
+    if db.session.query(Venue.id).filter_by(id=venue_id).scalar() is None:
+      abort(404)
+    write = queue_form(Venue, venue_id)
+    if write:
+      flash('Venue changes will be saved shortly.')
+    return queued(redirect(url_for('show_venue', venue_id=venue_id)), write)
   error = False
   formdata = request.form
   try:
-    venue = Venue.query.get_or_404(venue_id)
+    venue = Venue.query.options(*queries.load_profile('raise')).get_or_404(venue_id)
     venue.name = formdata['name']
     venue.city = formdata['city']
     venue.state = formdata['state']
@@ -257,7 +342,7 @@ def edit_venue_submission(venue_id):
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('%s failed', request.endpoint)
   finally:
     db.session.close()
   if error:
@@ -279,6 +364,11 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
   # called upon submitting the new artist listing form
+  if writequeue.enabled():
+    write = queue_form(Artist)
+    if write:
+      flash('Artist ' + request.form.get('name', '') + ' will be listed shortly.')
+    return queued(render_template('pages/home.html'), write)
   error = False
   formdata = ArtistForm(request.form)
   try:
@@ -299,7 +389,7 @@ def create_artist_submission():
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('%s failed', request.endpoint)
   finally:
     db.session.close()
   if error:
@@ -312,70 +402,43 @@ def create_artist_submission():
 #  Fetch, Search and Veiw Artists details
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@etags.conditional(etags.artists_version)
+@cache.cached('artists')
 def artists():
-  data = []
-  artists = Artist.query.all()
-  for artist in artists:
-    data.append({
-      "id": artist.id,
-      "name": artist.name
-    })
-  return render_template('pages/artists.html', artists=data)
+  after, before = page_cursors(queries.ARTIST_KEYS)
+  selection = facets.Selection.from_args(request.args)
+  filters = selection.filters(Artist)
+  facet_list = facets.facet_list(facets.counts(Artist, selection), selection)
+  if wants_stream():
+    artists = queries.artists_stream(after, filters)
+    return stream_template('pages/artists.html', artists=artists, selection=selection, facets=facet_list)
+  page = queries.artists_page(after, before, app.config['PAGE_SIZE'], filters)
+  return render_template('pages/artists.html', artists=page.items, page=page, selection=selection, facets=facet_list)
 
 @app.route('/artists/search', methods=['POST'])
 def search_artists():
   # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
   # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
   # search for "band" should return "The Wild Sax Band".
-  response = {}
   search_term = request.form.get('search_term', '')
-  artists = Artist.query.filter(Artist.name.ilike(f'%{search_term}%')).all()
-  response['count'] = len(artists)
-  response['data'] = artists
+  response = search.search(Artist, search_term, app.config['SEARCH_LIMIT'])
   return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@etags.conditional(etags.artist_version)
+@cache.cached('artist:{artist_id}')
 def show_artist(artist_id):
   # shows the artist page with the given artist_id
-  # TODO: replace with real artist data from the artist table, using artist_id
-  artist = Artist.query.get(artist_id)
-  data = {
-    "id": artist.id,
-    "name": artist.name,
-    "genres": artist.genres,
-    "city": artist.city,
-    "state": artist.state,
-    "phone": artist.phone,
-    "website": artist.website,
-    "facebook_link": artist.facebook_link,
-    "seeking_venue": artist.venue,
-    "seeking_description": artist.description,
-    "image_link": artist.image_link,
-    "past_shows": [],
-    "upcoming_shows": [],
-    "past_shows_count": 0,
-    "upcoming_shows_count": 0
-  }
-  print(past_shows_query)
-  for show in artist.shows:
-    if show.start_time < datetime.now():
-      data['past_shows'].append({
-        "venue_id": show.venue_id,
-        "venue_name": show.venue.name,
-        "venue_image_link": show.venue.image_link,
-        "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-      })
-      data['past_shows_count'] += 1
-    else:
-      data['upcoming_shows'].append({
-        "venue_id": show.venue_id,
-        "venue_name": show.venue.name,
-        "venue_image_link": show.venue.image_link,
-        "start_time": show.start_time.strftime('%Y-%m-%d %H:%M:%S')
-      })
-      data['upcoming_shows_count'] += 1
+  artist = Artist.query.options(*queries.load_profile('none')).get_or_404(artist_id)
+  data = queries.artist_detail(artist, datetime.now(), app.config['DETAIL_SHOWS_LIMIT'])
+  cache.tag(*(f"venue:{show['venue_id']}" for show in data['past_shows'] + data['upcoming_shows']))
   return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/shows/<any(past, upcoming):partition>')
+def artist_shows(artist_id, partition):
+  # "load more" for a partition of the artist page, as JSON
+  return show_partition_json(queries.artist_shows_query(artist_id), partition)
+
 #  Update Artists
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
@@ -383,7 +446,7 @@ def edit_artist(artist_id):
   
   form = ArtistForm()
 
-  artist = Artist.query.get_or_404(artist_id)
+  artist = Artist.query.options(*queries.load_profile('raise')).get_or_404(artist_id)
   form.name.data = artist.name
   form.city.data = artist.city
   form.state.data = artist.state
@@ -400,10 +463,17 @@ def edit_artist(artist_id):
 def edit_artist_submission(artist_id):
   
   # artist record with ID <artist_id> using the new attributes
+  if writequeue.enabled():
+    if db.session.query(Artist.id).filter_by(id=artist_id).scalar() is None:
+      abort(404)
+    write = queue_form(Artist, artist_id)
+    if write:
+      flash('Artist changes will be saved shortly.')
+    return queued(redirect(url_for('show_artist', artist_id=artist_id)), write)
   error = False
   formdata = request.form
   try:
-    artist = Artist.query.get_or_404(artist_id)
+    artist = Artist.query.options(*queries.load_profile('raise')).get_or_404(artist_id)
     artist.name = formdata['name']
     artist.city = formdata['city']
     artist.state = formdata['state']
@@ -418,7 +488,7 @@ def edit_artist_submission(artist_id):
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('%s failed', request.endpoint)
   finally:
     db.session.close()
   if error:
@@ -431,23 +501,79 @@ def edit_artist_submission(artist_id):
 #  Shows
 #  ----------------------------------------------------------------
 
+def show_query(args):
+  # the calendar filters of /shows, None without any; see calendars.py
+  if not any(arg in args for arg in calendars.FILTER_ARGS):
+    return None
+  try:
+    return calendars.ShowQuery.from_args(args, calendars.bucket())
+  except calendars.BadRange as error:
+    abort(400, str(error))
+
 @app.route('/shows')
+@calendars.bucketed(when=calendars.requested)
+@etags.conditional(etags.shows_version)
+@cache.cached('shows')
 def shows():
-  # displays list of shows at /shows
-  # TODO: replace with real venues data.
-  # num_shows should be aggregated based on number of upcoming shows per venue.
-  shows = Show.query.all()
-  data = []
-  for show in shows:
-    data.append({
-      "venue_id": show.venue_id,
-      "venue_name": show.venue.name,
-      "artist_id": show.artist_id,
-      "artist_name": show.artist.name,
-      "artist_image_link": show.artist.image_link,
-      "start_time": str(show.start_time)
-    })
-  return render_template('pages/shows.html', shows=data)
+  # displays list of shows at /shows, ordered by start time
+  # ?from= ?to= ?city= ?state= ?genre= narrow it to a time range and place
+  after, before = page_cursors(queries.SHOW_KEYS)
+  selection = show_query(request.args)
+  filters = selection.filters() if selection else ()
+  if wants_stream():
+    return stream_template('pages/shows.html', shows=queries.shows_stream(after, filters), selection=selection)
+  page = queries.shows_page(after, before, app.config['PAGE_SIZE'], filters)
+  return render_template('pages/shows.html', shows=page.items, page=page, selection=selection)
+
+@app.route('/shows/calendar')
+@calendars.bucketed()
+@etags.conditional(etags.shows_version)
+@cache.cached('shows')
+def shows_calendar():
+  # shows per day of ?month=YYYY-MM, narrowed by ?city= ?state= ?genre=
+  try:
+    first = calendars.parse_month(request.args.get('month'), calendars.bucket().date())
+    selection = calendars.ShowQuery.from_args(request.args, None)
+  except calendars.BadRange as error:
+    abort(400, str(error))
+  weeks = calendars.month_weeks(first)
+  counts = calendars.day_counts(weeks[0][0], weeks[-1][-1], selection)
+  months = {
+    'prev': (first - timedelta(days=1)).strftime('%Y-%m'),
+    'next': (first + timedelta(days=31)).strftime('%Y-%m'),
+  }
+  place_args = {arg: request.args.getlist(arg) for arg in ('city', 'state', 'genre')}
+  links = {
+    day: url_for('shows', **{'from': day.isoformat(), 'to': day.isoformat()}, **place_args)
+    for day in counts
+  }
+  return render_template(
+    'pages/shows_calendar.html',
+    first=first, weeks=weeks, counts=counts, links=links, months=months, place_args=place_args
+  )
+
+def show_feed(model, owner_column, entity_id):
+  now = calendars.bucket()
+  entity = db.session.query(model.name).filter(model.id == entity_id).one_or_none()
+  if entity is None:
+    abort(404)
+  rows = db.session.execute(calendars.feed_query(owner_column, entity_id, now))
+  venue_url = lambda show: url_for('show_venue', venue_id=show.venue_id, _external=True)
+  return Response(calendars.feed(entity.name, rows, request.host, venue_url), mimetype='text/calendar')
+
+@app.route('/venues/<int:venue_id>/shows.ics')
+@calendars.bucketed()
+@etags.conditional(etags.venue_version)
+def venue_calendar(venue_id):
+  # iCalendar feed of the venue's shows
+  return show_feed(Venue, Show.venue_id, venue_id)
+
+@app.route('/artists/<int:artist_id>/shows.ics')
+@calendars.bucketed()
+@etags.conditional(etags.artist_version)
+def artist_calendar(artist_id):
+  # iCalendar feed of the artist's shows
+  return show_feed(Artist, Show.artist_id, artist_id)
 
 @app.route('/shows/create')
 def create_shows():
@@ -460,25 +586,103 @@ def create_show_submission():
   error = False
   formdata = ShowForm(request.form)
   try:
+    venue = db.session.query(Venue.id, Venue.name).filter(Venue.id == int(formdata.venue_id.data)).one_or_none()
+    artist = db.session.query(Artist.id, Artist.name).filter(Artist.id == int(formdata.artist_id.data)).one_or_none()
+    missing = [
+      f'{kind} {field.data}'
+      for kind, field, row in (('venue', formdata.venue_id, venue), ('artist', formdata.artist_id, artist))
+      if row is None
+    ]
+    if missing:
+      flash('Show could not be listed: there is no ' + ' and no '.join(missing) + '.')
+      return render_template('pages/home.html')
+    # an unparseable time or duration is an error, not None or the default;
+    # a value that didn't parse is reported as such, not as missing
+    invalid = [field for field in (formdata.start_time, formdata.duration) if not field.validate(formdata)]
+    if invalid:
+      flash('Show could not be listed: ' + '; '.join(
+        f"{field.name}: {' '.join(field.process_errors or field.errors)}" for field in invalid
+      ))
+      return render_template('pages/home.html')
+    duration = formdata.duration.data
+    clash = intervals.find_conflict(venue.id, artist.id, formdata.start_time.data, duration)
+    if clash:
+      flash('Show could not be listed: ' + intervals.describe(*clash))
+      return render_template('pages/home.html')
+    if writequeue.enabled():
+      write = queue_form(Show)
+      if write:
+        flash('Show of ' + artist.name + ' at ' + venue.name + ' will be listed shortly.')
+      return queued(render_template('pages/home.html'), write)
     show = Show(
       venue_id = formdata.venue_id.data,
       artist_id = formdata.artist_id.data,
-      start_time = formdata.start_time.data 
+      start_time = formdata.start_time.data,
+      duration = duration
     )
     db.session.add(show)
     db.session.commit()
   except:
     error = True
     db.session.rollback()
-    print(sys.exc_info())
+    app.logger.exception('%s failed', request.endpoint)
   finally:
     db.session.close()
   if error:
     flash('An error occurred. Show could not be listed.')
   else:
-    flash('Show was successfully listed!')
+    flash('Show of ' + artist.name + ' at ' + venue.name + ' was successfully listed!')
   return render_template('pages/home.html')
 
+#  Import
+#  ----------------------------------------------------------------
+
+# Rejected rows returned in an upload's response; `flask import` writes
+# all of them to a file.
+IMPORT_REJECTS_SHOWN = 100
+
+@app.route('/import/<any(venues, artists, shows):kind>', methods=['POST'])
+def import_upload(kind):
+  # a CSV or NDJSON file in the `file` field, imported as it is read
+  upload = request.files.get('file')
+  if upload is None:
+    abort(400)
+  format = request.args.get('format') or importer.detect_format(upload.filename or '')
+  if format not in ('csv', 'ndjson'):
+    abort(400)
+  rejects = []
+
+  def on_reject(line, errors, record):
+    if len(rejects) < IMPORT_REJECTS_SHOWN:
+      rejects.append({'line': line, 'errors': errors, 'record': record})
+
+  stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+  result = importer.import_records(kind, importer.read_records(stream, format), on_reject=on_reject)
+  return jsonify(
+    records=result.records,
+    inserted=result.inserted,
+    rejected=result.rejected,
+    rejects=rejects
+  )
+
+#  Export
+#  ----------------------------------------------------------------
+
+@app.route('/export/<any(venues, artists, shows):kind>')
+def export(kind):
+  # the whole table, streamed; ?format=ndjson|csv|columnar, ?gzip=1
+  format = request.args.get('format', 'ndjson')
+  if format not in exporter.FORMATS:
+    abort(400)
+  gzip = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+  mimetype = 'application/gzip' if gzip else exporter.FORMATS[format][0]
+  response = Response(
+    stream_with_context(exporter.export(kind, format, gzip, app.config['EXPORT_CHUNK_SIZE'])),
+    mimetype=mimetype
+  )
+  response.headers['Content-Disposition'] = f'attachment; filename="{exporter.filename(kind, format, gzip)}"'
+  return response
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -489,13 +693,14 @@ def server_error(error):
 
 
 if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
     app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    if app.config['ERROR_LOG']:
+        file_handler = FileHandler(app.config['ERROR_LOG'])
+        file_handler.setFormatter(
+            Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+        )
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
@@ -0,0 +1,272 @@
+"""ASGI entry point: the read-heavy pages served with an async database driver.
+
+    uvicorn asgi:app --workers 4
+
+/venues, /artists (with their genre and state facets), /shows (with its
+calendar filters), the two searches and the venue and artist pages run
+here on an asyncpg engine, and the queries of one page that don't depend
+on each other run concurrently: a detail page fetches its entity and both
+show partitions at the same time, an empty search its count and its
+listing. They are the statements the Flask views run (queries.py,
+search.py), rendered with the same templates, so both entry points answer
+alike. Rendering and the first build of the facet indexes are blocking
+work, done in the thread pool. Every other route is the Flask app,
+mounted as WSGI.
+
+Not carried over: the page cache, conditional GETs, /metrics timings and
+streamed listings (?stream=1), which stay on the Flask side.
+"""
+import asyncio
+from datetime import datetime
+from urllib.parse import parse_qs
+from flask import render_template, session
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.responses import HTMLResponse
+from starlette.routing import Mount, Route
+from app import app as flask_app
+from models import Venue, Artist
+import queries
+import search
+import facets
+import calendars
+import events
+import counters
+
+#----------------------------------------------------------------------------#
+# Database.
+#----------------------------------------------------------------------------#
+
+def async_url(config):
+    url = config.get('ASYNC_DATABASE_URI')
+    if url:
+        return url
+    return make_url(config['SQLALCHEMY_DATABASE_URI']).set(drivername='postgresql+asyncpg')
+
+
+engine = create_async_engine(
+    async_url(flask_app.config),
+    pool_size=flask_app.config['ASYNC_POOL_SIZE'],
+    max_overflow=flask_app.config['ASYNC_POOL_SIZE'] // 2,
+)
+
+
+async def fetch_all(stmt):
+    # one connection per statement, so statements gathered together run
+    # at the same time
+    async with engine.connect() as conn:
+        return (await conn.execute(stmt)).all()
+
+
+async def fetch_one(stmt):
+    async with engine.connect() as conn:
+        return (await conn.execute(stmt)).one_or_none()
+
+
+async def fetch_scalar(stmt):
+    async with engine.connect() as conn:
+        return (await conn.execute(stmt)).scalar()
+
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def render_flask(request, template, context):
+    # the templates use url_for, request.endpoint and flashed messages,
+    # so they are rendered inside a Flask request context for this URL,
+    # with its session cookie; showing a flashed message pops it from the
+    # session, whose new cookie is returned with the page
+    with flask_app.test_request_context(
+        request.url.path, method=request.method, query_string=request.url.query,
+        headers={'Cookie': request.headers.get('cookie', '')},
+    ):
+        body = render_template(template, **context)
+        response = flask_app.response_class()
+        if session.modified:
+            flask_app.session_interface.save_session(flask_app, session, response)
+        return body, response.headers.getlist('Set-Cookie')
+
+
+async def render(request, template, status_code=200, **context):
+    body, cookies = await run_in_threadpool(render_flask, request, template, context)
+    response = HTMLResponse(body, status_code=status_code)
+    for cookie in cookies:
+        response.headers.append('set-cookie', cookie)
+    return response
+
+
+async def not_found(request):
+    return await render(request, 'errors/404.html', status_code=404)
+
+
+class BadCursor(Exception):
+    pass
+
+
+def page_cursors(request, keys):
+    after = request.query_params.get('after')
+    before = request.query_params.get('before')
+    for cursor in (after, before):
+        if cursor is not None:
+            try:
+                queries.decode_cursor(cursor, keys)
+            except ValueError:
+                raise BadCursor(cursor)
+    return after, before
+
+
+async def keyset_page(stmt, keys, after, before):
+    limit = flask_app.config['PAGE_SIZE']
+    rows = await fetch_all(queries.keyset_query(stmt, keys, after, before, limit))
+    return queries.keyset_rows(rows, keys, after, before, limit)
+
+
+#----------------------------------------------------------------------------#
+# Listings.
+#----------------------------------------------------------------------------#
+
+def facet_context(request, model):
+    # the in-process bitmap counts; only their first build reads the database
+    selection = facets.Selection.from_args(request.query_params)
+    with flask_app.app_context():
+        counts = facets.counts(model, selection)
+    return selection, {'selection': selection, 'facets': facets.facet_list(counts, selection)}
+
+
+async def venues(request):
+    after, before = page_cursors(request, queries.VENUE_AREA_KEYS)
+    selection, context = await run_in_threadpool(facet_context, request, Venue)
+    stmt = queries.venue_areas_query().where(*selection.filters(Venue))
+    page = await keyset_page(stmt, queries.VENUE_AREA_KEYS, after, before)
+    page.items = list(queries.group_areas(page.items))
+    return await render(request, 'pages/venues.html', areas=page.items, page=page, **context)
+
+
+async def artists(request):
+    after, before = page_cursors(request, queries.ARTIST_KEYS)
+    selection, context = await run_in_threadpool(facet_context, request, Artist)
+    stmt = queries.artists_query().where(*selection.filters(Artist))
+    page = await keyset_page(stmt, queries.ARTIST_KEYS, after, before)
+    return await render(request, 'pages/artists.html', artists=page.items, page=page, **context)
+
+
+async def shows(request):
+    after, before = page_cursors(request, queries.SHOW_KEYS)
+    selection = None
+    if any(arg in request.query_params for arg in calendars.FILTER_ARGS):
+        seconds = flask_app.config['CALENDAR_BUCKET_SECONDS']
+        selection = calendars.ShowQuery.from_args(
+            request.query_params, calendars.bucket_start(datetime.now(), seconds)
+        )
+    stmt = queries.shows_query().where(*(selection.filters() if selection else ()))
+    page = await keyset_page(stmt, queries.SHOW_KEYS, after, before)
+    return await render(request, 'pages/shows.html', shows=page.items, page=page, selection=selection)
+
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+async def run_search(model, term):
+    limit = flask_app.config['SEARCH_LIMIT']
+    term = term.strip()
+    if not term:
+        count, listing = search.browse_queries(model, limit)
+        total, rows = await asyncio.gather(fetch_scalar(count), fetch_all(listing))
+        return search.search_page(total, search.browse_results(rows))
+    rows = await fetch_all(search.search_query(model, term, limit))
+    return search.search_page(*search.search_results(rows))
+
+
+async def search_term(request):
+    # the search forms are urlencoded, no need for a multipart parser
+    form = parse_qs((await request.body()).decode())
+    return form.get('search_term', [''])[0]
+
+
+async def search_venues(request):
+    term = await search_term(request)
+    results = await run_search(Venue, term)
+    return await render(request, 'pages/search_venues.html', results=results, search_term=term)
+
+
+async def search_artists(request):
+    term = await search_term(request)
+    results = await run_search(Artist, term)
+    return await render(request, 'pages/search_artists.html', results=results, search_term=term)
+
+
+#----------------------------------------------------------------------------#
+# Detail pages.
+#----------------------------------------------------------------------------#
+
+async def detail(model, fields, shows_stmt, id):
+    # the entity and both show partitions, concurrently; None if no entity
+    now, limit = datetime.now(), flask_app.config['DETAIL_SHOWS_LIMIT']
+    row, *partitions = await asyncio.gather(
+        fetch_one(select(*fields.values()).where(model.id == id)),
+        *(
+            fetch_all(queries.show_partition_query(shows_stmt, partition, now, limit=limit))
+            for partition in queries.PARTITIONS
+        )
+    )
+    if row is None:
+        return None
+    data = queries.fields_data(row, fields)
+    for partition, rows in zip(queries.PARTITIONS, partitions):
+        queries.set_show_partition(data, partition, queries.keyset_rows(rows, queries.SHOW_KEYS, limit=limit))
+    return data
+
+
+async def show_venue(request):
+    venue_id = request.path_params['venue_id']
+    data = await detail(Venue, queries.VENUE_FIELDS, queries.venue_shows_query(venue_id), venue_id)
+    if data is None:
+        return await not_found(request)
+    return await render(request, 'pages/show_venue.html', venue=data)
+
+
+async def show_artist(request):
+    artist_id = request.path_params['artist_id']
+    data = await detail(Artist, queries.ARTIST_FIELDS, queries.artist_shows_query(artist_id), artist_id)
+    if data is None:
+        return await not_found(request)
+    return await render(request, 'pages/show_artist.html', artist=data)
+
+
+#----------------------------------------------------------------------------#
+# Application.
+#----------------------------------------------------------------------------#
+
+async def bad_request(request, exc):
+    return HTMLResponse('Bad Request', status_code=400)
+
+
+def follow_changes():
+    # the Flask hooks that start it don't run for the routes above
+    with flask_app.app_context():
+        events.follower.start()
+        if counters.roller is not None:
+            counters.roller.start()
+
+
+app = Starlette(
+    routes=[
+        Route('/venues', venues),
+        Route('/venues/search', search_venues, methods=['POST']),
+        Route('/venues/{venue_id:int}', show_venue),
+        Route('/artists', artists),
+        Route('/artists/search', search_artists, methods=['POST']),
+        Route('/artists/{artist_id:int}', show_artist),
+        Route('/shows', shows),
+        Mount('/', WSGIMiddleware(flask_app)),
+    ],
+    exception_handlers={BadCursor: bad_request, calendars.BadRange: bad_request},
+    on_startup=[follow_changes],
+    on_shutdown=[engine.dispose],
+)
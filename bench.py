@@ -0,0 +1,633 @@
+"""Micro-benchmarks for the hot paths.
+
+    python bench.py search --database-url postgresql://.../fyyur_bench --rows 1000000
+    python bench.py suggest --names 100000
+    python bench.py facets --rows 1000000
+    python bench.py matching --artists 500000
+    python bench.py datetime --timestamps 100000
+    python bench.py export --database-url postgresql://.../fyyur_bench --shows 10000000
+    python bench.py plans --database-url postgresql://.../fyyur_bench --shows 1000000
+    python bench.py routes --database-url postgresql://.../fyyur_bench --seed-scale 1m --output run.json
+    python bench.py routes --database-url ... --http http://127.0.0.1:5000 --compare run.json
+
+Benchmarks that need a database only run against the URL given on the
+command line, never the one in config.py, and may insert synthetic rows.
+Each benchmark prints latency percentiles and exits non-zero when p99 is
+over its budget.
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+
+#----------------------------------------------------------------------------#
+# Helpers.
+#----------------------------------------------------------------------------#
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+
+def report(name, samples, budget_ms=None):
+    ms = [sample * 1000 for sample in samples]
+    p50, p95, p99 = (percentile(ms, p) for p in (50, 95, 99))
+    line = f'{name}: n={len(ms)} p50={p50:.3f}ms p95={p95:.3f}ms p99={p99:.3f}ms'
+    if budget_ms is not None:
+        line += f' (budget p99 <= {budget_ms}ms)'
+    print(line)
+    return budget_ms is None or p99 <= budget_ms
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def random_word(rng, length=None):
+    length = length or rng.randint(3, 10)
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(length)).capitalize()
+
+
+def random_name(rng):
+    return ' '.join(random_word(rng) for _ in range(rng.randint(1, 4)))
+
+
+def bench_app(database_url):
+    from app import app
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
+    return app
+
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+SEED_VENUES_SQL = '''
+INSERT INTO "Venue" (name, city, state, address, phone, genres, talent, updated_at)
+SELECT
+  initcap(substr(md5(i::text), 1, 6)) || ' ' || initcap(substr(md5(i::text), 7, 8)) || ' Hall',
+  (ARRAY['Austin', 'New York', 'San Francisco', 'Chicago', 'Nashville'])[1 + i % 5],
+  (ARRAY['TX', 'NY', 'CA', 'IL', 'TN'])[1 + i % 5],
+  i || ' Main St',
+  '555-555-5555',
+  ARRAY[(ARRAY['Jazz', 'Blues', 'Rock n Roll', 'Folk', 'Pop'])[1 + i % 5]],
+  i % 3 = 0,
+  now()
+FROM generate_series(:start, :stop) AS i
+'''
+
+
+def bench_search(args):
+    import search
+    from models import db, Venue
+    rng = random.Random(args.seed)
+    terms = [random_word(rng, rng.randint(3, 6)).lower() for _ in range(args.queries)]
+    terms += ['hall', 'austin', 'jazz', 'tx']
+
+    app = bench_app(args.database_url)
+    with app.app_context():
+        existing = db.session.query(db.func.count(Venue.id)).scalar()
+        if existing < args.rows:
+            db.session.execute(db.text(SEED_VENUES_SQL), {'start': existing + 1, 'stop': args.rows})
+            db.session.commit()
+            db.session.execute(db.text('ANALYZE "Venue"'))
+        for term in terms[:10]:
+            search.search(Venue, term, args.limit)  # warm up
+        samples = [timed(search.search, Venue, term, args.limit) for term in terms]
+        return report(f'search postgres rows={max(existing, args.rows)}', samples, args.budget_ms)
+
+
+#----------------------------------------------------------------------------#
+# Typeahead.
+#----------------------------------------------------------------------------#
+
+def bench_suggest(args):
+    import suggest
+    rng = random.Random(args.seed)
+    index = suggest.PrefixIndex(max_bytes=args.max_bytes)
+    index.build((id, random_name(rng)) for id in range(args.names))
+    prefixes = [random_word(rng, rng.randint(1, 4)).lower() for _ in range(args.queries)]
+    for prefix in prefixes[:100]:
+        index.suggest(prefix)  # warm up
+    samples = [timed(index.suggest, prefix) for prefix in prefixes]
+    print(f'suggest index: {len(index.entries)} names, {len(index.keys)} keys, '
+          f'~{index.bytes // 1024} KiB{" (truncated)" if index.truncated else ""}')
+    return report(f'suggest names={args.names}', samples, args.budget_ms)
+
+
+#----------------------------------------------------------------------------#
+# Facet counts.
+#----------------------------------------------------------------------------#
+
+def facet_rows(rng, count):
+    # (id, state, genres) drawn like seed.py's artists
+    import seed
+    cities, genres = seed.Zipf(len(seed.CITIES), 1.1), seed.Zipf(len(seed.GENRES), 0.9)
+    for id in range(1, count + 1):
+        yield id, seed.CITIES[cities.draw(rng)][1], seed._genres(rng, genres)
+
+
+def random_selection(rng):
+    import facets
+    return facets.Selection(
+        rng.sample(facets.GENRES, rng.choice((0, 1, 1, 2, 3))),
+        rng.sample(facets.STATES, rng.choice((0, 0, 1, 2))),
+    )
+
+
+def bench_facets(args):
+    import facets
+    rng = random.Random(args.seed)
+    index = facets.BitmapIndex()
+    rows = list(facet_rows(rng, args.rows))
+    build = timed(index.build, rows, args.rows)
+    selections = [random_selection(rng) for _ in range(args.queries)]
+    for selection in selections[:20]:
+        index.counts(selection)  # warm up
+    samples = [timed(index.counts, selection) for selection in selections]
+    size = sum(sys.getsizeof(bits) for bits in index.bitmaps.values()) + sys.getsizeof(index.rows)
+    print(f'facet index: {args.rows} rows, {len(index.bitmaps)} bitmaps, ~{size // 1024} KiB, '
+          f'built in {build:.2f}s')
+    return report(f'facet counts rows={args.rows}', samples, args.budget_ms)
+
+
+#----------------------------------------------------------------------------#
+# Matchmaking.
+#----------------------------------------------------------------------------#
+
+def candidate_rows(rng, count, seeking):
+    # (id, city, state, genres, seeking) drawn like seed.py's artists
+    import seed
+    cities, genres = seed.Zipf(len(seed.CITIES), 1.1), seed.Zipf(len(seed.GENRES), 0.9)
+    for id in range(1, count + 1):
+        city, state = seed.CITIES[cities.draw(rng)]
+        yield id, city, state, seed._genres(rng, genres), rng.random() < seeking
+
+
+def bench_matching(args):
+    import matching
+    rng = random.Random(args.seed)
+    pool = matching.Pool()
+    rows = list(candidate_rows(rng, args.artists, args.seeking))
+    build = timed(pool.build, rows)
+    # venues to rank for: a random catalogue row's place and genres, and a
+    # co-booking history of up to 50 artists
+    subjects = [
+        (*rng.choice(rows)[1:4], {rng.randint(1, args.artists): rng.randint(1, 10) for _ in range(rng.randint(0, 50))})
+        for _ in range(args.queries)
+    ]
+    for city, state, genres, history in subjects[:20]:
+        pool.top(genres, city, state, history, args.limit)  # warm up
+    samples = [
+        timed(pool.top, genres, city, state, history, args.limit)
+        for city, state, genres, history in subjects
+    ]
+    print(f'matching pool: {args.artists} artists, {pool.size} seeking, built in {build:.2f}s')
+    return report(f'matching top-{args.limit} artists={args.artists}', samples, args.budget_ms)
+
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#----------------------------------------------------------------------------#
+
+def legacy_format_datetime(value, format='medium'):
+    # the filter as it was: parse the string, resolve pattern and locale
+    import babel.dates
+    import dateutil.parser
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def bench_datetime(args):
+    import datetime
+    import formatting
+    rng = random.Random(args.seed)
+    start = datetime.datetime(2019, 1, 1)
+    # shows start on the hour or half hour, so a listing repeats values
+    values = [
+        start + datetime.timedelta(minutes=30 * rng.randrange(args.distinct))
+        for _ in range(args.timestamps)
+    ]
+    strings = [value.isoformat() for value in values]
+
+    def run(fn, items):
+        return [timed(fn, item, args.format) for item in items]
+
+    for value, string in zip(values[:1000], strings):
+        expected = legacy_format_datetime(string, args.format)
+        if formatting.format_datetime(value, args.format) != expected:
+            print(f'output differs for {string}: {formatting.format_datetime(value, args.format)!r} != {expected!r}')
+            return False
+
+    legacy = run(legacy_format_datetime, strings)
+    formatting.format_datetime.cache_clear()
+    cold = run(formatting.format_datetime.__wrapped__, values)
+    cached = run(formatting.format_datetime, values)
+    report('datetime legacy (string)', legacy)
+    report('datetime compiled (datetime, no memo)', cold)
+    ok = report('datetime compiled + memo (datetime)', cached, args.budget_ms)
+    total = sum(legacy) / sum(cached)
+    print(f'{args.timestamps} timestamps, {args.distinct} distinct: {total:.1f}x faster than legacy')
+    return ok
+
+
+#----------------------------------------------------------------------------#
+# Export.
+#----------------------------------------------------------------------------#
+
+SEED_ARTISTS_SQL = '''
+INSERT INTO "Artist" (name, city, state, phone, genres, venue, updated_at)
+SELECT 'Artist ' || i, 'Austin', 'TX', '555-555-5555', ARRAY['Jazz'], false, now()
+FROM generate_series(:start, :stop) AS i
+'''
+
+SEED_SHOWS_SQL = '''
+INSERT INTO "Show" (venue_id, artist_id, start_time, updated_at)
+SELECT
+  (SELECT min(id) FROM "Venue") + i % :venues,
+  (SELECT min(id) FROM "Artist") + i % :artists,
+  timestamp '2020-01-01' + i * interval '17 minutes',
+  now()
+FROM generate_series(:start, :stop) AS i
+'''
+
+
+def rss_bytes():
+    # current resident set size; Linux only, falls back to the peak
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def seed_catalogue(venues, artists, shows):
+    # tops the tables up to the given row counts; returns the show count
+    from models import db, Venue, Artist, Show
+    count = lambda model: db.session.query(db.func.count(model.id)).scalar()
+    seeds = ((Venue, SEED_VENUES_SQL, venues), (Artist, SEED_ARTISTS_SQL, artists))
+    for model, sql, rows in seeds:
+        existing = count(model)
+        if existing < rows:
+            db.session.execute(db.text(sql), {'start': existing + 1, 'stop': rows})
+    existing = count(Show)
+    if existing < shows:
+        db.session.execute(db.text(SEED_SHOWS_SQL), {
+            'start': existing + 1, 'stop': shows, 'venues': venues, 'artists': artists
+        })
+    db.session.commit()
+    return max(existing, shows)
+
+
+def peak_rss_bytes():
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def bench_export(args):
+    import exporter
+    from models import db
+    app = bench_app(args.database_url)
+    with app.app_context():
+        total = seed_catalogue(1000, 1000, args.shows)
+
+        start, written, samples = time.perf_counter(), 0, []
+        for piece in exporter.export('shows', args.format, args.gzip, args.chunk_size):
+            written += len(piece)
+            samples.append(rss_bytes())
+        seconds = time.perf_counter() - start
+        db.session.remove()
+
+    # the first chunks warm up the encoder and the cursor's buffers
+    baseline = samples[min(len(samples) - 1, 2)]
+    growth = (max(samples) - baseline) / 2 ** 20
+    print(f'export shows rows={total} format={args.format}{" gzip" if args.gzip else ""}: '
+          f'{seconds:.1f}s, {total / seconds:,.0f} rows/s, {written / 2 ** 20:,.1f} MiB written')
+    print(f'rss: {baseline / 2 ** 20:.1f} MiB after warm-up, peak {max(samples) / 2 ** 20:.1f} MiB, '
+          f'growth {growth:.1f} MiB (budget {args.budget_mb} MiB)')
+    return growth <= args.budget_mb
+
+
+#----------------------------------------------------------------------------#
+# Query plans.
+#----------------------------------------------------------------------------#
+
+def bench_plans(args):
+    # every route's SELECTs on a catalogue big enough for the planner to
+    # choose between an index and a sequential scan
+    import commands
+    import counters
+    from models import db
+    app = bench_app(args.database_url)
+    with app.app_context():
+        seed_catalogue(args.venues, args.artists, args.shows)
+        counters.rebuild()
+        for table in commands.PLAN_TABLES:
+            db.session.execute(db.text(f'ANALYZE "{table}"'))
+        db.session.commit()
+        db.session.remove()
+    ok = True
+    for endpoint, plans, failures in commands.check_query_plans(app):
+        slowest = max((plan.get('Actual Total Time', 0) for _, plan in plans), default=0)
+        print(f'{endpoint}: {len(plans)} plans, slowest {slowest:.3f}ms '
+              + ('FAIL ' + '; '.join(failures) if failures else 'ok'))
+        ok = ok and not failures
+    return ok
+
+
+#----------------------------------------------------------------------------#
+# Routes.
+#----------------------------------------------------------------------------#
+
+# Values tried for the `any(...)` URL arguments.
+ROUTE_ARGUMENTS = {
+    'partition': ('past', 'upcoming'),
+    'kind': ('venues', 'artists', 'shows'),
+}
+
+# Routes that read whole tables get fewer requests than --requests.
+ROUTE_REQUESTS = {'export': 2}
+
+# Routes that change data, only run with --writes; delete_venue never is,
+# it would remove what the other routes read.
+WRITE_ENDPOINTS = {
+    'create_venue_submission', 'create_artist_submission', 'create_show_submission',
+    'edit_venue_submission', 'edit_artist_submission', 'import_upload',
+}
+# api.write_status needs the key of a queued write, the benchmark queues none.
+SKIPPED_ENDPOINTS = {'static', 'delete_venue', 'api.write_status'}
+
+
+def form_data(endpoint, kind, rng, ids):
+    # a valid submission for a write route, or the search form
+    import seed
+    cities, genres = seed.Zipf(len(seed.CITIES)), seed.Zipf(len(seed.GENRES))
+    if endpoint in ('search_venues', 'search_artists'):
+        return {'search_term': rng.choice(['hall', 'blue', 'jazz', 'new york', 'tx'])}
+    if endpoint == 'create_show_submission':
+        when = datetime.now() + timedelta(days=rng.randint(1, 300))
+        return {'venue_id': ids['venue_id'], 'artist_id': ids['artist_id'],
+                'start_time': when.strftime('%Y-%m-%d %H:%M:%S')}
+    if endpoint == 'import_upload':
+        values = seed.venue_values if kind == 'venues' else seed.artist_values
+        if kind == 'shows':
+            rows = [form_data('create_show_submission', None, rng, ids) for _ in range(10)]
+        else:
+            rows = [values(rng, cities, genres) for _ in range(10)]
+            for row in rows:
+                row['genres'] = ';'.join(row['genres'])
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+        return {'file': (io.BytesIO(out.getvalue().encode()), f'{kind}.csv')}
+    fields = (seed.venue_values if 'venue' in endpoint else seed.artist_values)(rng, cities, genres)
+    # BooleanFields are sent only when checked
+    return {key: value for key, value in fields.items() if value is not False}
+
+
+def route_cases(app, ids, writes):
+    # (name, endpoint, method, url, kind) for every route of the app
+    from flask import url_for
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.endpoint):
+        if rule.endpoint in SKIPPED_ENDPOINTS or (rule.endpoint in WRITE_ENDPOINTS and not writes):
+            continue
+        method = sorted(rule.methods - {'HEAD', 'OPTIONS'})[0]
+        choices = [ROUTE_ARGUMENTS[arg] for arg in rule.arguments if arg in ROUTE_ARGUMENTS]
+        for picked in itertools.product(*choices):
+            values = dict(ids, **dict(zip([arg for arg in rule.arguments if arg in ROUTE_ARGUMENTS], picked)))
+            with app.test_request_context():
+                url = url_for(rule.endpoint, **{arg: values[arg] for arg in rule.arguments})
+            name = rule.endpoint + ''.join(f'[{value}]' for value in picked)
+            yield name, rule.endpoint, method, url, values.get('kind')
+
+
+def sample_ids():
+    # the busiest venue and artist (the skew makes them the slowest pages)
+    # and the newest show
+    from models import db, Venue, Artist, Show
+    busiest = lambda model: db.session.query(model.id).order_by(
+        (model.upcoming_shows_count + model.past_shows_count).desc(), model.id
+    ).limit(1).scalar() or 1
+    return {
+        'venue_id': busiest(Venue),
+        'artist_id': busiest(Artist),
+        'show_id': db.session.query(db.func.max(Show.id)).scalar() or 1,
+    }
+
+
+def summary(samples, queries=None):
+    ms = [sample * 1000 for sample in samples]
+    result = {'n': len(ms)}
+    if ms:
+        result.update({f'p{p}_ms': round(percentile(ms, p), 3) for p in (50, 95, 99)})
+    if queries:
+        result['queries'] = round(sum(queries) / len(queries), 2)
+        result['queries_max'] = max(queries)
+    return result
+
+
+def bench_routes(args):
+    import cache
+    from collections import Counter
+    from instrumentation import count_queries
+    from models import db
+    app = bench_app(args.database_url)
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['SLOW_REQUEST_MS'] = 0
+    if not args.cache:
+        cache.backend = None
+    with app.app_context():
+        if args.seed_scale:
+            import seed
+            seed.seed(seed.SCALES[args.seed_scale], random_seed=args.seed)
+        ids = sample_ids()
+        database = {table: db.session.execute(db.text(f'SELECT count(*) FROM "{table}"')).scalar()
+                    for table in ('Venue', 'Artist', 'Show')}
+        db.session.remove()
+    print('catalogue: ' + ', '.join(f'{count} {table}' for table, count in database.items()))
+
+    rng = random.Random(args.seed)
+    client = app.test_client()
+    client.get('/')  # builds the in-process indexes
+    results = {'started': datetime.now().isoformat(timespec='seconds'), 'git': git_revision(),
+               'database': database, 'routes': {}, 'http': {}}
+    cases = list(route_cases(app, ids, args.writes))
+    for name, endpoint, method, url, kind in cases:
+        requests = ROUTE_REQUESTS.get(endpoint, args.requests)
+        samples, queries, statuses = [], [], Counter()
+        for number in range(args.warmup + requests):
+            data = form_data(endpoint, kind, rng, ids) if method == 'POST' else None
+            with count_queries() as counter:
+                start = time.perf_counter()
+                response = client.open(url, method=method, data=data)
+                response.get_data()  # streamed bodies are produced here
+                elapsed = time.perf_counter() - start
+            if number >= args.warmup:
+                samples.append(elapsed)
+                queries.append(counter.count)
+                statuses[response.status_code] += 1
+        result = summary(samples, queries)
+        result.update(method=method, url=url, statuses=dict(statuses), rss_mb=round(rss_bytes() / 2 ** 20, 1))
+        results['routes'][name] = result
+        print(f"{name:<40} p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+              f"p99={result['p99_ms']:.2f}ms queries={result['queries']} rss={result['rss_mb']}MiB "
+              + ' '.join(f'{status}x{count}' for status, count in sorted(statuses.items())))
+
+    if args.http:
+        import asyncio
+        import loadtest
+        base = args.http.rstrip('/')
+        for name, endpoint, method, url, kind in cases:
+            if endpoint in WRITE_ENDPOINTS or endpoint in ROUTE_REQUESTS:
+                continue
+            spec = url
+            if method == 'POST':
+                spec = f"POST {url} search_term={form_data(endpoint, kind, rng, ids)['search_term'].replace(' ', '+')}"
+            stats = asyncio.run(loadtest.run(base, [spec], args.concurrency, args.duration))
+            result = summary(stats['latencies'])
+            result.update(rps=round(len(stats['latencies']) / args.duration, 1),
+                          errors=stats['errors'], failed=stats['failed'])
+            results['http'][name] = result
+            print(f"http {name:<35} {result['rps']} req/s p50={result.get('p50_ms', 0):.1f}ms "
+                  f"p99={result.get('p99_ms', 0):.1f}ms errors={result['errors']} >=400={result['failed']}")
+
+    results['peak_rss_mb'] = round(peak_rss_bytes() / 2 ** 20, 1)
+    if args.output:
+        with open(args.output, 'w') as out:
+            json.dump(results, out, indent=2, sort_keys=True)
+        print(f'results written to {args.output}')
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), results)
+    return all(
+        not any(status >= 500 for status in result['statuses'])
+        for result in results['routes'].values()
+    )
+
+
+def compare(before, after):
+    # p50 and p99 ratios (after / before) and query count changes per route
+    print(f"compared with {before.get('git')} of {before.get('started')}:")
+    for section in ('routes', 'http'):
+        for name, now in after[section].items():
+            then = before.get(section, {}).get(name)
+            if not then or 'p50_ms' not in then or 'p50_ms' not in now:
+                continue
+            line = (f"{'http ' if section == 'http' else ''}{name:<40} p50 {then['p50_ms']:.2f} -> {now['p50_ms']:.2f}ms "
+                    f"({now['p50_ms'] / (then['p50_ms'] or 1):.2f}x), "
+                    f"p99 {then['p99_ms']:.2f} -> {now['p99_ms']:.2f}ms")
+            if 'queries' in then:
+                line += f", queries {then['queries']} -> {now['queries']}"
+            print(line)
+
+
+def git_revision():
+    import subprocess
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+#----------------------------------------------------------------------------#
+# Command line.
+#----------------------------------------------------------------------------#
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=1)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('search', help='venue search latency')
+    cmd.add_argument('--database-url')
+    cmd.add_argument('--rows', type=int, default=1000000)
+    cmd.add_argument('--queries', type=int, default=500)
+    cmd.add_argument('--limit', type=int, default=50)
+    cmd.add_argument('--budget-ms', type=float, default=5)
+    cmd.set_defaults(run=bench_search, needs_database=lambda args: True)
+
+    cmd = commands.add_parser('suggest', help='typeahead prefix lookups')
+    cmd.add_argument('--names', type=int, default=100000)
+    cmd.add_argument('--queries', type=int, default=10000)
+    cmd.add_argument('--max-bytes', type=int, default=None)
+    cmd.add_argument('--budget-ms', type=float, default=1)
+    cmd.set_defaults(run=bench_suggest, needs_database=lambda args: False)
+
+    cmd = commands.add_parser('facets', help='genre and state facet counts from the bitmap index')
+    cmd.add_argument('--rows', type=int, default=1000000)
+    cmd.add_argument('--queries', type=int, default=1000)
+    cmd.add_argument('--budget-ms', type=float, default=10)
+    cmd.set_defaults(run=bench_facets, needs_database=lambda args: False)
+
+    cmd = commands.add_parser('matching', help='ranking seeking artists for a venue')
+    cmd.add_argument('--artists', type=int, default=500000)
+    cmd.add_argument('--queries', type=int, default=500)
+    cmd.add_argument('--limit', type=int, default=20)
+    cmd.add_argument('--seeking', type=float, default=0.4, help='share of artists seeking a venue')
+    cmd.add_argument('--budget-ms', type=float, default=10)
+    cmd.set_defaults(run=bench_matching, needs_database=lambda args: False)
+
+    cmd = commands.add_parser('export', help='streaming export memory and throughput')
+    cmd.add_argument('--database-url')
+    cmd.add_argument('--shows', type=int, default=10000000)
+    cmd.add_argument('--format', default='ndjson', choices=['ndjson', 'csv', 'columnar'])
+    cmd.add_argument('--gzip', action='store_true')
+    cmd.add_argument('--chunk-size', type=int, default=5000)
+    cmd.add_argument('--budget-mb', type=float, default=16)
+    cmd.set_defaults(run=bench_export, needs_database=lambda args: True)
+
+    cmd = commands.add_parser('plans', help="no sequential scans in any route's queries")
+    cmd.add_argument('--database-url')
+    cmd.add_argument('--venues', type=int, default=10000)
+    cmd.add_argument('--artists', type=int, default=10000)
+    cmd.add_argument('--shows', type=int, default=1000000)
+    cmd.set_defaults(run=bench_plans, needs_database=lambda args: True)
+
+    cmd = commands.add_parser('routes', help='every route: latency, queries per request and memory')
+    cmd.add_argument('--database-url')
+    cmd.add_argument('--seed-scale', choices=['1k', '10k', '100k', '1m', '10m'],
+                     help='add a synthetic catalogue of this size first (see seed.py)')
+    cmd.add_argument('--requests', type=int, default=50, help='per route')
+    cmd.add_argument('--warmup', type=int, default=3, help='untimed requests per route')
+    cmd.add_argument('--writes', action='store_true', help='also run the create, edit and import routes')
+    cmd.add_argument('--cache', action='store_true', help='keep the rendered page cache on')
+    cmd.add_argument('--http', metavar='URL', help='also load a running server with loadtest.py')
+    cmd.add_argument('--concurrency', type=int, default=50)
+    cmd.add_argument('--duration', type=float, default=5, help='seconds per route over HTTP')
+    cmd.add_argument('--output', help='write the results as JSON')
+    cmd.add_argument('--compare', metavar='JSON', help='results of an earlier run to compare with')
+    cmd.set_defaults(run=bench_routes, needs_database=lambda args: True)
+
+    cmd = commands.add_parser('datetime', help='the datetime template filter')
+    cmd.add_argument('--timestamps', type=int, default=100000)
+    cmd.add_argument('--distinct', type=int, default=2000, help='distinct half hours to draw from')
+    cmd.add_argument('--format', default='full')
+    cmd.add_argument('--budget-ms', type=float, default=0.05)
+    cmd.set_defaults(run=bench_datetime, needs_database=lambda args: False)
+
+    args = parser.parse_args(argv)
+    if args.needs_database(args) and not args.database_url:
+        parser.error(f'{args.command} needs --database-url')
+    return 0 if args.run(args) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
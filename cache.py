@@ -0,0 +1,250 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, g, make_response, request, session
+import events
+
+#----------------------------------------------------------------------------#
+# Rendered page cache.
+#
+# GET pages are stored under their path and query string together with a
+# set of tags naming what they show ('venues', 'venue:3', 'artist:7'...).
+# A commit touching a Venue, Artist or Show drops every page carrying one
+# of its tags, so an edit only costs the pages that actually show it. TTL
+# bounds how stale the past/upcoming split can get as shows start.
+# Commits made by other processes drop their pages too, once the change
+# log has been read (events.Follower); a page behind an ETag is stored
+# under its version as well, so it is never served with a newer one.
+#
+# CACHE_BACKEND picks the store: 'memory' is a per-process LRU, 'sqlite'
+# is a file shared by every worker on the host, so an invalidation in one
+# worker is seen by all of them.
+#----------------------------------------------------------------------------#
+
+class MemoryBackend:
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, tags, expires)
+        self.tags = {}                # tag -> {key, ...}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                self._drop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, tags):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            self._drop(key)
+            self.entries[key] = (value, tags, time.monotonic() + self.ttl)
+            self.bytes += len(value)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add(key)
+            while self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def invalidate(self, tags):
+        with self.lock:
+            for tag in tags:
+                for key in list(self.tags.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+            self.bytes = 0
+
+    def _drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        value, tags, _ = entry
+        self.bytes -= len(value)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+class SQLiteBackend:
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,
+        expires REAL NOT NULL, used REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+    CREATE TABLE IF NOT EXISTS tags (tag TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (tag, key));
+    CREATE INDEX IF NOT EXISTS tags_key ON tags (key);
+    '''
+
+    def __init__(self, path, max_bytes, ttl):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self):
+        # one connection per thread, and a fresh one after fork
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        conn = self._connect()
+        row = conn.execute(
+            'SELECT value FROM entries WHERE key = ? AND expires > ?', (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute('UPDATE entries SET used = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def set(self, key, value, tags):
+        if len(value) > self.max_bytes:
+            return
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM tags WHERE key = ?', (key,))
+            conn.execute(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value), now + self.ttl, now)
+            )
+            conn.executemany('INSERT OR IGNORE INTO tags VALUES (?, ?)', [(tag, key) for tag in tags])
+            conn.execute('DELETE FROM entries WHERE expires <= ?', (now,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                # least recently used first, until the store fits again
+                conn.execute('''
+                    DELETE FROM entries WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY used DESC) AS kept FROM entries
+                        ) WHERE kept > ?
+                    )''', (self.max_bytes,))
+            conn.execute('DELETE FROM tags WHERE key NOT IN (SELECT key FROM entries)')
+
+    def invalidate(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        conn = self._connect()
+        marks = ', '.join('?' * len(tags))
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute(f'DELETE FROM entries WHERE key IN (SELECT key FROM tags WHERE tag IN ({marks}))', tags)
+            conn.execute('DELETE FROM tags WHERE key NOT IN (SELECT key FROM entries)')
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM entries')
+            conn.execute('DELETE FROM tags')
+
+
+backend = None
+
+
+def init_app(app):
+    global backend
+    kind = app.config.get('CACHE_BACKEND')
+    max_bytes, ttl = app.config['CACHE_MAX_BYTES'], app.config['CACHE_TTL']
+    if kind == 'memory':
+        backend = MemoryBackend(max_bytes, ttl)
+    elif kind == 'sqlite':
+        backend = SQLiteBackend(app.config['CACHE_PATH'], max_bytes, ttl)
+    elif kind:
+        raise ValueError(f'unknown CACHE_BACKEND: {kind!r}')
+
+
+#  Views
+#  ----------------------------------------------------------------
+
+def tag(*tags):
+    # called by a view to name further entities its page shows
+    g.setdefault('cache_tags', set()).update(tags)
+
+
+def cacheable():
+    # pages carrying a flashed message are one-offs
+    return (
+        backend is not None
+        and request.method == 'GET'
+        and '_flashes' not in session
+    )
+
+
+def cached(*tags):
+    # tags may use the view's arguments: cached('venues', 'venue:{venue_id}')
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if not cacheable():
+                return view(**kwargs)
+            key = request.full_path
+            if g.get('cache_version'):
+                key = f'{key}#{g.cache_version}'
+            body = backend.get(key)
+            if body is not None:
+                response = current_app.response_class(body, mimetype='text/html')
+                response.headers['X-Cache'] = 'hit'
+                return response
+            response = make_response(view(**kwargs))
+            if response.status_code == 200 and not response.is_streamed and '_flashes' not in session:
+                page_tags = {tag.format(**kwargs) for tag in tags} | g.pop('cache_tags', set())
+                backend.set(key, response.get_data(), page_tags)
+                response.headers['X-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
+
+
+#  Invalidation
+#  ----------------------------------------------------------------
+
+def change_tags(change):
+    name = change.model.__name__.lower()
+    if name == 'show':
+        tags = {'shows', 'venues'}
+        for column in ('venue_id', 'artist_id'):
+            if change.values.get(column) is not None:
+                tags.add(f"{column[:-3]}:{change.values[column]}")
+        return tags
+    return {f'{name}:{change.id}', f'{name}s', 'shows'}
+
+
+@events.on_change
+def _invalidate(changes):
+    if backend is None:
+        return
+    tags = set()
+    for change in changes:
+        if change.op == 'reset':
+            backend.clear()
+            return
+        tags |= change_tags(change)
+    backend.invalidate(tags)
@@ -0,0 +1,374 @@
+import calendar
+from datetime import date, datetime, time, timedelta
+from functools import wraps
+from flask import current_app, g, make_response, request
+from sqlalchemy import Date, cast, event, func, inspect, select
+from sqlalchemy.dialects.postgresql import array, insert
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Show, ShowDay
+from enums import Genre
+import counters
+
+#----------------------------------------------------------------------------#
+# Show calendars.
+#
+# /shows?from=&to=&city=&state=&genre= lists the shows in a time range,
+# a keyset page at a time off the (start_time, id) index; /shows/calendar
+# counts them per day of a month from ShowDay, the number of shows per day
+# in each venue city, kept up to date by every flush that adds, removes or
+# moves a show (and by imports, through `apply()`), so a month costs at
+# most 31 rows per city. Counts filtered by genre are aggregated from Show
+# over the month's index range instead. Venues and artists have an
+# iCalendar feed of their shows around now.
+#
+# Calendar responses are the same for every request within a time bucket
+# of CALENDAR_BUCKET_SECONDS: ranges open at "now" start at the bucket, and
+# browsers and proxies may keep them until the bucket ends.
+#----------------------------------------------------------------------------#
+
+FILTER_ARGS = ('from', 'to', 'city', 'state', 'genre')
+
+GENRES = {genre.value for genre in Genre}
+
+# The days around now a venue or artist feed covers, and its most events.
+FEED_PAST_DAYS = 30
+FEED_DAYS = 365
+FEED_LIMIT = 500
+
+
+class BadRange(ValueError):
+    pass
+
+
+#  Time buckets
+#  ----------------------------------------------------------------
+
+def bucket_start(now, seconds):
+    midnight = datetime.combine(now.date(), time())
+    return midnight + timedelta(seconds=int((now - midnight).total_seconds()) // seconds * seconds)
+
+
+def bucket():
+    # the start of the current request's bucket
+    if 'calendar_bucket' not in g:
+        g.calendar_bucket = bucket_start(datetime.now(), current_app.config['CALENDAR_BUCKET_SECONDS'])
+    return g.calendar_bucket
+
+
+def bucketed(when=None):
+    # public caching until the end of the bucket, for the requests when()
+    # accepts (all of them by default); outside etags.conditional, so 304s
+    # get it too
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            response = make_response(view(**kwargs))
+            if response.status_code in (200, 304) and (when is None or when()):
+                end = bucket() + timedelta(seconds=current_app.config['CALENDAR_BUCKET_SECONDS'])
+                response.cache_control.no_cache = None
+                response.cache_control.public = True
+                response.cache_control.max_age = max(1, int((end - datetime.now()).total_seconds()))
+            return response
+        return wrapper
+    return decorator
+
+
+def requested():
+    return any(arg in request.args for arg in FILTER_ARGS)
+
+
+#  Filters
+#  ----------------------------------------------------------------
+
+def parse_time(value, name, end=False):
+    # an ISO 8601 date or time, offsets dropped like the forms do; a date
+    # alone ending a range takes in that whole day
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        try:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+        except ValueError:
+            raise BadRange(f'{name} must be an ISO 8601 date or time')
+    return datetime.combine(day + timedelta(days=1 if end else 0), time())
+
+
+class ShowQuery:
+    # the calendar filters of a request; a row matches when it is in the
+    # city, in any of the states and its artist has any of the genres
+
+    def __init__(self, start=None, end=None, city=None, states=(), genres=(), args=None):
+        self.start, self.end = start, end
+        self.city = city
+        self.states = list(states)
+        self.genres = [genre for genre in genres if genre in GENRES]
+        self.args = args or {}
+
+    @classmethod
+    def from_args(cls, args, default_start):
+        # from defaults to default_start, so an open range lists what is on
+        # from now; raises BadRange
+        start = parse_time(args['from'], 'from') if args.get('from') else default_start
+        end = parse_time(args['to'], 'to', end=True) if args.get('to') else None
+        if start is not None and end is not None and end <= start:
+            raise BadRange('to must be after from')
+        return cls(
+            start, end,
+            city=(args.get('city') or '').strip() or None,
+            states=[state.strip().upper() for state in args.getlist('state') if state.strip()],
+            genres=args.getlist('genre'),
+            # url_for arguments that keep the filters, for the pager
+            args={arg: args.getlist(arg) for arg in FILTER_ARGS if arg in args},
+        )
+
+    def __bool__(self):
+        return bool(self.args)
+
+    def place_filters(self, city, state):
+        clauses = []
+        if self.city:
+            clauses.append(city == self.city)
+        if self.states:
+            clauses.append(state.in_(self.states))
+        return clauses
+
+    def filters(self):
+        # WHERE clauses for queries.shows_query(), which joins Venue and Artist
+        clauses = self.place_filters(Venue.city, Venue.state)
+        if self.start is not None:
+            clauses.append(Show.start_time >= self.start)
+        if self.end is not None:
+            clauses.append(Show.start_time < self.end)
+        if self.genres:
+            clauses.append(Artist.genres.op('&&')(cast(array(self.genres), Artist.genres.type)))
+        return clauses
+
+
+#  Month view
+#  ----------------------------------------------------------------
+
+def parse_month(value, today):
+    # 'YYYY-MM', this month when missing
+    if not value:
+        return today.replace(day=1)
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        return date(year, month, 1)
+    except ValueError:
+        raise BadRange('month must be YYYY-MM')
+
+
+def month_weeks(first):
+    # the weeks on a month's page, Monday first, padded with the days of
+    # the months around it
+    return calendar.Calendar().monthdatescalendar(first.year, first.month)
+
+
+def day_counts(first, last, query):
+    # {date: shows} for the days first..last matching query's place and
+    # genre filters
+    if query.genres:
+        day = cast(Show.start_time, Date)
+        stmt = (
+            select(day, func.count(Show.id))
+            .join(Venue, Venue.id == Show.venue_id)
+            .join(Artist, Artist.id == Show.artist_id)
+            .where(
+                Show.start_time >= datetime.combine(first, time()),
+                Show.start_time < datetime.combine(last + timedelta(days=1), time()),
+                *ShowQuery(genres=query.genres).filters(),
+                *query.place_filters(Venue.city, Venue.state),
+            )
+            .group_by(day)
+        )
+    else:
+        stmt = (
+            select(ShowDay.day, func.sum(ShowDay.shows))
+            .where(ShowDay.day >= first, ShowDay.day <= last)
+            .where(*query.place_filters(ShowDay.city, ShowDay.state))
+            .group_by(ShowDay.day)
+        )
+    return {day: int(count) for day, count in db.session.execute(stmt) if count}
+
+
+#  Day counts
+#  ----------------------------------------------------------------
+
+def _venue_places(session, venue_ids):
+    # {venue_id: (city, state)}, from the session where it holds the venue
+    # (a venue deleted in this flush is no longer in the table)
+    places = {}
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Venue) and obj.id in venue_ids:
+            places[obj.id] = (obj.city, obj.state)
+    missing = set(venue_ids) - places.keys()
+    if missing:
+        rows = session.execute(select(Venue.id, Venue.city, Venue.state).where(Venue.id.in_(missing)))
+        places.update((id, (city, state)) for id, city, state in rows)
+    return places
+
+
+def _add(session, deltas):
+    # deltas are {(day, state, city): shows}, in key order so concurrent
+    # writers lock rows in the same order
+    table = ShowDay.__table__
+    rows = [
+        {'day': day, 'state': state, 'city': city, 'shows': shows}
+        for (day, state, city), shows in sorted(deltas.items()) if shows
+    ]
+    if rows:
+        stmt = insert(table)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=['day', 'state', 'city'], set_={'shows': table.c.shows + stmt.excluded.shows}
+            ),
+            rows
+        )
+
+
+def apply(session, shows):
+    # shows are (+1 or -1, venue_id, artist_id, start_time), as for
+    # counters.apply
+    shows = list(shows)
+    if not shows:
+        return
+    places = _venue_places(session, {venue_id for _, venue_id, _, _ in shows})
+    deltas = {}
+    for sign, venue_id, _, start_time in shows:
+        if venue_id in places:
+            city, state = places[venue_id]
+            key = (start_time.date(), state, city)
+            deltas[key] = deltas.get(key, 0) + sign
+    _add(session, deltas)
+
+
+def _moved_venues(session):
+    # (venue_id, old (city, state), new (city, state)) of edited venues
+    for obj in session.dirty:
+        if not isinstance(obj, Venue):
+            continue
+        state = inspect(obj)
+        old = tuple(
+            state.attrs[key].history.deleted[0] if state.attrs[key].history.deleted else getattr(obj, key)
+            for key in ('city', 'state')
+        )
+        if old != (obj.city, obj.state):
+            yield obj.id, old, (obj.city, obj.state)
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_days(session, flush_context):
+    apply(session, counters.flushed_shows(session))
+    deltas = {}
+    for venue_id, (old_city, old_state), (city, state) in _moved_venues(session):
+        day = cast(Show.start_time, Date)
+        for shows_day, shows in session.execute(
+            select(day, func.count(Show.id)).where(Show.venue_id == venue_id).group_by(day)
+        ):
+            for key, sign in (((shows_day, old_state, old_city), -1), ((shows_day, state, city), 1)):
+                deltas[key] = deltas.get(key, 0) + sign * shows
+    _add(session, deltas)
+
+
+def _counted():
+    day = cast(Show.start_time, Date)
+    return (
+        select(day.label('day'), Venue.state, Venue.city, func.count(Show.id).label('shows'))
+        .join(Venue, Venue.id == Show.venue_id)
+        .group_by(day, Venue.state, Venue.city)
+    )
+
+
+def check():
+    # ((day, state, city), stored, counted) for every wrong day count
+    stored = {
+        (row.day, row.state, row.city): row.shows
+        for row in db.session.execute(select(ShowDay).where(ShowDay.shows != 0)).scalars()
+    }
+    counted = {(row.day, row.state, row.city): row.shows for row in db.session.execute(_counted())}
+    db.session.rollback()
+    return [
+        (key, stored.get(key, 0), counted.get(key, 0))
+        for key in sorted(stored.keys() | counted.keys()) if stored.get(key, 0) != counted.get(key, 0)
+    ]
+
+
+def rebuild():
+    # recounts every day from the Show table
+    db.session.execute(ShowDay.__table__.delete())
+    db.session.execute(insert(ShowDay.__table__).from_select(['day', 'state', 'city', 'shows'], _counted()))
+    db.session.commit()
+
+
+#  iCalendar feeds
+#  ----------------------------------------------------------------
+
+def feed_query(owner_column, owner_id, now):
+    # a venue's or artist's shows from FEED_PAST_DAYS ago, oldest first: a
+    # range of the (owner, start_time) index
+    return (
+        select(
+            Show.id, Show.venue_id, Show.start_time, Show.duration, Show.updated_at,
+            Venue.name.label('venue_name'), Venue.address, Venue.city, Venue.state,
+            Artist.name.label('artist_name'),
+        )
+        .join(Venue, Venue.id == Show.venue_id)
+        .join(Artist, Artist.id == Show.artist_id)
+        .where(
+            owner_column == owner_id,
+            Show.start_time >= now - timedelta(days=FEED_PAST_DAYS),
+            Show.start_time < now + timedelta(days=FEED_DAYS),
+        )
+        .order_by(Show.start_time, Show.id)
+        .limit(FEED_LIMIT)
+    )
+
+
+def ics_text(value):
+    return (value or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def ics_time(value):
+    # floating local time, as start_time is stored
+    return value.strftime('%Y%m%dT%H%M%S')
+
+
+def fold(line):
+    # content lines are at most 75 octets, continued after a space
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line
+    parts, start = [], 0
+    while start < len(encoded):
+        end = min(start + (75 if not parts else 74), len(encoded))
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1  # not inside a UTF-8 sequence
+        parts.append(encoded[start:end].decode())
+        start = end
+    return '\r\n '.join(parts)
+
+
+def feed(name, shows, host, show_url):
+    # an iCalendar document of shows, rows of feed_query()
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Fyyur//Shows//EN',
+        'CALSCALE:GREGORIAN',
+        f'X-WR-CALNAME:{ics_text(name)}',
+    ]
+    for show in shows:
+        end = show.start_time + timedelta(minutes=show.duration)
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:show-{show.id}@{host}',
+            f'DTSTAMP:{ics_time(show.updated_at)}Z',
+            f'DTSTART:{ics_time(show.start_time)}',
+            f'DTEND:{ics_time(end)}',
+            f'SUMMARY:{ics_text(f"{show.artist_name} at {show.venue_name}")}',
+            f'LOCATION:{ics_text(", ".join(filter(None, (show.address, show.city, show.state))))}',
+            f'URL:{show_url(show)}',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ''.join(fold(line) + '\r\n' for line in lines)
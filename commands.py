@@ -0,0 +1,263 @@
+import json
+import os
+import sys
+import time
+import click
+from flask import url_for
+from models import db, Venue, Artist
+from instrumentation import count_queries
+import importer
+import exporter
+import counters
+import calendars
+import seed
+
+#----------------------------------------------------------------------------#
+# CLI commands, registered on the app with `init_app(app)`.
+#----------------------------------------------------------------------------#
+
+# endpoint -> (method, statement budget, may the route read the Show table)
+QUERY_BUDGETS = {
+    'index': ('GET', 0, False),
+    'venues': ('GET', 2, True),
+    'search_venues': ('POST', 1, False),
+    'show_venue': ('GET', 4, True),
+    'edit_venue': ('GET', 1, False),
+    'artists': ('GET', 2, False),
+    'search_artists': ('POST', 1, False),
+    'show_artist': ('GET', 4, True),
+    'edit_artist': ('GET', 1, False),
+    'shows': ('GET', 2, True),
+    'shows_calendar': ('GET', 2, True),
+    'venue_calendar': ('GET', 3, True),
+    'artist_calendar': ('GET', 3, True),
+    'api.venues': ('GET', 1, False),
+    'api.venue': ('GET', 1, False),
+    'api.artists': ('GET', 1, False),
+    'api.artist': ('GET', 1, False),
+    'api.shows': ('GET', 1, True),
+}
+
+
+def route_statements(app, budgets=QUERY_BUDGETS, search_term='a'):
+    # Runs every budgeted route through the test client against the
+    # configured database and yields (endpoint, response, counter).
+    with app.app_context():
+        venue = db.session.query(Venue.id).order_by(Venue.id).first()
+        artist = db.session.query(Artist.id).order_by(Artist.id).first()
+        db.session.remove()
+    ids = {
+        'venue_id': venue.id if venue else 1,
+        'artist_id': artist.id if artist else 1,
+    }
+    client = app.test_client()
+    # the first request builds the in-process indexes, not part of any route
+    client.get('/')
+    for endpoint, (method, budget, reads_shows) in budgets.items():
+        rule = next(app.url_map.iter_rules(endpoint))
+        with app.test_request_context():
+            url = url_for(endpoint, **{arg: ids[arg] for arg in rule.arguments})
+        with count_queries() as counter:
+            response = client.open(url, method=method, data={'search_term': search_term})
+        yield endpoint, response, counter
+
+
+def check_query_budgets(app, budgets=QUERY_BUDGETS):
+    # yields (endpoint, counter, failures)
+    for endpoint, response, counter in route_statements(app, budgets):
+        method, budget, reads_shows = budgets[endpoint]
+        failures = []
+        if response.status_code >= 400:
+            failures.append(f'status {response.status_code}')
+        if counter.count > budget:
+            failures.append(f'{counter.count} statements, budget is {budget}')
+        if not reads_shows and counter.touches('Show'):
+            failures.append('reads the Show table')
+        yield endpoint, counter, failures
+
+
+# Tables no route may read with a sequential scan.
+PLAN_TABLES = ('Venue', 'Artist', 'Show')
+
+
+def seq_scans(plan):
+    # relations read by a sequential scan anywhere in an EXPLAIN plan
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+def check_query_plans(app, budgets=QUERY_BUDGETS, tables=PLAN_TABLES):
+    # Runs EXPLAIN ANALYZE on every SELECT the budgeted routes issue and
+    # yields (endpoint, [(statement, plan)], failures). Only meaningful on
+    # a database large enough for the planner to prefer indexes, see
+    # `python bench.py plans`. Searches use a term long enough for the
+    # trigram indexes.
+    for endpoint, response, counter in route_statements(app, budgets, search_term='hall'):
+        plans, failures = [], []
+        if response.status_code >= 400:
+            failures.append(f'status {response.status_code}')
+        with app.app_context():
+            connection = db.session.connection()
+            for statement, parameters in zip(counter.statements, counter.parameters):
+                if not statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+                    continue
+                explained = connection.exec_driver_sql('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, parameters)
+                plan = explained.scalar()[0]['Plan']
+                plans.append((statement, plan))
+                scanned = sorted({table for table in seq_scans(plan) if table in tables})
+                if scanned:
+                    failures.append(f"seq scan on {', '.join(scanned)}: {' '.join(statement.split())[:120]}")
+            db.session.rollback()
+            db.session.remove()
+        yield endpoint, plans, failures
+
+
+def plan_lines(plan, depth=0):
+    # one line per node: type, relation or index, actual time and rows
+    target = plan.get('Index Name') or plan.get('Relation Name') or ''
+    yield (f"{'  ' * depth}{plan['Node Type']} {target}".rstrip()
+           + f" ({plan.get('Actual Total Time', 0):.3f}ms, {plan.get('Actual Rows', 0)} rows)")
+    for child in plan.get('Plans', ()):
+        yield from plan_lines(child, depth + 1)
+
+
+def init_app(app):
+
+    @app.cli.command('query-counts')
+    @click.option('--verbose', is_flag=True, help='Print every statement.')
+    def query_counts(verbose):
+        """Count the SQL statements each route issues and check the budgets."""
+        failed = False
+        for endpoint, counter, failures in check_query_budgets(app):
+            status = 'FAIL ' + '; '.join(failures) if failures else 'ok'
+            click.echo(f'{endpoint:<16} {counter.count:>3} statements  {status}')
+            if verbose:
+                for statement in counter.statements:
+                    click.echo('    ' + ' '.join(statement.split()))
+            failed = failed or bool(failures)
+        if failed:
+            sys.exit(1)
+
+    @app.cli.command('query-plans')
+    @click.option('--verbose', is_flag=True, help='Print every plan.')
+    def query_plans(verbose):
+        """EXPLAIN ANALYZE each route's queries and fail on sequential scans."""
+        failed = False
+        for endpoint, plans, failures in check_query_plans(app):
+            status = 'FAIL ' + '; '.join(failures) if failures else 'ok'
+            click.echo(f'{endpoint:<16} {len(plans):>3} plans  {status}')
+            if verbose:
+                for statement, plan in plans:
+                    click.echo('    ' + ' '.join(statement.split()))
+                    for line in plan_lines(plan):
+                        click.echo('      ' + line)
+            failed = failed or bool(failures)
+        if failed:
+            sys.exit(1)
+
+    @app.cli.command('import')
+    @click.argument('kind', type=click.Choice(sorted(importer.KINDS)))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', type=click.Choice(['csv', 'ndjson']), help='Default: from the file extension.')
+    @click.option('--chunk-size', default=importer.CHUNK_SIZE, show_default=True)
+    @click.option('--checkpoint', help='Default: PATH.checkpoint')
+    @click.option('--rejects', help='Default: PATH.rejects.ndjson')
+    @click.option('--restart', is_flag=True, help='Ignore the checkpoint and start over.')
+    def import_file(kind, path, format, chunk_size, checkpoint, rejects, restart):
+        """Import venues, artists or shows from a CSV or NDJSON file."""
+        checkpoint = checkpoint or f'{path}.checkpoint'
+        rejects = rejects or f'{path}.rejects.ndjson'
+        if restart and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        resuming = os.path.exists(checkpoint)
+        with open(path, newline='', encoding='utf-8') as stream, \
+                open(rejects, 'a' if resuming else 'w') as rejected:
+
+            def on_reject(line, errors, record):
+                rejected.write(json.dumps({'line': line, 'errors': errors, 'record': record}, default=str) + '\n')
+
+            try:
+                result = importer.import_records(
+                    kind, importer.read_records(stream, format or importer.detect_format(path)),
+                    chunk_size, on_reject, checkpoint, importer.source_of(path)
+                )
+            except ValueError as error:
+                raise click.ClickException(str(error))
+        if result.skipped:
+            click.echo(f'resumed after {result.skipped} records')
+        click.echo(f'{result.records} records: {result.inserted} inserted, {result.rejected} rejected')
+        if result.rejected:
+            click.echo(f'rejected rows: {rejects}')
+
+    @app.cli.command('export')
+    @click.argument('kind', type=click.Choice(sorted(importer.KINDS)))
+    @click.argument('path', type=click.Path(dir_okay=False, writable=True), default='-')
+    @click.option('--format', type=click.Choice(sorted(exporter.FORMATS)), default='ndjson', show_default=True)
+    @click.option('--gzip', is_flag=True, help='Default: when PATH ends in .gz')
+    @click.option('--chunk-size', default=lambda: app.config['EXPORT_CHUNK_SIZE'], type=int)
+    def export_file(kind, path, format, gzip, chunk_size):
+        """Export venues, artists or shows to PATH, or stdout."""
+        gzip = gzip or path.endswith('.gz')
+        with click.open_file(path, 'wb') as out:
+            for piece in exporter.export(kind, format, gzip, chunk_size):
+                out.write(piece)
+
+    @app.cli.command('seed')
+    @click.option('--scale', type=click.Choice(list(seed.SCALES)), default='1k', show_default=True,
+                  help='Number of shows; venues and artists scale with it.')
+    @click.option('--shows', type=int, help='Overrides --scale.')
+    @click.option('--venues', type=int)
+    @click.option('--artists', type=int)
+    @click.option('--random-seed', default=1, show_default=True)
+    @click.option('--reset', is_flag=True, help='Delete every venue, artist and show first.')
+    def seed_catalogue(scale, shows, venues, artists, random_seed, reset):
+        """Add a synthetic catalogue of venues, artists and shows."""
+        if reset:
+            click.confirm('Delete every venue, artist and show?', abort=True)
+            seed.reset()
+        start = time.perf_counter()
+        added = seed.seed(shows or seed.SCALES[scale], venues, artists, random_seed)
+        click.echo('{} venues, {} artists, {} shows added in {:.1f}s'.format(*added, time.perf_counter() - start))
+
+    @app.cli.group('counters')
+    def counters_group():
+        """Upcoming and past show counters of venues and artists, shows per day."""
+
+    @counters_group.command('roll')
+    def counters_roll():
+        """Move the shows that have started from upcoming to past.
+
+        The app does it every COUNTERS_ROLL_SECONDS; with that unset, run
+        it every minute or so from cron, the venue listing counts upcoming
+        shows as of its last run.
+        """
+        click.echo(f'{counters.roll()} shows moved to past')
+
+    @counters_group.command('check')
+    @click.option('--repair', is_flag=True, help='Rebuild the counters if any are wrong.')
+    def counters_check(repair):
+        """Compare the counters with a count of the Show table."""
+        mismatches = counters.check()
+        for model, id, stored, counted in mismatches:
+            click.echo(f'{model.__tablename__} {id}: upcoming/past {stored[0]}/{stored[1]}, counted {counted[0]}/{counted[1]}')
+        click.echo(f'{len(mismatches)} wrong counters')
+        days = calendars.check()
+        for (day, state, city), stored, counted in days:
+            click.echo(f'{day} {city}, {state}: {stored} shows, counted {counted}')
+        click.echo(f'{len(days)} wrong day counts')
+        mismatches += days
+        if mismatches and repair:
+            counters.rebuild()
+            calendars.rebuild()
+            click.echo('counters rebuilt')
+        elif mismatches:
+            sys.exit(1)
+
+    @counters_group.command('rebuild')
+    def counters_rebuild():
+        """Recount every counter from the Show table."""
+        counters.rebuild()
+        calendars.rebuild()
+        click.echo('counters rebuilt')
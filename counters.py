@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, event, func, inspect, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Show, CounterClock
+
+#----------------------------------------------------------------------------#
+# Upcoming and past show counters.
+#
+# Venue and Artist carry upcoming_shows_count and past_shows_count, split
+# around the time on the 'shows' CounterClock row rather than around now.
+# Every flush that adds, removes or moves a Show (cascading deletes
+# included) adjusts the counters of its venue and artist in the same
+# transaction; bulk imports call `apply()` themselves. `roll()` moves the
+# shows that started since the clock from upcoming to past and advances
+# the clock; a thread in each process runs it once the clock is older than
+# COUNTERS_ROLL_SECONDS (`flask counters roll` does it by hand). Writers
+# share-lock the clock row and roll locks it exclusively, so a show is
+# never split against a clock that is moving under it.
+#
+# `check()` compares the counters with a count of the Show table and
+# `rebuild()` recomputes all of them.
+#----------------------------------------------------------------------------#
+
+CLOCK = 'shows'
+
+# owner model -> the Show column pointing at it
+OWNERS = {Venue: Show.venue_id, Artist: Show.artist_id}
+
+
+def clock(session, exclusive=False):
+    # the clock's time, locked until the end of the transaction
+    stmt = select(CounterClock.as_of).where(CounterClock.name == CLOCK)
+    as_of = session.execute(stmt.with_for_update(read=not exclusive)).scalar()
+    if as_of is None:
+        # a database created without the migration: no shows counted yet
+        session.execute(
+            insert(CounterClock.__table__)
+            .values(name=CLOCK, as_of=datetime.now())
+            .on_conflict_do_nothing(index_elements=['name'])
+        )
+        as_of = session.execute(stmt.with_for_update(read=not exclusive)).scalar()
+    return as_of
+
+
+def _counter_update(model):
+    table = model.__table__
+    return (
+        update(table)
+        .where(table.c.id == bindparam('owner'))
+        .values(
+            upcoming_shows_count=table.c.upcoming_shows_count + bindparam('upcoming'),
+            past_shows_count=table.c.past_shows_count + bindparam('past'),
+            # counters are not edits of the row
+            updated_at=table.c.updated_at,
+        )
+    )
+
+
+def apply(session, shows):
+    # shows are (+1 or -1, venue_id, artist_id, start_time)
+    shows = list(shows)
+    if not shows:
+        return
+    as_of = clock(session)
+    deltas = {model: {} for model in OWNERS}
+    for sign, venue_id, artist_id, start_time in shows:
+        for model, owner_id in ((Venue, venue_id), (Artist, artist_id)):
+            counts = deltas[model].setdefault(owner_id, [0, 0])
+            counts[start_time <= as_of] += sign
+    for model, owners in deltas.items():
+        # in id order, so concurrent writers lock rows in the same order
+        rows = [
+            {'owner': owner_id, 'upcoming': upcoming, 'past': past}
+            for owner_id, (upcoming, past) in sorted(owners.items())
+            if upcoming or past
+        ]
+        if rows:
+            session.execute(_counter_update(model), rows)
+
+
+def _show_values(obj, committed=False):
+    state = inspect(obj)
+    values = []
+    for key in ('venue_id', 'artist_id', 'start_time'):
+        history = state.attrs[key].history
+        if committed and history.deleted:
+            values.append(history.deleted[0])
+        elif committed and history.unchanged:
+            values.append(history.unchanged[0])
+        else:
+            values.append(getattr(obj, key))
+    return tuple(values)
+
+
+def flushed_shows(session):
+    # (+1 or -1, venue_id, artist_id, start_time) for the shows a flush
+    # added, removed or moved; calendars.py counts them too
+    shows = []
+    for obj in session.new:
+        if isinstance(obj, Show):
+            shows.append((1, *_show_values(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Show):
+            shows.append((-1, *_show_values(obj, committed=True)))
+    for obj in session.dirty:
+        if isinstance(obj, Show):
+            before, after = _show_values(obj, committed=True), _show_values(obj)
+            if before != after:
+                shows += [(-1, *before), (1, *after)]
+    return shows
+
+
+@event.listens_for(Session, 'after_flush')
+def _count_flushed(session, flush_context):
+    apply(session, flushed_shows(session))
+
+
+#  Rolling forward
+#  ----------------------------------------------------------------
+
+def roll(now=None):
+    # moves the shows that started since the clock to past; returns how
+    # many shows moved
+    now = now or datetime.now()
+    as_of = clock(db.session, exclusive=True)
+    if now <= as_of:
+        db.session.rollback()
+        return 0
+    started = (Show.start_time > as_of, Show.start_time <= now)
+    moved = db.session.execute(select(func.count(Show.id)).where(*started)).scalar()
+    for model, owner in OWNERS.items():
+        table = model.__table__
+        counts = (
+            select(owner.label('owner'), func.count(Show.id).label('moved'))
+            .where(*started)
+            .group_by(owner)
+            .subquery()
+        )
+        db.session.execute(
+            update(table)
+            .where(table.c.id == counts.c.owner)
+            .values(
+                upcoming_shows_count=table.c.upcoming_shows_count - counts.c.moved,
+                past_shows_count=table.c.past_shows_count + counts.c.moved,
+                updated_at=table.c.updated_at,
+            )
+        )
+    db.session.execute(update(CounterClock).where(CounterClock.name == CLOCK).values(as_of=now))
+    db.session.commit()
+    return moved
+
+
+class Roller:
+    # the thread of each process that keeps the clock within interval of
+    # now; processes that find it due together roll in turn, the later
+    # ones moving the few shows started meanwhile
+
+    def __init__(self, app, interval):
+        self.app = app
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def start(self):
+        # started on first use after a fork
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='counter-roll', daemon=True)
+            self.thread.start()
+
+    def due(self, now):
+        as_of = db.session.execute(select(CounterClock.as_of).where(CounterClock.name == CLOCK)).scalar()
+        db.session.rollback()
+        return as_of is None or now - as_of >= timedelta(seconds=self.interval)
+
+    def _run(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    if self.due(datetime.now()):
+                        roll()
+            except Exception:
+                self.app.logger.exception('counter roll failed')
+            time.sleep(self.interval / 4)
+
+
+roller = None
+
+
+def init_app(app):
+    global roller
+    interval = app.config.get('COUNTERS_ROLL_SECONDS')
+    if not interval:
+        return
+    roller = Roller(app, interval)
+
+    @app.before_request
+    def start_counter_roll():
+        # per process, like the change log
+        roller.start()
+
+
+#  Consistency
+#  ----------------------------------------------------------------
+
+def _expected(model, as_of):
+    # (upcoming, past) per row of model, counted from the Show table
+    owner = OWNERS[model]
+    upcoming = select(func.count(Show.id)).where(owner == model.id, Show.start_time > as_of)
+    past = select(func.count(Show.id)).where(owner == model.id, Show.start_time <= as_of)
+    return upcoming.scalar_subquery(), past.scalar_subquery()
+
+
+def check():
+    # (model, id, stored (upcoming, past), counted (upcoming, past)) for
+    # every row whose counters are wrong
+    as_of = clock(db.session)
+    mismatches = []
+    for model in OWNERS:
+        upcoming, past = _expected(model, as_of)
+        rows = db.session.execute(
+            select(model.id, model.upcoming_shows_count, model.past_shows_count, upcoming, past)
+            .order_by(model.id)
+        )
+        mismatches += [
+            (model, row[0], (row[1], row[2]), (row[3], row[4]))
+            for row in rows if (row[1], row[2]) != (row[3], row[4])
+        ]
+    db.session.rollback()
+    return mismatches
+
+
+def rebuild(now=None):
+    # recounts every counter around now and sets the clock to it
+    now = now or datetime.now()
+    clock(db.session, exclusive=True)
+    for model in OWNERS:
+        upcoming, past = _expected(model, now)
+        db.session.execute(
+            update(model)
+            .values(upcoming_shows_count=upcoming, past_shows_count=past, updated_at=model.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.execute(update(CounterClock).where(CounterClock.name == CLOCK).values(as_of=now))
+    db.session.commit()
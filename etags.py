@@ -0,0 +1,158 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import current_app, g, make_response, request, session
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Show, CounterClock, DeleteStamp
+
+#----------------------------------------------------------------------------#
+# Conditional GET.
+#
+# Each page has a version: the updated_at of what it shows, the time rows
+# were last deleted from those tables (a DeleteStamp, written by every
+# flush that deletes) and the start time of the next upcoming show (so it
+# changes when a show moves from upcoming to past). The version is one
+# query over indexes, answered before any rendering or relationship
+# loading; when it matches the client's If-None-Match, or nothing changed
+# since If-Modified-Since, the view is skipped and a 304 is returned.
+#----------------------------------------------------------------------------#
+
+# Version columns labelled updated_* are timestamps of the page's content,
+# in UTC like updated_at. Those labelled local_* are on the local clock the
+# show times use: the start of the last show that has started (the page
+# changed then, the show moved from upcoming to past) and the counter
+# clock. The latest of them all is the page's Last-Modified.
+
+def _stamp(model):
+    return select(func.max(model.updated_at)).scalar_subquery().label(f'updated_{model.__tablename__}')
+
+
+def _deleted(model):
+    table = model.__tablename__
+    return (
+        select(DeleteStamp.deleted_at)
+        .where(DeleteStamp.name == table)
+        .scalar_subquery()
+        .label(f'updated_deleted_{table}')
+    )
+
+
+@event.listens_for(Session, 'after_flush')
+def _stamp_deletes(session, flush_context):
+    tables = sorted({
+        obj.__tablename__ for obj in session.deleted if isinstance(obj, (Venue, Artist, Show))
+    })
+    if not tables:
+        return
+    stmt = insert(DeleteStamp.__table__)
+    session.execute(
+        stmt.on_conflict_do_update(index_elements=['name'], set_={'deleted_at': stmt.excluded.deleted_at}),
+        [{'name': table, 'deleted_at': datetime.utcnow()} for table in tables]
+    )
+
+
+def _next_show(now, *where):
+    return select(func.min(Show.start_time)).where(Show.start_time > now, *where).scalar_subquery()
+
+
+def _last_started(now, *where):
+    return (
+        select(func.max(Show.start_time)).where(Show.start_time <= now, *where)
+        .scalar_subquery().label('local_started')
+    )
+
+
+def venues_version(now):
+    # the listing counts upcoming shows as of the counter clock
+    counted_as_of = select(func.max(CounterClock.as_of)).scalar_subquery().label('local_counted')
+    return db.session.execute(select(
+        _stamp(Venue), _deleted(Venue), _stamp(Show), _deleted(Show), counted_as_of
+    )).one()
+
+
+def artists_version(now):
+    return db.session.execute(select(_stamp(Artist), _deleted(Artist))).one()
+
+
+def shows_version(now):
+    return db.session.execute(select(
+        _stamp(Show), _deleted(Show), _stamp(Venue), _stamp(Artist), _next_show(now), _last_started(now)
+    )).one()
+
+
+def _detail_version(model, own_column, other, other_column, entity_id, now):
+    # the entity, its shows and whatever is on the other side of them
+    return db.session.execute(
+        select(
+            model.updated_at.label('updated'),
+            func.max(Show.updated_at).label('updated_shows'),
+            func.count(Show.id),
+            func.max(other.updated_at).label('updated_other'),
+            _next_show(now, own_column == entity_id),
+            func.max(Show.start_time).filter(Show.start_time <= now).label('local_started'),
+        )
+        .select_from(model)
+        .outerjoin(Show, own_column == model.id)
+        .outerjoin(other, other.id == other_column)
+        .where(model.id == entity_id)
+        .group_by(model.id)
+    ).one_or_none()
+
+
+def venue_version(now, venue_id):
+    return _detail_version(Venue, Show.venue_id, Artist, Show.artist_id, venue_id, now)
+
+
+def artist_version(now, artist_id):
+    return _detail_version(Artist, Show.artist_id, Venue, Show.venue_id, artist_id, now)
+
+
+def last_modified(version):
+    stamps = []
+    for key, value in version._mapping.items():
+        if value is None:
+            continue
+        if key.startswith('updated'):
+            stamps.append(value)
+        elif key.startswith('local'):
+            stamps.append(value.astimezone(timezone.utc).replace(tzinfo=None))
+    return max(stamps) if stamps else None
+
+
+def conditional(version_of):
+    # version_of(now, **view_args) returns a row of values, or None when
+    # the entity does not exist (the view then answers as usual).
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(**kwargs)
+            version = version_of(datetime.now(), **kwargs)
+            if version is None:
+                return view(**kwargs)
+            raw = repr((request.full_path, tuple(version))).encode()
+            etag = hashlib.sha1(raw).hexdigest()
+            # the page cache keys the body by it, see cache.py
+            g.cache_version = etag
+            modified = last_modified(version)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            elif request.if_modified_since and modified:
+                not_modified = modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+            else:
+                not_modified = False
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(**kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            if modified:
+                response.last_modified = modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
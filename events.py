@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Show, ChangeLog
+
+#----------------------------------------------------------------------------#
+# Commit notifications.
+#
+# In-process indexes and caches subscribe with `@on_commit` and receive the
+# list of Venue/Artist/Show rows a transaction changed, once it has been
+# committed. Rolled back changes are never delivered. Writes that bypass
+# the ORM (bulk Core inserts) report their rows with `notify()`.
+#----------------------------------------------------------------------------#
+
+TRACKED_MODELS = (Venue, Artist, Show)
+
+MODELS = {model.__name__: model for model in TRACKED_MODELS}
+
+# op is 'insert', 'update' or 'delete'; values holds the column values the
+# session had loaded at flush time. 'reset' (id None) means any row of the
+# model may have changed: rebuild from the table.
+Change = namedtuple('Change', 'op model id values')
+
+_listeners = []
+_change_listeners = []
+
+
+def on_commit(listener):
+    _listeners.append(listener)
+    return listener
+
+
+def on_change(listener):
+    # like on_commit, and also called with the rows other processes
+    # committed, see Follower
+    _change_listeners.append(listener)
+    return listener
+
+
+def notify(changes):
+    changes = list(changes)
+    if not changes:
+        return
+    for listener in _listeners + _change_listeners:
+        listener(changes)
+
+
+def _snapshot(obj):
+    state = inspect(obj)
+    return {
+        attr.key: state.dict[attr.key]
+        for attr in state.mapper.column_attrs
+        if attr.key in state.dict
+    }
+
+
+def record(session, rows):
+    # logs (model, id) pairs in the session's transaction, for the other
+    # processes; bulk writers call it before committing
+    rows = [{'model': model.__name__, 'row_id': id} for model, id in rows]
+    if rows:
+        session.execute(insert(ChangeLog.__table__), rows)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_changes(session, flush_context):
+    changes = []
+    for op, objs in (('insert', session.new), ('update', session.dirty), ('delete', session.deleted)):
+        for obj in objs:
+            if not isinstance(obj, TRACKED_MODELS):
+                continue
+            if op == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            changes.append(Change(op, type(obj), obj.id, _snapshot(obj)))
+    session.info.setdefault('committed_changes', []).extend(changes)
+    # another process reads a show back as it is now, or gone: its venue
+    # and artist are logged too, so their pages are dropped there as well
+    rows = [(change.model, change.id) for change in changes]
+    rows += [
+        (model, change.values[column])
+        for change in changes if change.model is Show
+        for model, column in ((Venue, 'venue_id'), (Artist, 'artist_id'))
+        if change.values.get(column) is not None
+    ]
+    record(session, rows)
+
+
+@event.listens_for(Session, 'after_commit')
+def _dispatch_changes(session):
+    notify(session.info.pop('committed_changes', ()))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('committed_changes', None)
+
+#----------------------------------------------------------------------------#
+# Indexes kept current from commits.
+#
+# The typeahead, facet and matching indexes are built from their table on
+# first use and then updated with the changes `@on_change` delivers. A
+# build reads the rows while other threads go on committing: begin() is
+# called before the rows are read, the changes from then on are kept and
+# replayed over the rows once they are in. A 'reset' leaves the index to
+# be rebuilt on next use.
+#----------------------------------------------------------------------------#
+
+class ReplayingIndex:
+    # subclasses implement _load(*args), which reads the rows into new
+    # structures without touching the index and returns them as
+    # {attribute: value}, and _apply(change), called under self.lock
+
+    def __init__(self):
+        self.ready = False
+        self.pending = None  # changes committed during a build
+        self.lock = threading.Lock()
+
+    def begin(self):
+        # before the rows for build() are read
+        with self.lock:
+            self.pending = []
+
+    def build(self, *args):
+        loaded = self._load(*args)
+        with self.lock:
+            vars(self).update(loaded)
+            # the rows may predate commits made while they were read
+            for change in self.pending or ():
+                self._apply(change)
+            self.pending = None
+            self.ready = True
+
+    def apply(self, change):
+        with self.lock:
+            if self.pending is not None:
+                self.pending.append(change)
+            elif change.op == 'reset':
+                self.ready = False
+            elif self.ready:
+                self._apply(change)
+
+    def _load(self, *args):
+        raise NotImplementedError
+
+    def _apply(self, change):
+        raise NotImplementedError
+
+#----------------------------------------------------------------------------#
+# Other processes' commits.
+#
+# Each process keeps its own indexes, so a commit has to reach the others
+# too: every transaction that changes tracked rows logs them in ChangeLog,
+# with its transaction id, and a thread in each process reads the log every
+# CHANGE_SYNC_SECONDS. The rows it names are read as they are now and
+# handed to the `@on_change` listeners; a row that is gone is a delete.
+#
+# The thread reads the entries from its watermark on: the oldest
+# transaction that was still running at its previous read. Everything
+# older had ended by then and was read, in whatever order the transactions
+# committed; entries read twice are applied twice, to the same effect. The
+# watermark is taken before the indexes are first built, so a worker forked
+# by serve.py catches up from the master's preload. Entries are kept for
+# CHANGE_LOG_KEEP_SECONDS; a process that has fallen behind by half of that
+# gets a 'reset' per model instead.
+#----------------------------------------------------------------------------#
+
+# Ids read per statement while catching up.
+READ_CHUNK = 1000
+
+
+def _oldest_running():
+    # the oldest transaction id not yet ended, everything below it has
+    return db.session.execute(select(func.txid_snapshot_xmin(func.txid_current_snapshot()))).scalar()
+
+
+class Follower:
+
+    def __init__(self, app, interval, keep):
+        self.app = app
+        self.interval = interval
+        self.keep = keep
+        self.watermark = None
+        self.synced_at = None
+        self.pruned_at = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+
+    def mark(self):
+        # before the indexes are built: they hold every commit older than this
+        with self.lock:
+            if self.watermark is None:
+                self.watermark, self.synced_at = _oldest_running(), time.time()
+
+    def start(self):
+        # the thread of this process, started on first use after a fork
+        self.mark()
+        with self.lock:
+            if self.pid == os.getpid() and self.thread.is_alive():
+                return
+            self.pid = os.getpid()
+            self.thread = threading.Thread(target=self._run, name='change-log', daemon=True)
+            self.thread.start()
+
+    def _read(self, entries):
+        changes = []
+        for name, ids in entries.items():
+            model = MODELS[name]
+            columns = [getattr(model, attr.key).label(attr.key) for attr in inspect(model).column_attrs]
+            ids = sorted(ids)
+            for start in range(0, len(ids), READ_CHUNK):
+                chunk = ids[start:start + READ_CHUNK]
+                rows = {
+                    row.id: dict(row._mapping)
+                    for row in db.session.execute(select(*columns).where(model.id.in_(chunk)))
+                }
+                changes.extend(
+                    Change('update', model, id, rows[id]) if id in rows else Change('delete', model, id, {})
+                    for id in chunk
+                )
+        return changes
+
+    def sync(self):
+        watermark, now = _oldest_running(), time.time()
+        if now - self.synced_at > self.keep / 2:
+            changes = [Change('reset', model, None, {}) for model in TRACKED_MODELS]
+        else:
+            entries = {}
+            for name, id in db.session.execute(
+                select(ChangeLog.model, ChangeLog.row_id).where(ChangeLog.txid >= self.watermark).distinct()
+            ):
+                entries.setdefault(name, set()).add(id)
+            changes = self._read(entries)
+        if now - self.pruned_at > self.keep / 24:
+            db.session.execute(
+                delete(ChangeLog.__table__).where(ChangeLog.logged_at < func.now() - timedelta(seconds=self.keep))
+            )
+            self.pruned_at = now
+        db.session.commit()
+        self.watermark, self.synced_at = watermark, now
+        if changes:
+            for listener in _change_listeners:
+                listener(changes)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                with self.app.app_context():
+                    self.sync()
+            except Exception:
+                # the database is unreachable: the next read starts from
+                # the same watermark
+                self.app.logger.exception('change log read failed')
+
+
+follower = None
+
+
+def init_app(app):
+    global follower
+    follower = Follower(app, app.config['CHANGE_SYNC_SECONDS'], app.config['CHANGE_LOG_KEEP_SECONDS'])
+
+    @app.before_first_request
+    def mark_change_log():
+        # registered before the indexes' builds, see Follower
+        follower.mark()
+
+    @app.before_request
+    def follow_change_log():
+        # per process, like the write queue: a worker forked by serve.py
+        # starts its own
+        follower.start()
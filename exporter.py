@@ -0,0 +1,193 @@
+import csv
+import io
+import itertools
+import json
+import zlib
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.types import Boolean, DateTime, Integer
+from importer import FIELDS, KINDS
+import queries
+
+#----------------------------------------------------------------------------#
+# Catalogue export.
+#
+# Rows come from a server-side cursor in chunks of Core rows, never ORM
+# objects, so nothing collects in the session's identity map. Each chunk
+# is encoded and handed on before the next is fetched, which keeps memory
+# flat however large the table is.
+#
+# Columns carry the import field names (website_link, seeking_talent...)
+# plus `id`, so an exported file can be imported again as it is.
+#
+#   ndjson    one JSON object per row
+#   csv       a header row, genres joined with ';'
+#   columnar  one JSON header line, then one line per row group holding
+#             each column as an array: ids delta-encoded, low-cardinality
+#             strings dictionary-encoded. Read it with read_columnar().
+#----------------------------------------------------------------------------#
+
+FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+    'columnar': ('application/x-ndjson', 'columnar.jsonl'),
+}
+
+CHUNK_SIZE = 5000
+
+COLUMNAR_VERSION = 1
+
+
+def columns(kind):
+    # (field name, column) pairs, id first
+    model = KINDS[kind]
+    table = model.__table__
+    return [('id', table.c.id)] + [
+        (field, table.c[column]) for field, (column, _, _) in FIELDS[model].items()
+    ]
+
+
+def export_query(kind):
+    return select(*[column.label(field) for field, column in columns(kind)])
+
+
+def chunks(kind, chunk_size=CHUNK_SIZE, after=None):
+    # lists of up to chunk_size rows, in id order
+    table = KINDS[kind].__table__
+    rows = queries.keyset_stream(export_query(kind), (table.c.id,), after, chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+#  Encoders
+#  ----------------------------------------------------------------
+#
+#  Each takes the field names and an iterable of row chunks and yields
+#  one str per chunk.
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def encode_ndjson(kind, fields, row_chunks):
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_json_value).encode
+    for chunk in row_chunks:
+        yield ''.join(dumps(dict(zip(fields, row))) + '\n' for row in chunk)
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'y' if value else 'n'
+    if isinstance(value, list):
+        return ';'.join(value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def encode_csv(kind, fields, row_chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    for chunk in row_chunks:
+        writer.writerows([_csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def column_type(column):
+    if isinstance(column.type, Boolean):
+        return 'boolean'
+    if isinstance(column.type, Integer):
+        return 'integer'
+    if isinstance(column.type, DateTime):
+        return 'datetime'
+    if column.type.python_type is list:
+        return 'list'
+    return 'string'
+
+
+def encode_column(type, values):
+    if type == 'integer' and None not in values:
+        return {'encoding': 'delta', 'values': [b - a for a, b in zip([0] + values, values)]}
+    if type == 'datetime':
+        values = [value and value.isoformat() for value in values]
+    if type in ('string', 'datetime'):
+        dictionary = {}
+        codes = [dictionary.setdefault(value, len(dictionary)) for value in values]
+        if len(dictionary) * 2 <= len(values):
+            return {'encoding': 'dictionary', 'dictionary': list(dictionary), 'values': codes}
+    return {'encoding': 'plain', 'values': values}
+
+
+def encode_columnar(kind, fields, row_chunks):
+    types = [column_type(column) for _, column in columns(kind)]
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    yield dumps({
+        'format': 'fyyur-columnar', 'version': COLUMNAR_VERSION, 'kind': kind,
+        'columns': [{'name': field, 'type': type} for field, type in zip(fields, types)],
+    }) + '\n'
+    for chunk in row_chunks:
+        yield dumps({
+            'rows': len(chunk),
+            'columns': {
+                field: encode_column(type, list(values))
+                for field, type, values in zip(fields, types, zip(*chunk))
+            },
+        }) + '\n'
+
+
+ENCODERS = {'ndjson': encode_ndjson, 'csv': encode_csv, 'columnar': encode_columnar}
+
+
+def read_columnar(lines):
+    # rows (dicts) back from a columnar export
+    lines = iter(lines)
+    header = json.loads(next(lines))
+    if header.get('format') != 'fyyur-columnar' or header.get('version') != COLUMNAR_VERSION:
+        raise ValueError('not a fyyur columnar file')
+    fields = [column['name'] for column in header['columns']]
+    for line in lines:
+        group = json.loads(line)
+        decoded = []
+        for field in fields:
+            column = group['columns'][field]
+            values = column['values']
+            if column['encoding'] == 'delta':
+                values = list(itertools.accumulate(values))
+            elif column['encoding'] == 'dictionary':
+                values = [column['dictionary'][code] for code in values]
+            decoded.append(values)
+        for values in zip(*decoded):
+            yield dict(zip(fields, values))
+
+
+#  Output
+#  ----------------------------------------------------------------
+
+def gzipped(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for piece in data:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(kind, format='ndjson', gzip=False, chunk_size=CHUNK_SIZE):
+    # bytes, one piece per chunk of rows
+    fields = [field for field, _ in columns(kind)]
+    data = (text.encode() for text in ENCODERS[format](kind, fields, chunks(kind, chunk_size)))
+    return gzipped(data) if gzip else data
+
+
+def filename(kind, format, gzip=False):
+    return f"{kind}.{FORMATS[format][1]}{'.gz' if gzip else ''}"
@@ -5,10 +5,9 @@ from fabric.contrib.console import confirm
 
 
 def test():
+    # the per-route SQL budgets, against the configured database
     with settings(warn_only=True):
-        result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
-        )
+        result = local("flask query-counts", capture=True)
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
@@ -39,9 +38,7 @@ def heroku():
 
 
 def heroku_test():
-    local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
-    )
+    local("heroku run flask query-counts")
 
 
 def deploy():
@@ -51,6 +48,17 @@ def deploy():
     heroku()
     heroku_test()
 
+# benchmark
+
+
+def bench(scale="10k"):
+    # every route against a synthetic catalogue; DATABASE_URL must name a
+    # scratch database, rows are added to it
+    local(
+        "python bench.py routes --database-url $DATABASE_URL --seed-scale {} "
+        "--output bench-{}.json".format(scale, scale)
+    )
+
 # rollback
 
 
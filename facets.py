@@ -0,0 +1,206 @@
+import threading
+from sqlalchemy import cast, func, select
+from sqlalchemy.dialects.postgresql import array
+from models import db, Venue, Artist
+from enums import Genre, State
+import events
+
+#----------------------------------------------------------------------------#
+# Genre and state facets.
+#
+# /venues and /artists take ?genre= and ?state=, each repeatable: a row
+# matches when it has any of the chosen genres and is in any of the chosen
+# states. The listing is filtered in SQL, genres through the GIN index on
+# the array column. The counts shown next to each facet value come from an
+# in-process bitmap index instead: one Python int per genre and per state
+# whose bit `id` is set when that row has the value, so a count is an AND
+# and a popcount over ids, never a scan of the table. A genre's count
+# applies the chosen states but not the chosen genres, and the other way
+# round, so picking a value never hides the alternatives.
+#
+# The index is built from the database on the first request and then kept
+# current from commit notifications, like the typeahead index; those that
+# arrive while the rows are being read are replayed over them.
+#----------------------------------------------------------------------------#
+
+KINDS = {Venue: 'venue', Artist: 'artist'}
+
+GENRES = [genre.value for genre in Genre]
+STATES = [state.value for state in State]
+
+
+class Selection:
+    # the facet values picked in a request
+
+    def __init__(self, genres=(), states=()):
+        self.genres = [genre for genre in GENRES if genre in genres]
+        self.states = [state for state in STATES if state in states]
+
+    @classmethod
+    def from_args(cls, args):
+        # unknown values are dropped rather than matching nothing
+        return cls(args.getlist('genre'), args.getlist('state'))
+
+    def __bool__(self):
+        return bool(self.genres or self.states)
+
+    @property
+    def args(self):
+        # url_for arguments that keep the selection
+        return {'genre': self.genres, 'state': self.states}
+
+    def toggled(self, facet, value):
+        # url_for arguments with value picked if it wasn't, dropped if it was
+        picked = self.genres if facet == 'genre' else self.states
+        changed = [item for item in picked if item != value] if value in picked else picked + [value]
+        return {**self.args, facet: changed}
+
+    def filters(self, model):
+        clauses = []
+        if self.genres:
+            clauses.append(model.genres.op('&&')(cast(array(self.genres), model.genres.type)))
+        if self.states:
+            clauses.append(model.state.in_(self.states))
+        return clauses
+
+
+class BitmapIndex(events.ReplayingIndex):
+
+    def __init__(self):
+        super().__init__()
+        self.bitmaps = {}   # (facet, value) -> int, bit id set
+        self.sizes = {}     # (facet, value) -> bits set
+        self.rows = 0       # bit id set for every row indexed
+
+    @staticmethod
+    def keys(state, genres):
+        keys = [('genre', genre) for genre in genres or () if genre in GENRES]
+        if state in STATES:
+            keys.append(('state', state))
+        return keys
+
+    def _load(self, rows, max_id):
+        # rows of (id, state, genres); bits are set in bytearrays and each
+        # turned into an int once, setting them on ints would copy every time
+        size = max_id // 8 + 1
+        buffers = {('genre', genre): bytearray(size) for genre in GENRES}
+        buffers.update({('state', state): bytearray(size) for state in STATES})
+        present = bytearray(size)
+        for id, state, genres in rows:
+            byte, bit = divmod(id, 8)
+            present[byte] |= 1 << bit
+            for key in self.keys(state, genres):
+                buffers[key][byte] |= 1 << bit
+        bitmaps = {key: int.from_bytes(buffer, 'little') for key, buffer in buffers.items()}
+        sizes = {key: bits.bit_count() for key, bits in bitmaps.items()}
+        return {'bitmaps': bitmaps, 'sizes': sizes, 'rows': int.from_bytes(present, 'little')}
+
+    def _clear(self, id):
+        mask = ~(1 << id)
+        self.rows &= mask
+        for key, bits in self.bitmaps.items():
+            if bits >> id & 1:
+                self.bitmaps[key] = bits & mask
+                self.sizes[key] -= 1
+
+    def _put(self, id, state, genres):
+        self._clear(id)
+        bit = 1 << id
+        self.rows |= bit
+        for key in set(self.keys(state, genres)):
+            self.bitmaps[key] |= bit
+            self.sizes[key] += 1
+
+    def _apply(self, change):
+        if change.op == 'delete':
+            self._clear(change.id)
+        elif 'state' in change.values and 'genres' in change.values:
+            self._put(change.id, change.values['state'], change.values['genres'])
+
+    def _union(self, facet, values):
+        bits = 0
+        for value in values:
+            bits |= self.bitmaps[(facet, value)]
+        return bits
+
+    def _counts(self, facet, values, within, bitmaps, sizes):
+        # values' counts among the rows in within, None for all rows
+        if within is None:
+            return {value: sizes[(facet, value)] for value in values}
+        return {
+            value: (bitmaps[(facet, value)] & within).bit_count() if sizes[(facet, value)] else 0
+            for value in values
+        }
+
+    def counts(self, selection):
+        # {'total': n, 'genre': {genre: n}, 'state': {state: n}}
+        with self.lock:
+            bitmaps, sizes = self.bitmaps, dict(self.sizes)
+            in_genres = self._union('genre', selection.genres) if selection.genres else None
+            in_states = self._union('state', selection.states) if selection.states else None
+            rows = self.rows
+        # ints are immutable, the counting needs no lock
+        for within in (in_genres, in_states):
+            if within is not None:
+                rows &= within
+        return {
+            'total': rows.bit_count(),
+            'genre': self._counts('genre', GENRES, in_states, bitmaps, sizes),
+            'state': self._counts('state', STATES, in_genres, bitmaps, sizes),
+        }
+
+
+indexes = {kind: BitmapIndex() for kind in KINDS.values()}
+
+
+# One build at a time, so each replays the commits made during its reads.
+_building = threading.Lock()
+
+
+def build():
+    with _building:
+        for model, kind in KINDS.items():
+            _build(model, indexes[kind])
+
+
+def _build(model, index):
+    index.begin()
+    max_id = db.session.execute(select(func.coalesce(func.max(model.id), 0))).scalar()
+    rows = db.session.execute(
+        select(model.id, model.state, model.genres).execution_options(stream_results=True, yield_per=10000)
+    )
+    index.build(rows, max_id)
+
+
+def counts(model, selection):
+    index = indexes[KINDS[model]]
+    if not index.ready:
+        build()
+    return index.counts(selection)
+
+
+def facet_list(counts, selection):
+    # template rows per facet: (value, count, picked, url_for arguments),
+    # values matching nothing left out unless picked
+    facets = {}
+    for facet, picked in (('genre', selection.genres), ('state', selection.states)):
+        facets[facet] = [
+            (value, count, value in picked, selection.toggled(facet, value))
+            for value, count in counts[facet].items() if count or value in picked
+        ]
+    return facets
+
+
+@events.on_change
+def _update_indexes(changes):
+    for change in changes:
+        kind = KINDS.get(change.model)
+        if kind is not None:
+            indexes[kind].apply(change)
+
+
+def init_app(app):
+
+    @app.before_first_request
+    def build_facet_index():
+        build()
@@ -0,0 +1,56 @@
+from datetime import datetime
+from functools import lru_cache
+import babel.dates
+import dateutil.parser
+from babel import Locale
+
+#----------------------------------------------------------------------------#
+# Date formatting.
+#
+# The `datetime` template filter runs once per show row. Babel resolves the
+# locale and pattern and dateutil parses the value on every call; here the
+# compiled pattern, Locale and timezone are looked up once per
+# (format, locale, tz), and recent outputs are memoized, so a listing that
+# repeats the same start times formats each of them once.
+#----------------------------------------------------------------------------#
+
+FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+# Babel's own named formats, which are not a single pattern.
+BABEL_NAMED = ('long', 'short')
+
+OUTPUT_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=128)
+def compiled(format, locale, tz):
+    # (pattern, Locale, tzinfo) for format; pattern is None for a Babel
+    # named format
+    pattern = None
+    if format not in BABEL_NAMED:
+        pattern = babel.dates.parse_pattern(FORMATS.get(format, format))
+    return pattern, Locale.parse(locale), tz and babel.dates.get_timezone(tz)
+
+
+def to_datetime(value):
+    return value if isinstance(value, datetime) else dateutil.parser.parse(value)
+
+
+@lru_cache(maxsize=OUTPUT_CACHE_SIZE)
+def format_datetime(value, format='medium', locale='en', tz=None):
+    # value is a datetime or a string dateutil can parse; naive values are
+    # UTC, as in babel.dates.format_datetime
+    pattern, locale, tzinfo = compiled(format, locale, tz)
+    date = to_datetime(value)
+    if pattern is None:
+        return babel.dates.format_datetime(date, format, tzinfo=tzinfo, locale=locale)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=babel.dates.UTC)
+    if tzinfo is not None:
+        date = date.astimezone(tzinfo)
+        if hasattr(tzinfo, 'normalize'):  # pytz
+            date = tzinfo.normalize(date)
+    return pattern.apply(date, locale)
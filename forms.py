@@ -1,9 +1,16 @@
 from datetime import datetime
 from flask_wtf import FlaskForm as Form
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField 
-from wtforms.validators import DataRequired, AnyOf, URL, Regexp
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, IntegerField
+from wtforms.validators import DataRequired, AnyOf, URL, Regexp, NumberRange
 from enums import Genre, State
 
+# Shared with the bulk importer, which applies the same rules without
+# building a form per row.
+PHONE_PATTERN = r'^\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})$'
+
+# Show lengths in minutes: (shortest, longest), and the default.
+SHOW_MINUTES = (15, 24 * 60)
+DEFAULT_SHOW_MINUTES = 120
 
 
 class ShowForm(Form):
@@ -20,6 +27,11 @@ class ShowForm(Form):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    duration = IntegerField(
+        'duration',
+        validators=[NumberRange(*SHOW_MINUTES)],
+        default=DEFAULT_SHOW_MINUTES
+    )
 
 class VenueForm(Form):
     name = StringField(
@@ -40,7 +52,7 @@ class VenueForm(Form):
     )
     phone = StringField(
         'phone',
-         validators=[DataRequired(), Regexp('^\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})$')]
+         validators=[DataRequired(), Regexp(PHONE_PATTERN)]
     )
     image_link = StringField(
         'image_link',
@@ -86,7 +98,7 @@ class ArtistForm(Form):
     phone = StringField(
         # TODO implement validation logic for state
         'phone',
-        validators=[DataRequired(), Regexp('^\(?([0-9]{3})\)?[-. ]?([0-9]{3})[-. ]?([0-9]{4})$')]
+        validators=[DataRequired(), Regexp(PHONE_PATTERN)]
     )
     image_link = StringField(
         'image_link'
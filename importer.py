@@ -0,0 +1,446 @@
+import csv
+import json
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+import dateutil.parser
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
+from wtforms.validators import URL
+from models import db, Venue, Artist, Show
+from enums import Genre, State
+from forms import PHONE_PATTERN, SHOW_MINUTES, DEFAULT_SHOW_MINUTES
+import counters
+import calendars
+import intervals
+import events
+
+#----------------------------------------------------------------------------#
+# Bulk import of venues, artists and shows.
+#
+# Rows are read one at a time from CSV or NDJSON, so the file is never held
+# in memory, and checked against the same rules as VenueForm, ArtistForm
+# and ShowForm without building a form per row. Columns use the form field
+# names (website_link, seeking_talent...); an optional `id` column keeps
+# the file's own ids so a show file can refer to the venues and artists
+# imported before it.
+#
+# Valid rows are inserted in chunks, one multi-row INSERT and one commit per
+# chunk. After each commit the number of records consumed is written to a
+# checkpoint file; a rerun with the same checkpoint skips them. Rejected
+# rows are reported with their line number and errors, and never stop the
+# import.
+#----------------------------------------------------------------------------#
+
+CHUNK_SIZE = 1000
+
+ImportResult = namedtuple('ImportResult', 'records inserted rejected skipped')
+
+
+class Reject(ValueError):
+    pass
+
+
+#  Rules
+#  ----------------------------------------------------------------
+
+STATES = {state.value for state in State}
+GENRES = {genre.value for genre in Genre}
+PHONE = re.compile(PHONE_PATTERN)
+TRUE = {'y', 'yes', 'true', 't', '1', 'on'}
+FALSE = {'n', 'no', 'false', 'f', '0', 'off', ''}
+
+_url = URL()
+
+
+def text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    if '\x00' in value:
+        raise Reject('Invalid input.')
+    return value or None
+
+
+def state(value):
+    value = text(value)
+    if value not in STATES:
+        raise Reject('Not a valid choice.')
+    return value
+
+
+def phone(value):
+    value = text(value)
+    if value is None or not PHONE.match(value):
+        raise Reject('Invalid input.')
+    return value
+
+
+def url(value):
+    value = text(value)
+    if value is None:
+        return None
+    match = _url.regex.match(value)
+    if match is None or not _url.validate_hostname(match.group('host')):
+        raise Reject('Invalid URL.')
+    return value
+
+
+def genres(value):
+    # a list in NDJSON, ';' separated in CSV
+    if isinstance(value, str):
+        value = value.split(';')
+    values = [genre for genre in (text(item) for item in value or ()) if genre]
+    if not values:
+        raise Reject('This field is required.')
+    invalid = [genre for genre in values if genre not in GENRES]
+    if invalid:
+        raise Reject(f"'{', '.join(invalid)}' are not valid choices for this field.")
+    return values
+
+
+def boolean(value):
+    if isinstance(value, bool):
+        return value
+    value = (text(value) or '').lower()
+    if value in TRUE:
+        return True
+    if value in FALSE:
+        return False
+    raise Reject('Not a valid boolean.')
+
+
+def integer(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise Reject('Not a valid integer value.')
+
+
+def minutes(value):
+    # a show's duration; the form's default when left out
+    if text(value) is None:
+        return DEFAULT_SHOW_MINUTES
+    value = integer(value)
+    if not SHOW_MINUTES[0] <= value <= SHOW_MINUTES[1]:
+        raise Reject('Number must be between %d and %d.' % SHOW_MINUTES)
+    return value
+
+
+def timestamp(value):
+    # naive times are stored as given; for an offset the wall time is kept,
+    # like the form's DateTimeField
+    value = text(value)
+    if value is None:
+        raise Reject('This field is required.')
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = dateutil.parser.parse(value)
+        except (ValueError, OverflowError):
+            raise Reject('Not a valid datetime value.')
+    return parsed.replace(tzinfo=None)
+
+
+# model -> {field: (column, clean, required)}, following the forms and the
+# column names the create views write to
+FIELDS = {
+    Venue: {
+        'name': ('name', text, True),
+        'city': ('city', text, True),
+        'state': ('state', state, True),
+        'address': ('address', text, True),
+        'phone': ('phone', phone, True),
+        'image_link': ('image_link', url, False),
+        'genres': ('genres', genres, True),
+        'facebook_link': ('facebook_link', url, False),
+        'website_link': ('website', url, False),
+        'seeking_talent': ('talent', boolean, False),
+        'seeking_description': ('description', text, False),
+    },
+    Artist: {
+        'name': ('name', text, True),
+        'city': ('city', text, True),
+        'state': ('state', state, True),
+        'phone': ('phone', phone, True),
+        'image_link': ('image_link', text, False),
+        'genres': ('genres', genres, True),
+        'facebook_link': ('facebook_link', url, False),
+        'website_link': ('website', text, False),
+        'seeking_venue': ('venue', boolean, False),
+        'seeking_description': ('description', text, False),
+    },
+    Show: {
+        'artist_id': ('artist_id', integer, True),
+        'venue_id': ('venue_id', integer, True),
+        'start_time': ('start_time', timestamp, True),
+        'duration': ('duration', minutes, True),
+    },
+}
+
+KINDS = {'venues': Venue, 'artists': Artist, 'shows': Show}
+
+
+def clean(model, record):
+    # column values for record, or Reject with {field: message}
+    values, errors = {}, {}
+    if text(record.get('id')) is not None:
+        try:
+            values['id'] = integer(record['id'])
+        except Reject as reject:
+            errors['id'] = str(reject)
+    for field, (column, cleaner, required) in FIELDS[model].items():
+        try:
+            value = cleaner(record.get(field))
+        except Reject as reject:
+            errors[field] = str(reject)
+            continue
+        if value is None and required:
+            errors[field] = 'This field is required.'
+            continue
+        # the forms don't check lengths, the columns do
+        length = getattr(model.__table__.c[column].type, 'length', None)
+        if length and isinstance(value, str) and len(value) > length:
+            errors[field] = f'Field cannot be longer than {length} characters.'
+            continue
+        values[column] = value
+    if errors:
+        raise Reject(errors)
+    return values
+
+
+#  Reading
+#  ----------------------------------------------------------------
+
+def detect_format(name):
+    return 'ndjson' if name.lower().endswith(('.ndjson', '.jsonl', '.json')) else 'csv'
+
+
+def read_records(stream, format):
+    # (line number, record) pairs from a text stream; a record that can't
+    # be parsed is yielded as a Reject
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif format == 'ndjson':
+        for number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield number, Reject({'_row': 'Invalid JSON.'})
+                continue
+            if not isinstance(record, dict):
+                yield number, Reject({'_row': 'Expected a JSON object.'})
+                continue
+            yield number, record
+    else:
+        raise ValueError(f'unknown import format: {format!r}')
+
+
+#  Checkpoints
+#  ----------------------------------------------------------------
+
+def source_of(path):
+    stat = os.stat(path)
+    return {'path': os.path.abspath(path), 'size': stat.st_size}
+
+
+def load_checkpoint(path, kind, source):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('kind') != kind or checkpoint.get('source') != source:
+        raise ValueError(f'checkpoint {path} belongs to a different import')
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    # written next to the target and renamed, so a crash never leaves half
+    # a checkpoint
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp, path)
+
+
+#  Writing
+#  ----------------------------------------------------------------
+
+def _allocate_ids(table, count):
+    sequence = func.pg_get_serial_sequence(f'"{table.name}"', 'id')
+    return db.session.execute(
+        select(func.nextval(sequence)).select_from(func.generate_series(1, count))
+    ).scalars().all()
+
+
+def _sync_sequence(table):
+    # rows imported with their own ids must not be handed out again
+    db.session.execute(select(func.setval(
+        func.pg_get_serial_sequence(f'"{table.name}"', 'id'),
+        select(func.coalesce(func.max(table.c.id), 0) + 1).scalar_subquery(),
+        False
+    )))
+
+
+def _missing_references(rows):
+    # shows pointing at venues or artists that don't exist
+    missing = {}
+    for model, column in ((Venue, 'venue_id'), (Artist, 'artist_id')):
+        wanted = {row[column] for _, row in rows}
+        found = set(db.session.execute(select(model.id).where(model.id.in_(wanted))).scalars())
+        missing[column] = wanted - found
+    return missing
+
+
+def _booked(rows, on_reject):
+    # drops shows clashing with a booked show of their venue or artist, in
+    # the database or earlier in the file; one query for the whole chunk
+    if not rows:
+        return rows
+    periods = [intervals.show_period(row['start_time'], row['duration']) for _, row in rows]
+    bookings = intervals.load_bookings(
+        {column: {row[column] for _, row in rows} for column in ('venue_id', 'artist_id')},
+        min(start for start, _ in periods), max(end for _, end in periods)
+    )
+    kept = []
+    for (number, row), (start, end) in zip(rows, periods):
+        clash = bookings.conflict(row['venue_id'], row['artist_id'], start, end)
+        if clash and clash[1].show_id is not None and clash[1].show_id == row.get('id'):
+            # the show itself, from an earlier run of the same file
+            clash = None
+        if clash:
+            owner, booking = clash
+            on_reject(number, {owner: intervals.describe(owner, booking)}, row)
+            continue
+        bookings.add(row['venue_id'], row['artist_id'], intervals.Booking(start, end, None))
+        kept.append((number, row))
+    return kept
+
+
+def _taken_ids(table, values):
+    ids = [row['id'] for row in values]
+    return set(db.session.execute(select(table.c.id).where(table.c.id.in_(ids))).scalars())
+
+
+def _count_shows(model, values):
+    if model is Show:
+        shows = [(1, row['venue_id'], row['artist_id'], row['start_time']) for row in values]
+        counters.apply(db.session, shows)
+        calendars.apply(db.session, shows)
+
+
+def write_chunk(model, rows, on_reject):
+    # rows are (line number, values); returns the inserted rows' values
+    table = model.__table__
+    if model is Show:
+        missing = _missing_references(rows)
+        kept = []
+        for number, row in rows:
+            errors = {column: 'Not a valid choice.' for column in missing if row[column] in missing[column]}
+            if errors:
+                on_reject(number, errors, row)
+            else:
+                kept.append((number, row))
+        rows = _booked(kept, on_reject)
+    if not rows:
+        return []
+    own_ids = any('id' in row for _, row in rows)
+    ids = iter(_allocate_ids(table, sum('id' not in row for _, row in rows)))
+    values = [dict(row, id=row['id'] if 'id' in row else next(ids)) for _, row in rows]
+    if own_ids:
+        # rows whose id is taken would be skipped by ON CONFLICT; dropping
+        # them first keeps the rows actually inserted known
+        taken = _taken_ids(table, values)
+        kept = [(pair, row) for pair, row in zip(rows, values) if row['id'] not in taken]
+        rows, values = [pair for pair, _ in kept], [row for _, row in kept]
+    if not values:
+        return []
+    statement = insert(table).on_conflict_do_nothing(index_elements=['id'])
+    try:
+        db.session.execute(statement, values)
+    except DBAPIError:
+        # something the rules didn't catch: retry row by row so only the
+        # offending rows are rejected
+        db.session.rollback()
+        return write_rows(model, rows, values, own_ids, on_reject)
+    if own_ids:
+        _sync_sequence(table)
+    _count_shows(model, values)
+    events.record(db.session, [(model, row['id']) for row in values])
+    db.session.commit()
+    return values
+
+
+def write_rows(model, rows, values, own_ids, on_reject):
+    table = model.__table__
+    inserted = []
+    for (number, row), row_values in zip(rows, values):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(table).on_conflict_do_nothing(index_elements=['id']), row_values)
+        except DBAPIError as error:
+            on_reject(number, {'_row': str(error.orig).strip()}, row)
+            continue
+        inserted.append(row_values)
+    if own_ids:
+        _sync_sequence(table)
+    _count_shows(model, inserted)
+    events.record(db.session, [(model, row['id']) for row in inserted])
+    db.session.commit()
+    return inserted
+
+
+def import_records(kind, records, chunk_size=CHUNK_SIZE, on_reject=None,
+                   checkpoint_path=None, source=None):
+    # records are (line number, record) pairs, see read_records
+    model = KINDS[kind]
+    on_reject = on_reject or (lambda number, errors, record: None)
+    checkpoint = load_checkpoint(checkpoint_path, kind, source) or {
+        'kind': kind, 'source': source, 'records': 0, 'inserted': 0, 'rejected': 0
+    }
+    skipped = checkpoint['records']
+    counts = {'records': 0, 'inserted': 0, 'rejected': 0}
+
+    def reject(number, errors, record):
+        counts['rejected'] += 1
+        on_reject(number, errors, record)
+
+    def flush(chunk):
+        inserted = write_chunk(model, chunk, reject)
+        counts['inserted'] += len(inserted)
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, {
+                **checkpoint,
+                'records': skipped + counts['records'],
+                'inserted': checkpoint['inserted'] + counts['inserted'],
+                'rejected': checkpoint['rejected'] + counts['rejected'],
+            })
+        # Core inserts bypass the session's commit notifications (they
+        # are logged for the other processes in write_chunk)
+        events.notify(events.Change('insert', model, values['id'], values) for values in inserted)
+
+    chunk = []
+    for position, (number, record) in enumerate(records):
+        if position < skipped:
+            continue
+        counts['records'] += 1
+        if isinstance(record, Reject):
+            reject(number, record.args[0], None)
+            continue
+        try:
+            chunk.append((number, clean(model, record)))
+        except Reject as error:
+            reject(number, error.args[0], record)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if counts['records']:
+        flush(chunk)
+    return ImportResult(counts['records'], counts['inserted'], counts['rejected'], skipped)
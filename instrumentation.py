@@ -0,0 +1,240 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import Response, before_render_template, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# SQL statement counting.
+#----------------------------------------------------------------------------#
+
+class QueryCounter:
+    def __init__(self):
+        self.statements = []
+        self.parameters = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def touches(self, table):
+        return any(f'"{table}"' in statement for statement in self.statements)
+
+
+_local = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.statements.append(statement)
+        counter.parameters.append(parameters)
+    if getattr(_local, 'profile', None) is not None:
+        conn.info.setdefault('statement_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    profile = getattr(_local, 'profile', None)
+    starts = conn.info.get('statement_start')
+    if profile is None or not starts:
+        return
+    # rowcount is the number of rows a SELECT returned on psycopg2's
+    # client-side cursors; streamed (server-side) results report -1
+    rows = cursor.rowcount if cursor.description is not None and cursor.rowcount > 0 else 0
+    profile.statement(statement, time.perf_counter() - starts.pop(), rows)
+
+
+@contextmanager
+def count_queries():
+    # Counters nest: every active counter on this thread sees the statement.
+    counter = QueryCounter()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+#----------------------------------------------------------------------------#
+# Request metrics.
+#
+# With METRICS_ENABLED every request records its endpoint, wall time, SQL
+# statement count and time, template render time and rows loaded. They
+# are kept as per-endpoint histograms in this process and served in the
+# Prometheus text format on /metrics; each worker process exposes its own.
+# Requests slower than SLOW_REQUEST_MS are logged with their statements.
+#
+# Wall time ends when the view returns: a streamed page's body is rendered
+# later and is not counted, nor is its template time.
+#----------------------------------------------------------------------------#
+
+class RequestProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.statements = []  # (statement, seconds)
+        self.sql_seconds = 0.0
+        self.rows = 0
+        self.template_seconds = 0.0
+        self.template_starts = []
+        self.status = 500
+
+    def statement(self, statement, seconds, rows):
+        self.statements.append((statement, seconds))
+        self.sql_seconds += seconds
+        self.rows += rows
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.series = {}  # endpoint -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self.lock:
+            series = self.series.get(endpoint)
+            if series is None:
+                series = self.series[endpoint] = [0] * len(self.buckets) + [0, 0]
+            bucket = bisect.bisect_left(self.buckets, value)
+            if bucket < len(self.buckets):
+                series[bucket] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for endpoint, series in sorted(self.series.items()):
+                cumulative = 0
+                for le, hits in zip(self.buckets, series):
+                    cumulative += hits
+                    lines.append(f'{self.name}_bucket{{endpoint="{endpoint}",le="{le}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{endpoint="{endpoint}",le="+Inf"}} {series[-1]}')
+                lines.append(f'{self.name}_sum{{endpoint="{endpoint}"}} {series[-2]:.6f}')
+                lines.append(f'{self.name}_count{{endpoint="{endpoint}"}} {series[-1]}')
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}  # (endpoint, status) -> count
+        self.lock = threading.Lock()
+
+    def inc(self, endpoint, status):
+        with self.lock:
+            self.values[endpoint, status] = self.values.get((endpoint, status), 0) + 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for (endpoint, status), value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{endpoint="{endpoint}",status="{status}"}} {value}')
+        return lines
+
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+ROW_BUCKETS = (0, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+requests_total = Counter('fyyur_requests_total', 'Requests by endpoint and status.')
+request_seconds = Histogram('fyyur_request_duration_seconds', 'Wall time of the view.', SECONDS_BUCKETS)
+sql_statements = Histogram('fyyur_request_sql_statements', 'SQL statements per request.', STATEMENT_BUCKETS)
+sql_seconds = Histogram('fyyur_request_sql_duration_seconds', 'Time spent in SQL per request.', SECONDS_BUCKETS)
+template_seconds = Histogram('fyyur_request_template_duration_seconds', 'Template render time per request.', SECONDS_BUCKETS)
+rows_loaded = Histogram('fyyur_request_rows', 'Rows returned by SQL per request.', ROW_BUCKETS)
+
+METRICS = (requests_total, request_seconds, sql_statements, sql_seconds, template_seconds, rows_loaded)
+
+
+# Other modules add their own lines to /metrics with @collector.
+_collectors = []
+
+
+def collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def exposition():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.exposition())
+    for fn in _collectors:
+        lines.extend(fn())
+    return '\n'.join(lines) + '\n'
+
+
+# Statements quoted in one slow-request log entry.
+SLOW_LOG_STATEMENTS = 50
+
+
+def log_slow_request(app, endpoint, seconds, profile):
+    lines = [
+        f'slow request {request.method} {request.full_path.rstrip("?")} ({endpoint}) {seconds * 1000:.1f}ms: '
+        f'{len(profile.statements)} statements in {profile.sql_seconds * 1000:.1f}ms, '
+        f'template {profile.template_seconds * 1000:.1f}ms, {profile.rows} rows'
+    ]
+    for statement, statement_seconds in profile.statements[:SLOW_LOG_STATEMENTS]:
+        lines.append(f'  {statement_seconds * 1000:8.1f}ms  {" ".join(statement.split())}')
+    if len(profile.statements) > SLOW_LOG_STATEMENTS:
+        lines.append(f'  ... and {len(profile.statements) - SLOW_LOG_STATEMENTS} more')
+    app.logger.warning('\n'.join(lines))
+
+
+def init_app(app):
+    if not app.config.get('METRICS_ENABLED'):
+        return
+
+    @app.before_request
+    def start_profile():
+        _local.profile = RequestProfile()
+
+    @app.after_request
+    def record_status(response):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            profile.status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        profile = getattr(_local, 'profile', None)
+        _local.profile = None
+        if profile is None:
+            return
+        seconds = time.perf_counter() - profile.start
+        endpoint = request.endpoint or 'unmatched'
+        requests_total.inc(endpoint, profile.status)
+        request_seconds.observe(endpoint, seconds)
+        sql_statements.observe(endpoint, len(profile.statements))
+        sql_seconds.observe(endpoint, profile.sql_seconds)
+        template_seconds.observe(endpoint, profile.template_seconds)
+        rows_loaded.observe(endpoint, profile.rows)
+        slow_ms = app.config.get('SLOW_REQUEST_MS')
+        if slow_ms and seconds * 1000 >= slow_ms:
+            log_slow_request(app, endpoint, seconds, profile)
+
+    def template_started(sender, template, context, **extra):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None:
+            profile.template_starts.append(time.perf_counter())
+
+    def template_finished(sender, template, context, **extra):
+        profile = getattr(_local, 'profile', None)
+        if profile is not None and profile.template_starts:
+            profile.template_seconds += time.perf_counter() - profile.template_starts.pop()
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(exposition(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,134 @@
+from bisect import bisect_left
+from collections import namedtuple
+from datetime import timedelta
+from sqlalchemy import literal_column, or_, select
+from models import db, Show
+from forms import SHOW_MINUTES
+
+#----------------------------------------------------------------------------#
+# Show bookings.
+#
+# A show occupies its venue and its artist over [start_time, start_time +
+# duration minutes). The database enforces that neither is booked twice at
+# once with GiST exclusion constraints over that range (see models.py);
+# this module finds the conflicts first so they can be reported, and
+# keeps bookings in memory to validate a whole import batch, rows within
+# the same file included, with one query.
+#
+# Every lookup is bounded by MAX_DURATION: a show overlapping [start, end)
+# starts after start - MAX_DURATION, which keeps it a range scan of the
+# (venue_id, start_time) and (artist_id, start_time) indexes.
+#----------------------------------------------------------------------------#
+
+# Longest show, in minutes.
+MAX_DURATION = SHOW_MINUTES[1]
+
+Booking = namedtuple('Booking', 'start end show_id')
+
+# the end of a show, as SQL
+SHOW_END = Show.start_time + Show.duration * literal_column("interval '1 minute'")
+
+OWNERS = {'venue_id': Show.venue_id, 'artist_id': Show.artist_id}
+
+
+class Schedule:
+    # one venue's or artist's bookings: disjoint intervals sorted by start,
+    # so their ends are sorted too and the only booking that can overlap
+    # [start, end) is the last one starting before end
+
+    def __init__(self):
+        self.starts = []
+        self.bookings = []
+
+    def conflict(self, start, end):
+        index = bisect_left(self.starts, end)
+        if index and self.bookings[index - 1].end > start:
+            return self.bookings[index - 1]
+        return None
+
+    def add(self, booking):
+        index = bisect_left(self.starts, booking.start)
+        self.starts.insert(index, booking.start)
+        self.bookings.insert(index, booking)
+
+    def free(self, start, end, length):
+        # (start, end) gaps of at least length between the bookings
+        gaps, cursor = [], start
+        for booking in self.bookings[max(0, bisect_left(self.starts, start) - 1):]:
+            if booking.start >= end:
+                break
+            if booking.start - cursor >= length:
+                gaps.append((cursor, booking.start))
+            cursor = max(cursor, booking.end)
+        if end - cursor >= length:
+            gaps.append((cursor, end))
+        return gaps
+
+
+class Bookings:
+    # the schedules of many venues and artists, for checking a batch
+
+    def __init__(self):
+        self.schedules = {}
+
+    def schedule(self, owner, id):
+        return self.schedules.setdefault((owner, id), Schedule())
+
+    def conflict(self, venue_id, artist_id, start, end):
+        # (owner column, Booking) of the first clash, or None
+        for owner, id in (('venue_id', venue_id), ('artist_id', artist_id)):
+            booking = self.schedule(owner, id).conflict(start, end)
+            if booking is not None:
+                return owner, booking
+        return None
+
+    def add(self, venue_id, artist_id, booking):
+        self.schedule('venue_id', venue_id).add(booking)
+        self.schedule('artist_id', artist_id).add(booking)
+
+
+def show_period(start, duration):
+    return start, start + timedelta(minutes=duration)
+
+
+#  Queries
+#  ----------------------------------------------------------------
+
+def bookings_query(owners, start, end):
+    # shows overlapping [start, end) of any of owners, {column: ids}
+    return (
+        select(Show.id, Show.venue_id, Show.artist_id, Show.start_time, SHOW_END.label('end_time'))
+        .where(or_(*[OWNERS[owner].in_(ids) for owner, ids in owners.items() if ids]))
+        .where(Show.start_time < end)
+        .where(Show.start_time > start - timedelta(minutes=MAX_DURATION))
+        .where(SHOW_END > start)
+        .order_by(Show.start_time)
+    )
+
+
+def load_bookings(owners, start, end):
+    bookings = Bookings()
+    for row in db.session.execute(bookings_query(owners, start, end)):
+        bookings.add(row.venue_id, row.artist_id, Booking(row.start_time, row.end_time, row.id))
+    return bookings
+
+
+def find_conflict(venue_id, artist_id, start, duration):
+    # (owner column, Booking) of a show clashing with a new one, or None
+    start, end = show_period(start, duration)
+    bookings = load_bookings({'venue_id': [venue_id], 'artist_id': [artist_id]}, start, end)
+    return bookings.conflict(venue_id, artist_id, start, end)
+
+
+def free_slots(venue_id, start, end, duration):
+    # the venue's free (start, end) periods between start and end that
+    # are long enough for a show of duration minutes
+    bookings = load_bookings({'venue_id': [venue_id]}, start, end)
+    return bookings.schedule('venue_id', venue_id).free(start, end, timedelta(minutes=duration))
+
+
+def describe(owner, booking):
+    what = 'The venue' if owner == 'venue_id' else 'The artist'
+    show = f'show {booking.show_id}' if booking.show_id else 'an earlier row'
+    return (f"{what} is already booked from {booking.start:%Y-%m-%d %H:%M} "
+            f"to {booking.end:%Y-%m-%d %H:%M} ({show}).")
@@ -0,0 +1,155 @@
+"""HTTP load test for comparing the WSGI and ASGI entry points.
+
+    flask run --with-threads --port 5000          # or any WSGI server
+    uvicorn asgi:app --port 8000 --workers 4
+    python loadtest.py http://127.0.0.1:5000 http://127.0.0.1:8000 --concurrency 200
+
+Each client keeps one keep-alive connection and requests the paths in turn
+until the time is up. Requests per second and latency percentiles are
+printed per target, then each target's throughput relative to the first.
+Uses only the standard library.
+"""
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = [
+    '/venues',
+    '/artists',
+    '/shows',
+    '/venues/1',
+    '/artists/1',
+    'POST /venues/search search_term=music',
+]
+
+
+#----------------------------------------------------------------------------#
+# Client.
+#----------------------------------------------------------------------------#
+
+def build_request(host, spec):
+    # 'PATH' or 'POST PATH form-body'
+    method, path, body = 'GET', spec, ''
+    if spec.startswith('POST '):
+        method, rest = 'POST', spec[5:]
+        path, _, body = rest.partition(' ')
+    headers = [f'{method} {path} HTTP/1.1', f'Host: {host}', 'Connection: keep-alive']
+    if method == 'POST':
+        headers += ['Content-Type: application/x-www-form-urlencoded', f'Content-Length: {len(body)}']
+    return ('\r\n'.join(headers) + '\r\n\r\n' + body).encode()
+
+
+async def read_response(reader):
+    # (status, keep the connection open)
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    version, status = lines[0].split(' ', 2)[:2]
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    elif 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    else:
+        await reader.read()
+        return int(status), False
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+    return int(status), keep_alive
+
+
+async def client(url, requests, deadline, stats):
+    parts = urlsplit(url)
+    connection = None
+    for request in itertools.cycle(requests):
+        if time.perf_counter() >= deadline:
+            break
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            reader, writer = connection
+            writer.write(request)
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            stats['errors'] += 1
+            keep_alive = False
+        else:
+            stats['latencies'].append(time.perf_counter() - start)
+            if status >= 400:
+                stats['failed'] += 1
+        if not keep_alive and connection is not None:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def run(url, paths, concurrency, duration):
+    host = urlsplit(url).netloc
+    requests = [build_request(host, path) for path in paths]
+    stats = {'latencies': [], 'errors': 0, 'failed': 0}
+    deadline = time.perf_counter() + duration
+    # clients start at different paths, so every path is under load at once
+    await asyncio.gather(*(
+        client(url, requests[i % len(requests):] + requests[:i % len(requests)], deadline, stats)
+        for i in range(concurrency)
+    ))
+    return stats
+
+
+#----------------------------------------------------------------------------#
+# Report.
+#----------------------------------------------------------------------------#
+
+def percentile(samples, p):
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))] if samples else 0.0
+
+
+def report(url, stats, duration):
+    latencies = sorted(stats['latencies'])
+    rps = len(latencies) / duration
+    print(f'{url}: {len(latencies)} requests, {rps:.1f} req/s, '
+          f'{stats["failed"]} >= 400, {stats["errors"]} errors, '
+          + ' '.join(f'p{p}={percentile(latencies, p) * 1000:.1f}ms' for p in (50, 95, 99)))
+    return rps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('urls', nargs='+', help='base URL of each server to compare')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--duration', type=float, default=30, help='seconds per target')
+    parser.add_argument('--warmup', type=float, default=3, help='seconds of untimed load first')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help="'PATH' or 'POST PATH form-body', repeatable; default: the read-heavy pages")
+    args = parser.parse_args(argv)
+    paths = args.paths or DEFAULT_PATHS
+
+    results = []
+    for url in args.urls:
+        url = url.rstrip('/')
+        if args.warmup:
+            asyncio.run(run(url, paths, args.concurrency, args.warmup))
+        stats = asyncio.run(run(url, paths, args.concurrency, args.duration))
+        results.append((url, report(url, stats, args.duration), stats))
+    if len(results) > 1:
+        base = results[0][1] or 1
+        for url, rps, _ in results[1:]:
+            print(f'{url}: {rps / base:.2f}x the throughput of {results[0][0]}')
+    return 0 if all(not stats['errors'] for _, _, stats in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
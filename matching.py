@@ -0,0 +1,272 @@
+import threading
+from datetime import datetime
+import numpy as np
+from sqlalchemy import func, select
+from models import db, Venue, Artist, Show
+from enums import Genre
+import events
+
+#----------------------------------------------------------------------------#
+# Venue and artist matchmaking.
+#
+# Ranks the artists seeking a venue (Artist.venue) for a venue, and the
+# venues seeking talent (Venue.talent) for an artist. A candidate scores
+#
+#   WEIGHTS['genre']    * shared genres / genres of either (Jaccard)
+#   WEIGHTS['city']     if in the same city
+#   WEIGHTS['state']    if in the same state
+#   WEIGHTS['history']  * past shows together, up to HISTORY_CAP
+#
+# Each side is a Pool: the rows seeking, precomputed as columns of a genre
+# one-hot matrix (genre-major, so a subject's few genres are a few
+# contiguous rows) and interned city and state codes, so scoring every
+# candidate is a handful of vector operations and a partial sort. Only the
+# co-booking history, one grouped query over the (owner, start_time)
+# index, and the top rows' names come from the database. Pools are built
+# on the first request and then updated row by row from commit
+# notifications, replaying those that arrive while a build reads the rows.
+#----------------------------------------------------------------------------#
+
+WEIGHTS = {'genre': 0.5, 'city': 0.2, 'state': 0.1, 'history': 0.2}
+HISTORY_CAP = 5
+
+MAX_LIMIT = 100
+
+GENRES = [genre.value for genre in Genre]
+GENRE_INDEX = {genre: index for index, genre in enumerate(GENRES)}
+
+# model -> its seeking column, the Show column pointing at it
+SEEKING = {Venue: Venue.talent, Artist: Artist.venue}
+OWNERS = {Venue: Show.venue_id, Artist: Show.artist_id}
+OTHER = {Venue: Artist, Artist: Venue}
+
+
+class Places:
+    # interned codes for cities and states, shared by both pools
+
+    def __init__(self):
+        self.codes = {}
+        self.lock = threading.Lock()
+
+    def code(self, key):
+        if key is None:
+            return -1
+        with self.lock:
+            return self.codes.setdefault(key, len(self.codes))
+
+    def city(self, city, state):
+        if not city:
+            return -1
+        return self.code(('city', city.strip().lower(), (state or '').upper()))
+
+    def state(self, state):
+        return self.code(('state', state.upper())) if state else -1
+
+
+places = Places()
+
+
+def genre_vector(genres):
+    vector = np.zeros(len(GENRES), dtype=np.float32)
+    for genre in genres or ():
+        index = GENRE_INDEX.get(genre)
+        if index is not None:
+            vector[index] = 1
+    return vector
+
+
+class Pool(events.ReplayingIndex):
+    # the seeking rows of one model, the candidate list, as parallel
+    # arrays sorted by id
+
+    def __init__(self):
+        super().__init__()
+        self._allocate(0)
+
+    def _allocate(self, capacity, size=0):
+        self.size = size
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.genres = np.zeros((len(GENRES), capacity), dtype=np.float32)
+        self.genre_counts = np.zeros(capacity, dtype=np.float32)
+        self.cities = np.full(capacity, -1, dtype=np.int32)
+        self.states = np.full(capacity, -1, dtype=np.int32)
+
+    def _columns(self):
+        # every array, indexed by position along its last axis
+        return self.ids, self.genres, self.genre_counts, self.cities, self.states
+
+    def _load(self, rows):
+        # rows of (id, city, state, genres, seeking) in id order, into a
+        # fresh pool; the columns are filled whole rather than row by row
+        ids, cities, states, one_rows, one_columns = [], [], [], [], []
+        for id, city, state, genres, seeking in rows:
+            if not seeking:
+                continue
+            for genre in set(genres or ()):
+                if genre in GENRE_INDEX:
+                    one_rows.append(len(ids))
+                    one_columns.append(GENRE_INDEX[genre])
+            ids.append(id)
+            cities.append(places.city(city, state))
+            states.append(places.state(state))
+        pool = Pool()
+        pool._allocate(len(ids), len(ids))
+        pool.ids[:] = ids
+        pool.genres[one_columns, one_rows] = 1
+        pool.genre_counts[:] = pool.genres.sum(axis=0)
+        pool.cities[:] = cities
+        pool.states[:] = states
+        return {
+            'size': pool.size, 'ids': pool.ids, 'genres': pool.genres,
+            'genre_counts': pool.genre_counts, 'cities': pool.cities, 'states': pool.states,
+        }
+
+    def _position(self, id):
+        position = int(np.searchsorted(self.ids[:self.size], id))
+        return position, position < self.size and self.ids[position] == id
+
+    def _grow(self):
+        old = self._columns()
+        self._allocate(max(16, len(self.ids) * 2), self.size)
+        for new, previous in zip(self._columns(), old):
+            new[..., :previous.shape[-1]] = previous
+
+    def _put(self, id, city, state, genres, seeking):
+        if not seeking:
+            self._discard(id)
+            return
+        position, found = self._position(id)
+        if not found:
+            if self.size == len(self.ids):
+                self._grow()
+            # new ids are mostly the largest, this rarely moves anything
+            for column in self._columns():
+                column[..., position + 1:self.size + 1] = column[..., position:self.size].copy()
+            self.size += 1
+        vector = genre_vector(genres)
+        self.ids[position] = id
+        self.genres[:, position] = vector
+        self.genre_counts[position] = vector.sum()
+        self.cities[position] = places.city(city, state)
+        self.states[position] = places.state(state)
+
+    def _discard(self, id):
+        position, found = self._position(id)
+        if found:
+            for column in self._columns():
+                column[..., position:self.size - 1] = column[..., position + 1:self.size].copy()
+            self.size -= 1
+
+    def _apply(self, change):
+        if change.op == 'delete':
+            self._discard(change.id)
+            return
+        values = change.values
+        seeking = SEEKING[change.model].key
+        if all(key in values for key in ('city', 'state', 'genres', seeking)):
+            self._put(change.id, values['city'], values['state'], values['genres'], values[seeking])
+
+    def top(self, genres, city, state, history, limit):
+        # [(id, score)] of the best candidates; history is {id: past shows
+        # together}
+        wanted = [GENRE_INDEX[genre] for genre in set(genres or ()) if genre in GENRE_INDEX]
+        city, state = places.city(city, state), places.state(state)
+        with self.lock:
+            size = self.size
+            limit = min(limit, size)
+            if not limit:
+                return []
+            ids = self.ids[:size]
+            if wanted:
+                shared = self.genres[wanted[0], :size].copy()
+                for genre in wanted[1:]:
+                    shared += self.genres[genre, :size]
+                union = self.genre_counts[:size] + np.float32(len(wanted)) - shared
+                scores = np.float32(WEIGHTS['genre']) * shared / union
+            else:
+                scores = np.zeros(size, dtype=np.float32)
+            if city >= 0:
+                scores += np.float32(WEIGHTS['city']) * (self.cities[:size] == city)
+            if state >= 0:
+                scores += np.float32(WEIGHTS['state']) * (self.states[:size] == state)
+            if history:
+                other_ids = np.fromiter(history, dtype=np.int64, count=len(history))
+                counts = np.fromiter(history.values(), dtype=np.float32, count=len(history))
+                positions = np.searchsorted(ids, other_ids)
+                known = positions < size
+                known[known] = ids[positions[known]] == other_ids[known]
+                scores[positions[known]] += WEIGHTS['history'] * np.minimum(counts[known], HISTORY_CAP) / HISTORY_CAP
+            best = np.argpartition(-scores, limit - 1)[:limit]
+            # highest score first, lowest id on ties
+            best = best[np.lexsort((ids[best], -scores[best]))]
+            return [(int(ids[index]), round(float(scores[index]), 4)) for index in best]
+
+
+pools = {Venue: Pool(), Artist: Pool()}
+
+
+def _columns(model):
+    return model.id, model.city, model.state, model.genres, SEEKING[model]
+
+
+# One build at a time, so each replays the commits made during its reads.
+_building = threading.Lock()
+
+
+def build():
+    with _building:
+        for model, pool in pools.items():
+            pool.begin()
+            pool.build(db.session.execute(
+                select(*_columns(model)).order_by(model.id).execution_options(stream_results=True, yield_per=10000)
+            ))
+
+
+def history(model, id, now):
+    # {other side's id: past shows together} for a venue or an artist
+    owner, other = OWNERS[model], OWNERS[OTHER[model]]
+    rows = db.session.execute(
+        select(other, func.count(Show.id))
+        .where(owner == id, Show.start_time <= now)
+        .group_by(other)
+    )
+    return dict(rows.all())
+
+
+def recommend(model, id, limit=20, now=None):
+    # [(candidate row, score, past shows together)] for the venue or
+    # artist id, candidates from the other side; None if there is no such row
+    row = db.session.execute(select(*_columns(model)).where(model.id == id)).one_or_none()
+    if row is None:
+        return None
+    other = OTHER[model]
+    pool = pools[other]
+    if not pool.ready:
+        build()
+    together = history(model, id, now or datetime.now())
+    ranked = pool.top(row.genres, row.city, row.state, together, min(limit, MAX_LIMIT))
+    details = {
+        candidate.id: candidate for candidate in db.session.execute(
+            select(other.id, other.name, other.city, other.state, other.genres)
+            .where(other.id.in_([candidate_id for candidate_id, _ in ranked]))
+        )
+    }
+    return [
+        (details[candidate_id], score, together.get(candidate_id, 0))
+        for candidate_id, score in ranked if candidate_id in details
+    ]
+
+
+@events.on_change
+def _update_pools(changes):
+    for change in changes:
+        pool = pools.get(change.model)
+        if pool is not None:
+            pool.apply(change)
+
+
+def init_app(app):
+
+    @app.before_first_request
+    def build_matching_pools():
+        build()
@@ -0,0 +1,44 @@
+"""Add upcoming and past show counters to Venue and Artist.
+
+Revision ID: 3f9a6c1d2b87
+Revises: 8c3d41f07e2b
+Create Date: 2026-10-18 17:55:40.312907
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a6c1d2b87'
+down_revision = '8c3d41f07e2b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    clock = op.create_table(
+        'CounterClock',
+        sa.Column('name', sa.String(length=40), nullable=False),
+        sa.Column('as_of', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    now = datetime.now()
+    op.bulk_insert(clock, [{'name': 'shows', 'as_of': now}])
+    for table, owner in (('Venue', 'venue_id'), ('Artist', 'artist_id')):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        # existing shows, counted around the clock's starting time
+        op.execute(sa.text(f'''
+            UPDATE "{table}" SET
+              upcoming_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{owner} = "{table}".id AND start_time > :now),
+              past_shows_count = (SELECT count(*) FROM "Show" WHERE "Show".{owner} = "{table}".id AND start_time <= :now)
+        ''').bindparams(now=now))
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
+    op.drop_table('CounterClock')
@@ -0,0 +1,36 @@
+"""Search indexes on venue and artist names, cities and genres.
+
+Revision ID: 5b1e7c2f9a41
+Revises: dc360b6e1372
+Create Date: 2026-10-18 09:12:40.215873
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e7c2f9a41'
+down_revision = 'dc360b6e1372'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in ('Venue', 'Artist'):
+        for column in ('name', 'city'):
+            op.create_index(
+                f'ix_{table}_{column}_trgm', table, [column],
+                postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+            )
+        op.create_index(f'ix_{table}_state_upper', table, [sa.text('upper(state)')])
+        op.create_index(f'ix_{table}_genres', table, ['genres'], postgresql_using='gin')
+
+
+def downgrade():
+    for table in ('Artist', 'Venue'):
+        op.drop_index(f'ix_{table}_genres', table_name=table)
+        op.drop_index(f'ix_{table}_state_upper', table_name=table)
+        for column in ('city', 'name'):
+            op.drop_index(f'ix_{table}_{column}_trgm', table_name=table)
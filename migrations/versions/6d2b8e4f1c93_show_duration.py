@@ -0,0 +1,60 @@
+"""Show duration, and exclusion constraints against double bookings.
+
+Revision ID: 6d2b8e4f1c93
+Revises: a47e2d9c0b15
+Create Date: 2026-10-18 21:42:17.318520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2b8e4f1c93'
+down_revision = 'a47e2d9c0b15'
+branch_labels = None
+depends_on = None
+
+PERIOD = "tsrange(start_time, start_time + duration * interval '1 minute')"
+
+# Overlapping pairs of shows reported when the constraints can't be added.
+CONFLICTS_SHOWN = 20
+
+
+def conflicts(owner):
+    # pairs of shows of one venue or artist that overlap
+    return op.get_bind().execute(sa.text(f'''
+        SELECT a.id, b.id FROM "Show" a JOIN "Show" b
+          ON b.{owner} = a.{owner} AND b.id > a.id
+         AND b.start_time > a.start_time - interval '1 day'
+         AND b.start_time < a.start_time + a.duration * interval '1 minute'
+         AND a.start_time < b.start_time + b.duration * interval '1 minute'
+        ORDER BY a.id, b.id
+    ''')).fetchall()
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    op.add_column('Show', sa.Column('duration', sa.Integer(), server_default='120', nullable=False))
+    found = {owner: conflicts(owner) for owner in ('venue_id', 'artist_id')}
+    if any(found.values()):
+        pairs = '\n'.join(
+            f'  {owner} shows {a} and {b}'
+            for owner, rows in found.items() for a, b in rows[:CONFLICTS_SHOWN]
+        )
+        raise RuntimeError(
+            'Shows overlap and the exclusion constraints cannot be added; move, '
+            'shorten or delete one show of each pair and upgrade again:\n' + pairs
+        )
+    # as SQL: op.create_exclude_constraint takes columns, not expressions
+    for owner in ('venue', 'artist'):
+        op.execute(
+            f'ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{owner}_period" '
+            f'EXCLUDE USING gist ({owner}_id WITH =, {PERIOD} WITH &&)'
+        )
+
+
+def downgrade():
+    for owner in ('artist', 'venue'):
+        op.drop_constraint(f'ex_Show_{owner}_period', 'Show')
+    op.drop_column('Show', 'duration')
@@ -0,0 +1,37 @@
+"""ShowDay: shows per day in each venue city, for the month calendar.
+
+Revision ID: 9e4c7b2a5d18
+Revises: 6d2b8e4f1c93
+Create Date: 2026-10-18 23:05:41.207913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4c7b2a5d18'
+down_revision = '6d2b8e4f1c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ShowDay',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('state', sa.String(length=120), nullable=False),
+        sa.Column('city', sa.String(length=120), nullable=False),
+        sa.Column('shows', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day', 'state', 'city')
+    )
+    op.execute('''
+        INSERT INTO "ShowDay" (day, state, city, shows)
+        SELECT date("Show".start_time), "Venue".state, "Venue".city, count(*)
+          FROM "Show" JOIN "Venue" ON "Venue".id = "Show".venue_id
+         GROUP BY 1, 2, 3
+    ''')
+
+
+def downgrade():
+    op.drop_table('ShowDay')
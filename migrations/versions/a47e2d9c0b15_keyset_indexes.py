@@ -0,0 +1,47 @@
+"""Indexes for the show partitions and the keyset listings, and DeleteStamp.
+
+Revision ID: a47e2d9c0b15
+Revises: 3f9a6c1d2b87
+Create Date: 2026-10-18 18:20:03.904116
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a47e2d9c0b15'
+down_revision = '3f9a6c1d2b87'
+branch_labels = None
+depends_on = None
+
+# name -> (table, columns)
+INDEXES = {
+    'ix_Show_venue_id_start_time': ('Show', ['venue_id', 'start_time', 'id']),
+    'ix_Show_artist_id_start_time': ('Show', ['artist_id', 'start_time', 'id']),
+    'ix_Show_start_time': ('Show', ['start_time', 'id']),
+    'ix_Venue_city_state': ('Venue', ['city', 'state', 'id']),
+    'ix_Venue_name': ('Venue', ['name', 'id']),
+    'ix_Artist_name': ('Artist', ['name', 'id']),
+}
+
+
+def upgrade():
+    # replaces the row counts in the listings' ETag versions, see etags.py
+    op.create_table(
+        'DeleteStamp',
+        sa.Column('name', sa.String(length=40), nullable=False),
+        sa.Column('deleted_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('name')
+    )
+    # built concurrently, so the tables stay writable meanwhile
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in INDEXES.items():
+            op.create_index(name, table, columns, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, (table, columns) in reversed(list(INDEXES.items())):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    op.drop_table('DeleteStamp')
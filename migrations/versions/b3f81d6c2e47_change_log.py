@@ -0,0 +1,36 @@
+"""ChangeLog: rows each transaction changed, read by the other processes.
+
+Revision ID: b3f81d6c2e47
+Revises: 9e4c7b2a5d18
+Create Date: 2026-10-18 23:48:19.533180
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b3f81d6c2e47'
+down_revision = '9e4c7b2a5d18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'ChangeLog',
+        sa.Column('id', sa.BigInteger(), nullable=False),
+        sa.Column('txid', sa.BigInteger(), server_default=sa.text('txid_current()'), nullable=False),
+        sa.Column('model', sa.String(length=40), nullable=False),
+        sa.Column('row_id', sa.Integer(), nullable=False),
+        sa.Column('logged_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_ChangeLog_txid'), 'ChangeLog', ['txid'], unique=False)
+    op.create_index(op.f('ix_ChangeLog_logged_at'), 'ChangeLog', ['logged_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_ChangeLog_logged_at'), table_name='ChangeLog')
+    op.drop_index(op.f('ix_ChangeLog_txid'), table_name='ChangeLog')
+    op.drop_table('ChangeLog')
@@ -1,5 +1,7 @@
-from flask_sqlalchemy import SQLAlchemy
-db = SQLAlchemy()
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from replicas import RoutingSQLAlchemy
+db = RoutingSQLAlchemy()
 
 # TODO: connect to a local postgresql database
 
@@ -21,7 +23,11 @@ class Venue(db.Model):
     website = db.Column(db.String(120))
     talent = db.Column(db.Boolean,  default=False)
     description = db.Column(db.String(120))
-    shows = db.relationship('Show', backref='venue', lazy='joined', cascade="all, delete")
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows = db.relationship('Show', backref='venue', lazy='select', cascade="all, delete")
 
     def __repr__(self):
       return f'<venue_id: {self.id}, name: {self.name} >'
@@ -42,7 +48,11 @@ class Artist(db.Model):
     venue = db.Column(db.Boolean, default=False)
     website = db.Column(db.String(120))
     description = db.Column(db.String(120))
-    shows = db.relationship('Show', backref='artist', lazy='joined', cascade="all, delete")
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    # maintained by counters.py
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    shows = db.relationship('Show', backref='artist', lazy='select', cascade="all, delete")
   
     def __repr__(self):
       return f'<artist: {self.id}, name: {self.name} >'
@@ -55,10 +65,89 @@ class Show(db.Model):
   venue_id = db.Column(db.Integer, db.ForeignKey('Venue.id'), nullable=False)
   artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
   start_time = db.Column(db.DateTime, nullable=False)
+  duration = db.Column(db.Integer, nullable=False, default=120, server_default='120')  # minutes
+  updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
   def __repr__(self):
     return f'<show_id: {self.id}, venue_id: {self.venue_id}, artist_id: {self.artist_id} >'
       
 # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+
+class CounterClock(db.Model):
+  # the time the show counters were last rolled forward to, see counters.py
+  __tablename__ = 'CounterClock'
+  name = db.Column(db.String(40), primary_key=True)
+  as_of = db.Column(db.DateTime, nullable=False)
+
+
+class DeleteStamp(db.Model):
+  # when rows were last deleted from a table, see etags.py
+  __tablename__ = 'DeleteStamp'
+  name = db.Column(db.String(40), primary_key=True)
+  deleted_at = db.Column(db.DateTime, nullable=False)
+
+
+class ShowDay(db.Model):
+  # shows per day in each venue city, see calendars.py
+  __tablename__ = 'ShowDay'
+  day = db.Column(db.Date, primary_key=True)
+  state = db.Column(db.String(120), primary_key=True)
+  city = db.Column(db.String(120), primary_key=True)
+  shows = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeLog(db.Model):
+  # rows each transaction changed, for the other processes, see events.py
+  __tablename__ = 'ChangeLog'
+  id = db.Column(db.BigInteger, primary_key=True)
+  txid = db.Column(db.BigInteger, nullable=False, server_default=db.text('txid_current()'), index=True)
+  model = db.Column(db.String(40), nullable=False)
+  row_id = db.Column(db.Integer, nullable=False)
+  logged_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), index=True)
+
+#----------------------------------------------------------------------------#
+# Indexes.
+#----------------------------------------------------------------------------#
+
+def _add_search_indexes(model):
+    # see search.py: trigram indexes for substring matches on name and city,
+    # upper(state) for state codes, GIN over genres for genre matches
+    table = model.__tablename__
+    for column in ('name', 'city'):
+        db.Index(
+            f'ix_{table}_{column}_trgm', getattr(model, column),
+            postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'}
+        )
+    db.Index(f'ix_{table}_state_upper', db.func.upper(model.state))
+    db.Index(f'ix_{table}_genres', model.genres, postgresql_using='gin')
+
+_add_search_indexes(Venue)
+_add_search_indexes(Artist)
+
+# Keyset orderings (see queries.py): each index ends with the listing's
+# sort keys, so a page is an index range scan with no sort.
+db.Index('ix_Show_venue_id_start_time', Show.venue_id, Show.start_time, Show.id)
+db.Index('ix_Show_artist_id_start_time', Show.artist_id, Show.start_time, Show.id)
+db.Index('ix_Show_start_time', Show.start_time, Show.id)
+db.Index('ix_Venue_city_state', Venue.city, Venue.state, Venue.id)
+db.Index('ix_Venue_name', Venue.name, Venue.id)
+db.Index('ix_Artist_name', Artist.name, Artist.id)
+
+#----------------------------------------------------------------------------#
+# Constraints.
+#----------------------------------------------------------------------------#
+
+# A venue or an artist plays one show at a time: no two shows of either may
+# overlap over [start_time, start_time + duration). GiST needs btree_gist
+# for the = on the id; see intervals.py for the checks that report a clash
+# before the constraint rejects it.
+SHOW_PERIOD = "tsrange(start_time, start_time + duration * interval '1 minute')"
+
+for _owner in ('venue', 'artist'):
+    Show.__table__.append_constraint(ExcludeConstraint(
+        (Show.__table__.c[f'{_owner}_id'], '='), (db.text(SHOW_PERIOD), '&&'),
+        name=f'ex_Show_{_owner}_period', using='gist'
+    ))
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
\ No newline at end of file
@@ -0,0 +1,389 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import noload, raiseload
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Read queries.
+#
+# Statements are built with Core `select()` so the same query can be run by
+# the Flask views and anything else holding a connection; the `*_query`
+# functions only build SQL, the plain functions execute it and shape rows
+# into the dicts the templates expect.
+#----------------------------------------------------------------------------#
+
+
+#  Relationship loading profiles
+#  ----------------------------------------------------------------
+#
+#  Relationships are lazy by default; each view picks how much of the
+#  object graph it needs and applies it with `Model.query.options(...)`:
+#
+#    'raise'     fail loudly if the view touches a relationship
+#    'none'      never load relationships, accessing them yields empty
+
+def load_profile(profile):
+    if profile == 'raise':
+        return [raiseload('*')]
+    if profile == 'none':
+        return [noload('*')]
+    raise ValueError(f'unknown loading profile: {profile!r}')
+
+
+#  Keyset pagination
+#  ----------------------------------------------------------------
+#
+#  Pages are addressed by an opaque cursor holding the sort key of the
+#  first or last row shown, so fetching page N costs the same as page 1.
+#  `keys` must end with a unique column to make the ordering total.
+
+PAGE_SIZE = 50
+
+
+class Page:
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    raise TypeError(f'cannot encode {value!r} in a cursor')
+
+
+def _decode_value(value):
+    if set(value) == {'dt'}:
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), default=_encode_value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys=None):
+    # the cursor's values; with keys, one value of the right type per key
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        values = json.loads(raw, object_hook=_decode_value)
+    except (ValueError, TypeError):
+        raise ValueError(f'invalid cursor: {cursor!r}')
+    if keys is not None and not (
+        isinstance(values, list) and len(values) == len(keys) and all(
+            # JSON true is a Python int too, but never a key
+            isinstance(value, key.type.python_type) and not isinstance(value, bool)
+            for value, key in zip(values, keys)
+        )
+    ):
+        raise ValueError(f'invalid cursor: {cursor!r}')
+    return values
+
+
+def keyset_filter(stmt, keys, after=None, before=None, descending=False):
+    # Narrows stmt to the rows after (or before) a cursor and orders it so
+    # the rows closest to the cursor come first. With descending=True the
+    # listing runs from the largest key down and "after" means smaller.
+    backwards = before is not None
+    cursor = before if backwards else after
+    if cursor is not None:
+        key, values = tuple_(*keys), tuple_(*decode_cursor(cursor, keys))
+        stmt = stmt.where(key < values if backwards != descending else key > values)
+    if backwards != descending:
+        return stmt.order_by(*[key.desc() for key in keys])
+    return stmt.order_by(*keys)
+
+
+def keyset_query(stmt, keys, after=None, before=None, limit=PAGE_SIZE, descending=False):
+    # one row past the page tells keyset_rows whether there is more
+    return keyset_filter(stmt, keys, after, before, descending).limit(limit + 1)
+
+
+def keyset_rows(rows, keys, after=None, before=None, limit=PAGE_SIZE):
+    # the Page for the rows keyset_query returned
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        rows.reverse()
+
+    def cursor(row):
+        # by name: rows from the asyncpg engine (asgi.py) don't map columns
+        return encode_cursor(row._mapping[key.key] for key in keys)
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if has_more or before is not None:
+            next_cursor = cursor(rows[-1])
+        if after is not None or (before is not None and has_more):
+            prev_cursor = cursor(rows[0])
+    return Page(rows, next_cursor, prev_cursor)
+
+
+def keyset_page(stmt, keys, after=None, before=None, limit=PAGE_SIZE, descending=False):
+    rows = db.session.execute(keyset_query(stmt, keys, after, before, limit, descending)).all()
+    return keyset_rows(rows, keys, after, before, limit)
+
+
+def keyset_stream(stmt, keys, after=None, chunk_size=PAGE_SIZE):
+    # Every row from the cursor onwards, fetched through a server-side
+    # cursor so memory stays bounded however large the table is.
+    result = db.session.execute(
+        keyset_filter(stmt, keys, after)
+        .execution_options(stream_results=True, yield_per=chunk_size)
+    )
+    yield from result
+
+
+#  Venues
+#  ----------------------------------------------------------------
+
+VENUE_AREA_KEYS = (Venue.city, Venue.state, Venue.id)
+
+
+def venue_areas_query():
+    # Every venue with its count of upcoming shows, read from the counter
+    # counters.py maintains, so the Show table is not scanned. Ordering by
+    # VENUE_AREA_KEYS keeps venues of a city next to each other.
+    return select(
+        Venue.city,
+        Venue.state,
+        Venue.id,
+        Venue.name,
+        Venue.upcoming_shows_count.label('num_upcoming_shows')
+    )
+
+
+def group_areas(rows):
+    area = None
+    for row in rows:
+        if area is None or (area['city'], area['state']) != (row.city, row.state):
+            if area is not None:
+                yield area
+            area = {
+                "city": row.city,
+                "state": row.state,
+                "venues": []
+            }
+        area['venues'].append({
+            "id": row.id,
+            "name": row.name,
+            "num_upcoming_shows": row.num_upcoming_shows
+        })
+    if area is not None:
+        yield area
+
+
+def venue_areas():
+    stmt = venue_areas_query().order_by(*VENUE_AREA_KEYS)
+    return list(group_areas(db.session.execute(stmt)))
+
+
+def venue_areas_page(after=None, before=None, limit=PAGE_SIZE, filters=()):
+    # filters are WHERE clauses on Venue, see facets.py
+    page = keyset_page(venue_areas_query().where(*filters), VENUE_AREA_KEYS, after, before, limit)
+    page.items = list(group_areas(page.items))
+    return page
+
+
+def venue_areas_stream(after=None, filters=()):
+    return group_areas(keyset_stream(venue_areas_query().where(*filters), VENUE_AREA_KEYS, after))
+
+
+#  Artists
+#  ----------------------------------------------------------------
+
+ARTIST_KEYS = (Artist.name, Artist.id)
+
+
+def artists_query():
+    return select(Artist.id, Artist.name)
+
+
+def artists_page(after=None, before=None, limit=PAGE_SIZE, filters=()):
+    return keyset_page(artists_query().where(*filters), ARTIST_KEYS, after, before, limit)
+
+
+def artists_stream(after=None, filters=()):
+    return keyset_stream(artists_query().where(*filters), ARTIST_KEYS, after)
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+SHOW_KEYS = (Show.start_time, Show.id)
+
+
+def shows_query():
+    return (
+        select(
+            Show.id,
+            Show.start_time,
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link')
+        )
+        .join(Venue, Venue.id == Show.venue_id)
+        .join(Artist, Artist.id == Show.artist_id)
+    )
+
+
+def shows_page(after=None, before=None, limit=PAGE_SIZE, filters=()):
+    # filters are WHERE clauses on Show, Venue and Artist, see calendars.py
+    return keyset_page(shows_query().where(*filters), SHOW_KEYS, after, before, limit)
+
+
+def shows_stream(after=None, filters=()):
+    return keyset_stream(shows_query().where(*filters), SHOW_KEYS, after)
+
+
+#  Detail pages
+#  ----------------------------------------------------------------
+#
+#  A venue or artist page needs its shows split into past and upcoming
+#  around one reference timestamp. Each partition is one query that joins
+#  only the columns the page shows from the other side and carries the
+#  partition's total as a window count, so the page costs two queries
+#  however long the history is. `limit` caps each partition; the rest is
+#  reachable through the partition's next cursor.
+
+PARTITIONS = ('past', 'upcoming')
+
+# Upper bound on one partition when no limit is asked for.
+MAX_PARTITION_SIZE = 10000
+
+
+def venue_shows_select():
+    # a venue's shows with the artist columns its page shows
+    return (
+        select(
+            Show.id,
+            Show.start_time,
+            Show.artist_id,
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link')
+        )
+        .join(Artist, Artist.id == Show.artist_id)
+    )
+
+
+def venue_shows_query(venue_id):
+    return venue_shows_select().where(Show.venue_id == venue_id)
+
+
+def artist_shows_select():
+    return (
+        select(
+            Show.id,
+            Show.start_time,
+            Show.venue_id,
+            Venue.name.label('venue_name'),
+            Venue.image_link.label('venue_image_link')
+        )
+        .join(Venue, Venue.id == Show.venue_id)
+    )
+
+
+def artist_shows_query(artist_id):
+    return artist_shows_select().where(Show.artist_id == artist_id)
+
+
+def show_partition_query(stmt, partition, now, after=None, limit=None):
+    # Past shows run newest first, upcoming shows soonest first.
+    if partition == 'past':
+        stmt = stmt.where(Show.start_time <= now)
+    elif partition == 'upcoming':
+        stmt = stmt.where(Show.start_time > now)
+    else:
+        raise ValueError(f'unknown show partition: {partition!r}')
+    stmt = stmt.add_columns(func.count().over().label('partition_count'))
+    return keyset_query(
+        stmt, SHOW_KEYS, after=after, limit=limit or MAX_PARTITION_SIZE,
+        descending=partition == 'past'
+    )
+
+
+def show_partition(stmt, partition, now, after=None, limit=None):
+    rows = db.session.execute(show_partition_query(stmt, partition, now, after, limit)).all()
+    return keyset_rows(rows, SHOW_KEYS, after=after, limit=limit or MAX_PARTITION_SIZE)
+
+
+def show_row(row):
+    show = dict(row._mapping)
+    del show['partition_count']
+    return show
+
+
+def set_show_partition(data, partition, page):
+    data[f'{partition}_shows'] = [show_row(row) for row in page]
+    data[f'{partition}_shows_count'] = page.items[0].partition_count if page.items else 0
+    data[f'{partition}_shows_next'] = page.next_cursor
+    return data
+
+
+def add_show_partitions(data, stmt, now, limit=None):
+    for partition in PARTITIONS:
+        set_show_partition(data, partition, show_partition(stmt, partition, now, limit=limit))
+    return data
+
+
+# Payload field -> column, shared by the HTML pages and /api/v1. The
+# *_data functions read the columns as attributes, so they take a model
+# instance or a row selected from these columns alike.
+
+VENUE_FIELDS = {
+    "id": Venue.id,
+    "name": Venue.name,
+    "genres": Venue.genres,
+    "address": Venue.address,
+    "city": Venue.city,
+    "state": Venue.state,
+    "phone": Venue.phone,
+    "website": Venue.website,
+    "facebook_link": Venue.facebook_link,
+    "seeking_talent": Venue.talent,
+    "seeking_description": Venue.description,
+    "image_link": Venue.image_link
+}
+
+ARTIST_FIELDS = {
+    "id": Artist.id,
+    "name": Artist.name,
+    "genres": Artist.genres,
+    "city": Artist.city,
+    "state": Artist.state,
+    "phone": Artist.phone,
+    "website": Artist.website,
+    "facebook_link": Artist.facebook_link,
+    "seeking_venue": Artist.venue,
+    "seeking_description": Artist.description,
+    "image_link": Artist.image_link
+}
+
+
+def fields_data(obj, fields):
+    return {field: getattr(obj, column.key) for field, column in fields.items()}
+
+
+def venue_data(venue, fields=VENUE_FIELDS):
+    return fields_data(venue, fields)
+
+
+def artist_data(artist, fields=ARTIST_FIELDS):
+    return fields_data(artist, fields)
+
+
+def venue_detail(venue, now, limit=None):
+    return add_show_partitions(venue_data(venue), venue_shows_query(venue.id), now, limit)
+
+
+def artist_detail(artist, now, limit=None):
+    return add_show_partitions(artist_data(artist), artist_shows_query(artist.id), now, limit)
@@ -0,0 +1,156 @@
+import itertools
+import threading
+from flask import g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.engine import make_url
+import instrumentation
+
+#----------------------------------------------------------------------------#
+# Connection pools and read replicas.
+#
+# The pool settings in config.py (DATABASE_POOL_*) become the engine
+# options of the primary and of every replica. With DATABASE_REPLICA_URLS
+# set, the endpoints in READ_ENDPOINTS run their SELECTs on a replica, one
+# replica per request in turn; writes, SELECT ... FOR UPDATE, flushes and
+# every other endpoint use the primary. A request that commits a write
+# sets a short-lived cookie, and while it lasts that browser reads from
+# the primary too, so the page it is redirected to shows its own change.
+#
+# A page rendered from a lagging replica can still be cached; CACHE_TTL
+# bounds how long that lasts.
+#----------------------------------------------------------------------------#
+
+READ_ENDPOINTS = frozenset({
+    'venues', 'search_venues', 'show_venue', 'venue_shows',
+    'artists', 'search_artists', 'show_artist', 'artist_shows',
+    'shows', 'shows_calendar', 'venue_calendar', 'artist_calendar', 'export',
+})
+
+# Blueprints whose endpoints are all reads.
+READ_BLUEPRINTS = frozenset({'api'})
+
+STICKY_COOKIE = 'fyyur_primary'
+
+
+def engine_options(config):
+    # SQLALCHEMY_ENGINE_OPTIONS for the DATABASE_POOL_* settings
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    options = {
+        'pool_pre_ping': config['DATABASE_POOL_PRE_PING'],
+        'pool_recycle': config['DATABASE_POOL_RECYCLE'],
+    }
+    if url.get_backend_name() == 'sqlite':
+        # file databases get a NullPool, which takes no sizing
+        return options
+    options.update(
+        pool_size=config['DATABASE_POOL_SIZE'],
+        max_overflow=config['DATABASE_MAX_OVERFLOW'],
+        pool_timeout=config['DATABASE_POOL_TIMEOUT'],
+    )
+    timeout = config['DATABASE_STATEMENT_TIMEOUT_MS']
+    if timeout and url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(timeout)}'}
+    return options
+
+
+def replica_binds(config):
+    return {f'replica{index}': url for index, url in enumerate(config['DATABASE_REPLICA_URLS'])}
+
+
+def is_read(clause):
+    return getattr(clause, 'is_select', False) and getattr(clause, '_for_update_arg', None) is None
+
+
+#  Routing
+#  ----------------------------------------------------------------
+
+# bind name -> statements routed there, for /metrics
+routed = {}
+_lock = threading.Lock()
+
+
+def _count(bind):
+    with _lock:
+        routed[bind] = routed.get(bind, 0) + 1
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        replica = g.get('replica') if has_request_context() else None
+        if replica is not None and is_read(clause) and not self._flushing:
+            _count(g.replica_bind)
+            return replica
+        if getattr(clause, 'is_dml', False):
+            self.info['wrote'] = True
+        if clause is not None:
+            _count('primary')
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        # the rest of this request, and the browser's next few, read
+        # from the primary
+        g.replica = None
+        g.wrote = True
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+@instrumentation.collector
+def _exposition():
+    with _lock:
+        counts = sorted(routed.items())
+    lines = [
+        '# HELP fyyur_db_statements_routed_total Statements run through the session, by bind.',
+        '# TYPE fyyur_db_statements_routed_total counter',
+    ]
+    lines += [f'fyyur_db_statements_routed_total{{bind="{bind}"}} {count}' for bind, count in counts]
+    return lines
+
+
+def init_app(app):
+    # before the first engine is created; explicit settings win
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config), **app.config['SQLALCHEMY_ENGINE_OPTIONS']
+    }
+    binds = replica_binds(app.config)
+    if not binds:
+        return
+    app.config['SQLALCHEMY_BINDS'] = {**(app.config['SQLALCHEMY_BINDS'] or {}), **binds}
+    turns = itertools.cycle(sorted(binds))
+    turn_lock = threading.Lock()
+    sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+
+    @app.before_request
+    def pick_replica():
+        if request.endpoint not in READ_ENDPOINTS and request.blueprint not in READ_BLUEPRINTS:
+            return
+        if request.cookies.get(STICKY_COOKIE):
+            return
+        with turn_lock:
+            g.replica_bind = next(turns)
+        g.replica = app.extensions['sqlalchemy'].db.get_engine(app, bind=g.replica_bind)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if g.get('wrote') and sticky_seconds:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=sticky_seconds, httponly=True, samesite='Lax')
+        return response
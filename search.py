@@ -0,0 +1,97 @@
+from collections import namedtuple
+from sqlalchemy import case, cast, func, literal, or_, select
+from sqlalchemy.dialects.postgresql import array
+from models import db
+from enums import Genre
+
+#----------------------------------------------------------------------------#
+# Venue and artist search.
+#
+# A term matches on name or city (substring, case-insensitive), on the
+# state code, or on a genre. On Postgres the substring matches are served
+# by the pg_trgm GIN indexes and genres by the GIN index on the array
+# column (see migration 5b1e7c2f9a41); results are ranked by trigram
+# similarity of the name.
+#----------------------------------------------------------------------------#
+
+SearchResult = namedtuple('SearchResult', 'id name rank')
+
+# What a search page shows: the number of matches (at most `cap`), the best
+# matches, and whether the cap was reached.
+SearchPage = namedtuple('SearchPage', 'count data capped')
+
+# Matches counted and ranked per search. A broad term ('jazz', 'tx') can
+# match a large part of the table; the scan stops after MATCH_CAP matches,
+# so the count stops there ("1000+") and the cost stays bounded. For such
+# a term the ranking is approximate: the best of the first MATCH_CAP
+# matches the indexes return, not of all of them.
+MATCH_CAP = 1000
+
+GENRES = {genre.value.lower(): genre.value for genre in Genre}
+
+
+def escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_query(model, term, limit, cap=MATCH_CAP):
+    pattern = f'%{escape_like(term)}%'
+    name_match = model.name.ilike(pattern, escape='\\')
+    city_match = model.city.ilike(pattern, escape='\\')
+    matches = [name_match, city_match, func.upper(model.state) == term.upper()]
+    genre = GENRES.get(term.lower())
+    if genre:
+        matches.append(model.genres.op('@>')(cast(array([genre]), model.genres.type)))
+    rank = case(
+        (name_match, 2 + func.similarity(model.name, term)),
+        (city_match, 1 + func.similarity(model.city, term)),
+        else_=literal(0.5)
+    )
+    candidates = (
+        select(model.id, model.name, rank.label('rank'))
+        .where(or_(*matches))
+        .limit(cap)
+        .subquery()
+    )
+    return (
+        select(candidates, func.count().over().label('total'))
+        .order_by(candidates.c.rank.desc(), candidates.c.name, candidates.c.id)
+        .limit(limit)
+    )
+
+
+def search(model, term, limit=50, cap=MATCH_CAP):
+    term = term.strip()
+    if not term:
+        total, results = browse(model, limit, cap)
+    else:
+        total, results = search_results(db.session.execute(search_query(model, term, limit, cap)).all())
+    return search_page(total, results, cap)
+
+
+def search_results(rows):
+    # (total, results) from the rows of search_query
+    total = rows[0].total if rows else 0
+    return total, [SearchResult(row.id, row.name, row.rank) for row in rows]
+
+
+def search_page(total, results, cap=MATCH_CAP):
+    return SearchPage(min(total, cap), results, total >= cap)
+
+
+def browse_queries(model, limit, cap=MATCH_CAP):
+    # An empty search lists everything, alphabetically: (count, rows).
+    return (
+        select(func.count()).select_from(select(model.id).limit(cap).subquery()),
+        select(model.id, model.name).order_by(model.name, model.id).limit(limit)
+    )
+
+
+def browse_results(rows):
+    return [SearchResult(row.id, row.name, 0) for row in rows]
+
+
+def browse(model, limit, cap=MATCH_CAP):
+    count, listing = browse_queries(model, limit, cap)
+    total = db.session.execute(count).scalar()
+    return total, browse_results(db.session.execute(listing).all())
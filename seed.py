@@ -0,0 +1,318 @@
+import bisect
+import csv
+import io
+import itertools
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from models import db, Venue, Artist, Show
+from enums import Genre, State
+import counters
+import calendars
+
+#----------------------------------------------------------------------------#
+# Synthetic catalogue.
+#
+# `seed(shows)` adds venues, artists and shows shaped like a real listing
+# site rather than uniform noise: a few cities hold most venues, a few
+# genres most acts, and show bookings follow a Zipf law over venues and
+# artists, so a handful of them carry long histories while most have a
+# few shows. Two years of past shows and one of upcoming ones, bunched in
+# the coming weeks, each in one of three evening slots short enough that
+# shows in different slots never overlap; a bitmap per venue and artist
+# keeps any of them from being booked twice in a slot, as the exclusion
+# constraints on Show require. Rows go in with COPY in batches, then the
+# show counters are rebuilt and the tables analyzed. The same seed gives
+# the same data.
+#----------------------------------------------------------------------------#
+
+# Named scales: shows; venues and artists follow with SHOWS_PER_VENUE and
+# SHOWS_PER_ARTIST.
+SCALES = {
+    '1k': 1000,
+    '10k': 10000,
+    '100k': 100000,
+    '1m': 1000000,
+    '10m': 10000000,
+}
+SHOWS_PER_VENUE = 50
+SHOWS_PER_ARTIST = 25
+
+# Rows per COPY statement.
+BATCH_SIZE = 50000
+
+# Days of past and upcoming shows, the evening slots of a day and the show
+# lengths, in minutes; the longest fits between two slots.
+DAYS_PAST = 730
+DAYS_UPCOMING = 365
+SLOTS = ((18, 0), (20, 30), (23, 0))
+DURATIONS = (60, 90, 90, 120, 120, 150)
+
+# Draws of a venue, artist and slot before a show is given up.
+BOOKING_ATTEMPTS = 8
+
+# Biggest first: a Zipf draw over this list puts most venues in the top
+# few cities.
+CITIES = [
+    ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Nashville', 'TN'),
+    ('Austin', 'TX'), ('San Francisco', 'CA'), ('Seattle', 'WA'), ('New Orleans', 'LA'),
+    ('Atlanta', 'GA'), ('Boston', 'MA'), ('Philadelphia', 'PA'), ('Denver', 'CO'),
+    ('Portland', 'OR'), ('Minneapolis', 'MN'), ('Detroit', 'MI'), ('Miami', 'FL'),
+    ('Houston', 'TX'), ('Phoenix', 'AZ'), ('Las Vegas', 'NV'), ('Washington', 'DC'),
+    ('Baltimore', 'MD'), ('Kansas City', 'MO'), ('Memphis', 'TN'), ('Cleveland', 'OH'),
+    ('Pittsburgh', 'PA'), ('Salt Lake City', 'UT'), ('Richmond', 'VA'), ('Louisville', 'KY'),
+    ('Omaha', 'NE'), ('Albuquerque', 'NM'), ('Providence', 'RI'), ('Burlington', 'VT'),
+    ('Boise', 'ID'), ('Anchorage', 'AK'), ('Honolulu', 'HI'), ('Cheyenne', 'WY'),
+]
+assert {state for _, state in CITIES} <= {state.value for state in State}
+
+# Most booked first.
+GENRES = [
+    Genre.Rock_n_Roll, Genre.Pop, Genre.Hip_Hop, Genre.Electronic, Genre.Jazz,
+    Genre.Alternative, Genre.Country, Genre.R_B, Genre.Folk, Genre.Blues,
+    Genre.Soul, Genre.Punk, Genre.Heavy_Metal, Genre.Funk, Genre.Reggae,
+    Genre.Classical, Genre.Instrumental, Genre.Musical_Theatre, Genre.Other,
+]
+assert set(GENRES) == set(Genre)
+
+ADJECTIVES = [
+    'Blue', 'Velvet', 'Golden', 'Electric', 'Midnight', 'Silver', 'Crimson', 'Lucky',
+    'Wild', 'Hollow', 'Painted', 'Broken', 'Neon', 'Rusty', 'Quiet', 'Little',
+    'Lonesome', 'Copper', 'Sunset', 'Northern', 'Brass', 'Iron', 'Crystal', 'Lost',
+]
+NOUNS = [
+    'Note', 'Room', 'Owl', 'Fox', 'Anchor', 'Lantern', 'Harbor', 'Garden',
+    'Horse', 'River', 'Crow', 'Moon', 'Tiger', 'Arrow', 'Engine', 'Rose',
+    'Shadow', 'Canyon', 'Mirror', 'Wolf', 'Comet', 'Saint', 'Echo', 'Parade',
+]
+VENUE_KINDS = ['Hall', 'Club', 'Lounge', 'Theater', 'Tavern', 'Ballroom', 'Bar', 'Social Club']
+ARTIST_FORMS = ['The {adj} {noun}s', '{adj} {noun}', '{noun} & the {adj}s', 'DJ {adj} {noun}']
+STREETS = ['Main St', 'Broadway', 'Market St', 'Elm St', '2nd Ave', 'Oak St', 'Pine St', 'Lake St']
+
+
+class Zipf:
+    # ranks 0..n-1, rank r drawn with weight 1 / (r + 1) ** exponent
+
+    def __init__(self, n, exponent=1.0):
+        self.cumulative = list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(n)))
+
+    def draw(self, rng):
+        return bisect.bisect(self.cumulative, rng.random() * self.cumulative[-1])
+
+
+def scale_counts(shows):
+    # (venues, artists, shows) for a number of shows
+    return max(10, shows // SHOWS_PER_VENUE), max(10, shows // SHOWS_PER_ARTIST), shows
+
+
+#  Rows
+#  ----------------------------------------------------------------
+
+def _name(rng):
+    return rng.choice(ADJECTIVES), rng.choice(NOUNS)
+
+
+def _phone(rng):
+    return f'{rng.randint(200, 999)}-{rng.randint(200, 999)}-{rng.randint(0, 9999):04d}'
+
+
+def _genres(rng, genres):
+    picked = {GENRES[genres.draw(rng)].value for _ in range(rng.choice((1, 1, 2, 2, 3)))}
+    return sorted(picked)
+
+
+def _slug(name):
+    return ''.join(c for c in name.lower() if c.isalnum())
+
+
+def venue_values(rng, cities, genres):
+    # a VenueForm's worth of fields, by form field name
+    adj, noun = _name(rng)
+    name = f'The {adj} {noun} {rng.choice(VENUE_KINDS)}'
+    city, state = CITIES[cities.draw(rng)]
+    seeking = rng.random() < 0.3
+    return {
+        'name': name,
+        'city': city,
+        'state': state,
+        'address': f'{rng.randint(1, 9999)} {rng.choice(STREETS)}',
+        'phone': _phone(rng),
+        'image_link': f'https://images.example.com/venues/{_slug(name)}.jpg',
+        'facebook_link': f'https://www.facebook.com/{_slug(name)}',
+        'genres': _genres(rng, genres),
+        'website_link': f'https://{_slug(name)}.example.com',
+        'seeking_talent': seeking,
+        'seeking_description': 'Looking for local acts to play weekends.' if seeking else '',
+    }
+
+
+def artist_values(rng, cities, genres):
+    adj, noun = _name(rng)
+    name = rng.choice(ARTIST_FORMS).format(adj=adj, noun=noun)
+    city, state = CITIES[cities.draw(rng)]
+    seeking = rng.random() < 0.4
+    return {
+        'name': name,
+        'city': city,
+        'state': state,
+        'phone': _phone(rng),
+        'image_link': f'https://images.example.com/artists/{_slug(name)}.jpg',
+        'facebook_link': f'https://www.facebook.com/{_slug(name)}',
+        'genres': _genres(rng, genres),
+        'website_link': f'https://{_slug(name)}.example.com',
+        'seeking_venue': seeking,
+        'seeking_description': 'Touring next spring, booking venues now.' if seeking else '',
+    }
+
+
+def slot(rng):
+    # an index over every day's slots, DAYS_PAST * len(SLOTS) being today's
+    # first; a third of shows upcoming, most of those within weeks
+    if rng.random() < 1 / 3:
+        day = DAYS_PAST + min(int(rng.expovariate(1 / 45)), DAYS_UPCOMING - 1)
+    else:
+        day = rng.randrange(DAYS_PAST)
+    return day * len(SLOTS) + rng.randrange(len(SLOTS))
+
+
+def slot_time(slot, now):
+    day, index = divmod(slot, len(SLOTS))
+    hour, minute = SLOTS[index]
+    date = now.date() + timedelta(days=day - DAYS_PAST)
+    return datetime(date.year, date.month, date.day, hour, minute)
+
+
+class Calendar:
+    # one bit per (owner, slot): whether the owner is booked then
+
+    def __init__(self, owners):
+        self.slots = (DAYS_PAST + DAYS_UPCOMING) * len(SLOTS)
+        self.bits = bytearray((owners * self.slots + 7) // 8)
+
+    def _bit(self, owner, slot):
+        return divmod(owner * self.slots + slot, 8)
+
+    def booked(self, owner, slot):
+        byte, bit = self._bit(owner, slot)
+        return self.bits[byte] >> bit & 1
+
+    def book(self, owner, slot):
+        byte, bit = self._bit(owner, slot)
+        self.bits[byte] |= 1 << bit
+
+
+#  Loading
+#  ----------------------------------------------------------------
+
+# model -> COPY column order
+COLUMNS = {
+    Venue: ['id', 'name', 'city', 'state', 'address', 'phone', 'image_link', 'facebook_link',
+            'genres', 'website', 'talent', 'description', 'updated_at'],
+    Artist: ['id', 'name', 'city', 'state', 'phone', 'image_link', 'facebook_link',
+             'genres', 'website', 'venue', 'description', 'updated_at'],
+    Show: ['venue_id', 'artist_id', 'start_time', 'duration', 'updated_at'],
+}
+
+# column -> form field, where the names differ
+FORM_FIELDS = {
+    'website': 'website_link',
+    'talent': 'seeking_talent',
+    'venue': 'seeking_venue',
+    'description': 'seeking_description',
+}
+
+
+def _cell(value):
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return '{' + ','.join('"' + item.replace('"', '\\"') + '"' for item in value) + '}'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return value
+
+
+def copy_rows(model, rows):
+    # COPY rows (tuples in COLUMNS[model] order) in batches; returns the count
+    table = model.__tablename__
+    columns = ', '.join(COLUMNS[model])
+    cursor = db.session.connection().connection.cursor()
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, BATCH_SIZE))
+        if not batch:
+            return count
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([_cell(value) for value in row] for row in batch)
+        buffer.seek(0)
+        cursor.copy_expert(f'COPY "{table}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        count += len(batch)
+
+
+def reserve_ids(model, count):
+    # a block of count consecutive ids from the table's sequence; seeding
+    # is assumed to be the only writer
+    sequence = func.pg_get_serial_sequence(f'"{model.__tablename__}"', 'id')
+    last = db.session.execute(select(func.setval(sequence, func.nextval(sequence) + count - 1))).scalar()
+    return range(last - count + 1, last + 1)
+
+
+def show_rows(rng, shows, owners, now):
+    # shows rows booking no venue or artist twice in a slot; a show whose
+    # draws all clash is left out, so there can be slightly fewer
+    (venue_ids, venue_rank), (artist_ids, artist_rank) = owners[Venue], owners[Artist]
+    venues, artists = Calendar(len(venue_ids)), Calendar(len(artist_ids))
+    for _ in range(shows):
+        for _ in range(BOOKING_ATTEMPTS):
+            venue, artist, when = venue_rank.draw(rng), artist_rank.draw(rng), slot(rng)
+            if not venues.booked(venue, when) and not artists.booked(artist, when):
+                break
+        else:
+            continue
+        venues.book(venue, when)
+        artists.book(artist, when)
+        yield venue_ids[venue], artist_ids[artist], slot_time(when, now), rng.choice(DURATIONS), now
+
+
+def seed(shows, venues=None, artists=None, random_seed=1, now=None):
+    # adds the rows and commits; returns (venues, artists, shows) added
+    default_venues, default_artists, _ = scale_counts(shows)
+    venues, artists = venues or default_venues, artists or default_artists
+    rng = random.Random(random_seed)
+    now = now or datetime.now()
+    cities, genres = Zipf(len(CITIES), 1.1), Zipf(len(GENRES), 0.9)
+
+    owners = {}
+    for model, count, values in ((Venue, venues, venue_values), (Artist, artists, artist_values)):
+        ids = reserve_ids(model, count)
+
+        def rows(ids=ids, values=values, model=model):
+            for id in ids:
+                fields = values(rng, cities, genres)
+                yield tuple(
+                    id if column == 'id' else now if column == 'updated_at'
+                    else fields[FORM_FIELDS.get(column, column)]
+                    for column in COLUMNS[model]
+                )
+
+        copy_rows(model, rows())
+        # popularity is a random permutation of the ids, not their order
+        popular = list(ids)
+        rng.shuffle(popular)
+        owners[model] = (popular, Zipf(count, 1.05))
+
+    shows = copy_rows(Show, show_rows(rng, shows, owners, now))
+    db.session.commit()
+    counters.rebuild(now)
+    calendars.rebuild()
+    for model in COLUMNS:
+        db.session.execute(db.text(f'ANALYZE "{model.__tablename__}"'))
+    db.session.commit()
+    return venues, artists, shows
+
+
+def reset():
+    # empties the catalogue and restarts the ids
+    db.session.execute(db.text('TRUNCATE "Show", "Venue", "Artist" RESTART IDENTITY'))
+    db.session.commit()
@@ -0,0 +1,297 @@
+"""Production server: a pre-forking master and threaded WSGI workers.
+
+    SECRET_KEY_FILE=/etc/fyyur/secret python serve.py --bind 0.0.0.0:8000
+
+The master imports the app and builds its in-process indexes (typeahead,
+facets, matching) once, then forks SERVE_WORKERS workers that share them,
+the templates and the enum tables copy-on-write. Each worker serves the
+inherited listening socket with SERVE_THREADS threads, on pools of its own:
+the master closes its database connections before forking and each worker
+resets the engines it inherits. A worker keeps the indexes it inherited
+current with the rows every process commits, see events.py.
+
+Signals to the master:
+
+    TERM, INT  stop: workers finish the requests in flight, for up to
+               SERVE_GRACEFUL_SECONDS
+    HUP        reload: a new master is started on the same socket with
+               the current code and config; once its workers are up it
+               stops the old one, so no connection is refused meanwhile
+
+A worker that has served about SERVE_MAX_REQUESTS requests, or grown past
+SERVE_MAX_RSS_MB, stops the same way and the master forks a fresh one.
+"""
+import argparse
+import gc
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from werkzeug.serving import make_server
+from werkzeug.wsgi import ClosingIterator
+
+# The listening socket a reloaded master inherits, and the master it replaces.
+LISTEN_FD = 'SERVE_LISTEN_FD'
+REPLACES = 'SERVE_REPLACES'
+
+# Seconds between the master's checks on its workers.
+TICK = 0.5
+
+
+def parse_args(config):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bind', default=f"0.0.0.0:{os.environ.get('PORT', 5000)}", help='host:port')
+    parser.add_argument('--workers', type=int, default=config['SERVE_WORKERS'])
+    parser.add_argument('--threads', type=int, default=config['SERVE_THREADS'])
+    parser.add_argument('--pid', help='file the master writes its pid to')
+    return parser.parse_args()
+
+
+def listen(bind):
+    # the socket every worker accepts on; a reloaded master inherits it
+    if os.environ.get(LISTEN_FD):
+        sock = socket.socket(fileno=int(os.environ.pop(LISTEN_FD)))
+    else:
+        host, _, port = bind.rpartition(':')
+        sock = socket.create_server((host or '0.0.0.0', int(port)), backlog=2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def rss_bytes():
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # peak rather than current outside Linux; kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+#  Preloading
+#  ----------------------------------------------------------------
+
+def engines(app):
+    from models import db
+    return [db.get_engine(app, bind) for bind in [None, *(app.config['SQLALCHEMY_BINDS'] or {})]]
+
+
+def preload(app):
+    # everything a worker would build on its first request, built once
+    from models import db
+    with app.test_request_context():
+        app.try_trigger_before_first_request_functions()
+        db.session.remove()
+    for engine in engines(app):
+        engine.dispose()
+
+
+#  Worker
+#  ----------------------------------------------------------------
+
+class Worker:
+    # the app, counting the requests in flight and served; asks to stop
+    # once it has served max_requests or outgrown max_rss
+
+    def __init__(self, app, max_requests, max_rss):
+        self.app = app
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.active = 0
+        self.served = 0
+        self.server = None
+        self.stopping = False
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            self.active += 1
+        try:
+            response = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        # a streamed response is in flight until it is closed
+        return ClosingIterator(response, self._done)
+
+    def _done(self):
+        with self.lock:
+            self.active -= 1
+            self.served += 1
+            self.idle.notify_all()
+            served = self.served
+        if self.max_requests and served >= self.max_requests:
+            self.stop('served %d requests' % served)
+        elif self.max_rss and served % 16 == 0 and rss_bytes() > self.max_rss:
+            self.stop('outgrew %d MB' % (self.max_rss >> 20))
+
+    def stop(self, reason=None):
+        # from a signal handler or a request thread; serve_forever returns
+        with self.lock:
+            if self.stopping:
+                return
+            self.stopping = True
+        if reason:
+            print(f'[{os.getpid()}] worker {reason}, stopping', file=sys.stderr)
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def drain(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            while self.active and time.monotonic() < deadline:
+                self.idle.wait(deadline - time.monotonic())
+
+
+def limit_threads(server, threads):
+    # at most threads requests at a time; while they are all busy the
+    # worker stops accepting and the connections go to other workers
+    slots = threading.BoundedSemaphore(threads)
+    process_request, process_request_thread = server.process_request, server.process_request_thread
+
+    def acquire(request, client_address):
+        slots.acquire()
+        process_request(request, client_address)
+
+    def release(request, client_address):
+        try:
+            process_request_thread(request, client_address)
+        finally:
+            slots.release()
+
+    server.process_request, server.process_request_thread = acquire, release
+
+
+def run_worker(app, sock, args):
+    for signum in (signal.SIGHUP, signal.SIGINT):
+        signal.signal(signum, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # pooled connections are per process; none may be shared with the master
+    for engine in engines(app):
+        engine.dispose(close=False)
+    # the objects inherited from the master stay frozen, only what the
+    # worker allocates itself is collected
+    gc.enable()
+    config = app.config
+    max_requests = config['SERVE_MAX_REQUESTS']
+    if max_requests:
+        max_requests += random.randint(0, config['SERVE_MAX_REQUESTS_JITTER'])
+    worker = Worker(app, max_requests, config['SERVE_MAX_RSS_MB'] << 20)
+    host, port = sock.getsockname()[:2]
+    worker.server = make_server(host, port, worker, threaded=True, fd=sock.fileno())
+    limit_threads(worker.server, args.threads)
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    worker.server.serve_forever()
+    worker.drain(config['SERVE_GRACEFUL_SECONDS'])
+    # unwinds the master's frames in this process; atexit handlers run,
+    # the write queue drains there
+    sys.exit(0)
+
+
+#  Master
+#  ----------------------------------------------------------------
+
+class Master:
+
+    def __init__(self, app, sock, args):
+        self.app = app
+        self.sock = sock
+        self.args = args
+        self.workers = set()
+        self.stopping = False
+        self.reloading = False
+        self.graceful = app.config['SERVE_GRACEFUL_SECONDS']
+
+    def spawn(self):
+        # the master runs with the collector off, so nothing has freed
+        # holes in its pages for new objects to fill; frozen, its objects
+        # are left alone by the workers' collectors and stay shared
+        gc.freeze()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(self.app, self.sock, self.args)
+            except Exception:
+                traceback.print_exc()
+                os._exit(1)
+        self.workers.add(pid)
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            self.workers.discard(pid)
+
+    def reload(self):
+        # the new master starts from scratch on our socket, then stops us
+        env = {**os.environ, LISTEN_FD: str(self.sock.fileno()), REPLACES: str(os.getpid())}
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), *sys.argv[1:]], env=env, pass_fds=(self.sock.fileno(),)
+        )
+
+    def signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.workers.discard(pid)
+
+    def stop(self):
+        self.signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + self.graceful
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(TICK / 5)
+        self.signal_workers(signal.SIGKILL)
+        self.reap()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, lambda signum, frame: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda signum, frame: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGHUP, lambda signum, frame: setattr(self, 'reloading', True))
+        while len(self.workers) < self.args.workers:
+            self.spawn()
+        replaces = os.environ.pop(REPLACES, None)
+        if replaces:
+            os.kill(int(replaces), signal.SIGTERM)
+        host, port = self.sock.getsockname()[:2]
+        print(f'[{os.getpid()}] serving on {host}:{port} with {self.args.workers} workers', file=sys.stderr)
+        while not self.stopping:
+            if self.reloading:
+                self.reloading = False
+                self.reload()
+            self.reap()
+            while len(self.workers) < self.args.workers and not self.stopping:
+                self.spawn()
+            time.sleep(TICK)
+        self.stop()
+
+
+def main():
+    # off before the app is imported, see Master.spawn
+    gc.disable()
+    from app import app
+    args = parse_args(app.config)
+    if app.config['SECRET_KEY_EPHEMERAL']:
+        sys.exit('serve.py: set SECRET_KEY or SECRET_KEY_FILE, every worker needs the same key')
+    sock = listen(args.bind)
+    preload(app)
+    if args.pid:
+        with open(args.pid, 'w') as file:
+            file.write(f'{os.getpid()}\n')
+    Master(app, sock, args).run()
+
+
+if __name__ == '__main__':
+    main()
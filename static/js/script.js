@@ -2,3 +2,66 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// "Load more" on venue and artist pages: fetch the next page of a show
+// partition and append it as tiles above the button.
+document.addEventListener('click', function (event) {
+  var button = event.target.closest('.load-more');
+  if (!button) return;
+  var link = button.dataset.link;
+  fetch(button.dataset.url)
+    .then(function (response) { return response.json(); })
+    .then(function (page) {
+      var row = button.previousElementSibling;
+      page.shows.forEach(function (show) {
+        var col = document.createElement('div');
+        col.className = 'col-sm-4';
+        var tile = document.createElement('div');
+        tile.className = 'tile tile-show';
+        var img = document.createElement('img');
+        img.src = show[link + '_image_link'] || '';
+        var name = document.createElement('h5');
+        var a = document.createElement('a');
+        a.href = '/' + link + 's/' + show[link + '_id'];
+        a.textContent = show[link + '_name'];
+        name.appendChild(a);
+        var when = document.createElement('h6');
+        when.textContent = show.start_time_display;
+        tile.append(img, name, when);
+        col.appendChild(tile);
+        row.appendChild(col);
+      });
+      if (page.next) {
+        var url = new URL(button.dataset.url, window.location.href);
+        url.searchParams.set('after', page.next);
+        button.dataset.url = url.pathname + url.search;
+      } else {
+        button.remove();
+      }
+    });
+});
+
+// Typeahead for the venue and artist search boxes, served from /api/suggest.
+(function () {
+  var timer = null;
+  document.addEventListener('input', function (event) {
+    var input = event.target;
+    if (!input.dataset || !input.dataset.suggest) return;
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var list = document.getElementById(input.getAttribute('list'));
+      var q = input.value.trim();
+      if (!q) { list.innerHTML = ''; return; }
+      fetch('/api/suggest?type=' + input.dataset.suggest + '&q=' + encodeURIComponent(q))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          list.innerHTML = '';
+          data.suggestions.forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            list.appendChild(option);
+          });
+        });
+    }, 80);
+  });
+})();
@@ -0,0 +1,165 @@
+import bisect
+import sys
+import threading
+from sqlalchemy import select
+from models import db, Venue, Artist
+import events
+
+#----------------------------------------------------------------------------#
+# Typeahead suggestions.
+#
+# A sorted array of lower-cased keys searched with bisect. Every name is
+# indexed once in full and once from the start of each later word, so
+# "hop" suggests "The Musical Hop". The index is built from the database
+# on the first request and then kept current from commit notifications
+# (those that arrive while it reads the rows are replayed), so answering a
+# keystroke never touches the database.
+#----------------------------------------------------------------------------#
+
+KINDS = {Venue: 'venue', Artist: 'artist'}
+
+# Rough per-key overhead of the tuple and list slot on top of the strings.
+ENTRY_OVERHEAD = 120
+
+
+class PrefixIndex(events.ReplayingIndex):
+
+    def __init__(self, max_bytes=None):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.keys = []      # sorted (key, id)
+        self.entries = {}   # id -> (name, [key, ...])
+        self.bytes = 0
+        self.truncated = False
+
+    @staticmethod
+    def word_keys(name):
+        name = name.lower()
+        keys = [name]
+        for i in range(1, len(name)):
+            if name[i - 1] == ' ' and name[i] != ' ':
+                keys.append(name[i:])
+        return keys
+
+    def _cost(self, name, keys):
+        return sys.getsizeof(name) + sum(sys.getsizeof(key) + ENTRY_OVERHEAD for key in keys)
+
+    def _fit(self, name):
+        # keys for name within the memory budget: all of them, the full
+        # name only, or none
+        keys = self.word_keys(name)
+        cost = self._cost(name, keys)
+        if self.max_bytes is not None and self.bytes + cost > self.max_bytes:
+            self.truncated = True
+            keys = keys[:1]
+            cost = self._cost(name, keys)
+            if self.bytes + cost > self.max_bytes:
+                return [], 0
+        return keys, cost
+
+    def _add(self, id, name):
+        keys, cost = self._fit(name)
+        if not keys:
+            return
+        for key in keys:
+            bisect.insort(self.keys, (key, id))
+        self.entries[id] = (name, keys)
+        self.bytes += cost
+
+    def _remove(self, id):
+        entry = self.entries.pop(id, None)
+        if entry is None:
+            return
+        name, keys = entry
+        for key in keys:
+            i = bisect.bisect_left(self.keys, (key, id))
+            if i < len(self.keys) and self.keys[i] == (key, id):
+                del self.keys[i]
+        self.bytes -= self._cost(name, keys)
+
+    def _load(self, rows):
+        # rows of (id, name), into a fresh index; sorting once beats
+        # repeated insort
+        index = PrefixIndex(self.max_bytes)
+        for id, name in rows:
+            keys, cost = index._fit(name)
+            if not keys:
+                continue
+            index.keys.extend((key, id) for key in keys)
+            index.entries[id] = (name, keys)
+            index.bytes += cost
+        index.keys.sort()
+        return {'keys': index.keys, 'entries': index.entries, 'bytes': index.bytes, 'truncated': index.truncated}
+
+    def _apply(self, change):
+        if change.op == 'delete':
+            self._remove(change.id)
+        elif 'name' in change.values:
+            self._remove(change.id)
+            self._add(change.id, change.values['name'])
+
+    def suggest(self, prefix, limit=10):
+        # (id, name) of up to `limit` names with a word starting with prefix
+        prefix = prefix.lower().lstrip()
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self.lock:
+            i = bisect.bisect_left(self.keys, (prefix,))
+            while i < len(self.keys) and len(results) < limit:
+                key, id = self.keys[i]
+                if not key.startswith(prefix):
+                    break
+                i += 1
+                if id not in seen:
+                    seen.add(id)
+                    results.append((id, self.entries[id][0]))
+        return results
+
+
+indexes = {kind: PrefixIndex() for kind in KINDS.values()}
+
+
+# One build at a time, so each replays the commits made during its reads.
+_building = threading.Lock()
+
+
+def build():
+    with _building:
+        for model, kind in KINDS.items():
+            indexes[kind].begin()
+            indexes[kind].build(db.session.execute(select(model.id, model.name)))
+
+
+def suggest(prefix, limit=10, kind=None):
+    # (kind, id, name) tuples, alphabetical across kinds
+    kinds = [kind] if kind else list(indexes)
+    results = []
+    for kind in kinds:
+        index = indexes.get(kind)
+        if index is None:
+            continue
+        if not index.ready:
+            build()
+        results.extend((kind, id, name) for id, name in index.suggest(prefix, limit))
+    results.sort(key=lambda result: result[2].lower())
+    return results[:limit]
+
+
+@events.on_change
+def _update_indexes(changes):
+    for change in changes:
+        kind = KINDS.get(change.model)
+        if kind is not None:
+            indexes[kind].apply(change)
+
+
+def init_app(app):
+    # the memory budget is split evenly between venue and artist names
+    max_bytes = app.config.get('SUGGEST_MAX_BYTES')
+    for index in indexes.values():
+        index.max_bytes = max_bytes and max_bytes // len(indexes)
+
+    @app.before_first_request
+    def build_suggest_index():
+        build()
@@ -0,0 +1,344 @@
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import func, select
+from sqlalchemy.exc import DBAPIError
+from models import db, Venue, Artist, Show
+import intervals
+
+#----------------------------------------------------------------------------#
+# Queued writes.
+#
+# With WRITE_QUEUE on, the create and edit views check the form, append
+# the write to a SQLite file in WAL mode and answer at once; a worker
+# thread in each process applies the queued writes to Postgres. Whatever
+# has queued up while the previous batch was committing goes in the next
+# one: each write in its own savepoint, the batch in a single transaction,
+# so a spike of submissions costs one commit (and one fsync) per batch
+# instead of one per request. Writes go through the ORM, so the counters,
+# day counts, cache invalidation and commit notifications see them as if
+# the view had committed.
+#
+# Every write has a key, the client's Idempotency-Key (or the form's
+# idempotency_key field) when given: a write submitted again under the
+# same key is not queued twice, and /api/v1/writes/<key> reports its
+# state. A key reused for a different write is refused (KeyReused), the
+# writes are told apart by a hash of their model, op, target and values.
+# Inserts get their id from the table's sequence when queued, so the write
+# can be applied again after a crash without inserting twice.
+#
+# The file is shared by the workers on the host; writes left running by a
+# process that died are queued again. At exit the worker drains what it
+# can for WRITE_QUEUE_SHUTDOWN_SECONDS; anything left stays in the file
+# for the next start.
+#----------------------------------------------------------------------------#
+
+MODELS = {model.__name__: model for model in (Venue, Artist, Show)}
+
+Write = namedtuple('Write', 'key state op model id error queued_at done_at')
+
+MAX_KEY_LENGTH = 200
+
+
+class BadKey(ValueError):
+    pass
+
+
+class Rejected(ValueError):
+    pass
+
+
+class KeyReused(ValueError):
+    pass
+
+
+def encode(values):
+    return json.dumps(values, default=lambda value: value.isoformat())
+
+
+def request_hash(op, model, values, target):
+    # an insert's target is the id it is given when queued, not part of
+    # the request
+    request = [op, model.__name__, target if op == 'update' else None, values]
+    raw = json.dumps(request, sort_keys=True, default=lambda value: value.isoformat())
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def decode(model, payload):
+    values = json.loads(payload)
+    for key, value in values.items():
+        if value is not None and isinstance(model.__table__.c[key].type, db.DateTime):
+            values[key] = datetime.fromisoformat(value)
+    return values
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WriteQueue:
+
+    SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS writes (
+        id INTEGER PRIMARY KEY, key TEXT NOT NULL UNIQUE, op TEXT NOT NULL,
+        model TEXT NOT NULL, target INTEGER, payload TEXT NOT NULL,
+        state TEXT NOT NULL, worker INTEGER, error TEXT,
+        queued_at REAL NOT NULL, done_at REAL, request TEXT
+    );
+    CREATE INDEX IF NOT EXISTS writes_state ON writes (state, id);
+    CREATE INDEX IF NOT EXISTS writes_done ON writes (done_at);
+    '''
+
+    def __init__(self, app, path, batch, poll, keep, shutdown):
+        self.app = app
+        self.path = path
+        self.batch = batch
+        self.poll = poll
+        self.keep = keep
+        self.shutdown = shutdown
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.worker = None
+        self.pid = None
+        with self._connect() as conn:
+            conn.executescript(self.SCHEMA)
+            # files queued before writes had a request hash
+            if 'request' not in {column[1] for column in conn.execute('PRAGMA table_info(writes)')}:
+                conn.execute('ALTER TABLE writes ADD COLUMN request TEXT')
+
+    def _connect(self):
+        # one connection per thread, and a fresh one after fork; a commit is
+        # synced to disk before the view answers
+        conn = getattr(self.local, 'conn', None)
+        if conn is None or self.local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return conn
+
+    #  Submitting
+    #  ----------------------------------------------------------------
+
+    def submit(self, op, model, values, target=None, key=None):
+        # queues an 'insert' of values or an 'update' of row target; the
+        # Write, which is the earlier one when key was used before for the
+        # same request
+        if key is not None and (not key or len(key) > MAX_KEY_LENGTH):
+            raise BadKey(f'idempotency keys are 1 to {MAX_KEY_LENGTH} characters')
+        key = key or new_key()
+        request = request_hash(op, model, values, target)
+        earlier = self._earlier(key, request)
+        if earlier is not None:
+            return earlier
+        if op == 'insert':
+            sequence = func.pg_get_serial_sequence(f'"{model.__tablename__}"', 'id')
+            target = db.session.execute(select(func.nextval(sequence))).scalar()
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO writes (key, op, model, target, payload, state, queued_at, request) '
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (key, op, model.__name__, target, encode(values), time.time(), request)
+            )
+        self.start()
+        self.wake.set()
+        # another submission may have taken the key meanwhile
+        return self._earlier(key, request)
+
+    def _earlier(self, key, request):
+        # the write queued under key, None if there is none; refused if it
+        # was queued for another request
+        row = self._connect().execute('SELECT request FROM writes WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[0] is not None and row[0] != request:
+            raise KeyReused(f'idempotency key {key!r} was used for a different write')
+        return self.status(key)
+
+    def status(self, key):
+        row = self._connect().execute(
+            'SELECT key, state, op, model, target, error, queued_at, done_at FROM writes WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        key, state, op, model, target, error, queued_at, done_at = row
+        return Write(
+            key, state, op, model, target, error,
+            datetime.fromtimestamp(queued_at), done_at and datetime.fromtimestamp(done_at)
+        )
+
+    #  Worker
+    #  ----------------------------------------------------------------
+
+    def start(self):
+        # the worker of this process, started on first use after a fork
+        with self.lock:
+            if self.pid == os.getpid() and self.worker.is_alive():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.worker = threading.Thread(target=self._run, name='write-queue', daemon=True)
+            self.worker.start()
+
+    def _requeue_orphans(self):
+        # writes claimed by processes that are gone; a write they had
+        # committed is applied again, to the same effect
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            workers = [pid for pid, in conn.execute("SELECT DISTINCT worker FROM writes WHERE state = 'running'")]
+            for pid in workers:
+                if pid != os.getpid() and not _alive(pid):
+                    conn.execute("UPDATE writes SET state = 'queued', worker = NULL WHERE state = 'running' AND worker = ?", (pid,))
+
+    def _claim(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                "SELECT id, op, model, target, payload FROM writes WHERE state = 'queued' ORDER BY id LIMIT ?",
+                (self.batch,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE writes SET state = 'running', worker = ? WHERE id = ?", [(os.getpid(), row[0]) for row in rows]
+            )
+        return rows
+
+    def _finish(self, results):
+        # results are (id, state, error); finished writes are kept for
+        # status polling, then dropped
+        conn = self._connect()
+        now = time.time()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(
+                'UPDATE writes SET state = ?, error = ?, done_at = ? WHERE id = ?',
+                [(state, error, now, id) for id, state, error in results]
+            )
+            conn.execute('DELETE FROM writes WHERE done_at < ?', (now - self.keep,))
+
+    def _release(self, rows):
+        conn = self._connect()
+        with conn:
+            conn.executemany("UPDATE writes SET state = 'queued', worker = NULL WHERE id = ?", [(row[0],) for row in rows])
+
+    @staticmethod
+    def _apply(op, model, target, values):
+        row = db.session.get(model, target)
+        if op == 'insert':
+            if row is not None:
+                return
+            if model is Show:
+                # shows queued together were checked against the table only
+                clash = intervals.find_conflict(
+                    values['venue_id'], values['artist_id'], values['start_time'], values['duration']
+                )
+                if clash:
+                    raise Rejected(intervals.describe(*clash))
+            db.session.add(model(id=target, **values))
+        elif row is None:
+            raise Rejected(f'no {model.__name__.lower()} {target}')
+        else:
+            for key, value in values.items():
+                setattr(row, key, value)
+        db.session.flush()
+
+    def _commit(self, rows):
+        # one transaction for the batch; a write that fails is rolled back
+        # to its savepoint and reported, the others still commit
+        results = []
+        with self.app.app_context():
+            try:
+                for id, op, name, target, payload in rows:
+                    model = MODELS[name]
+                    try:
+                        with db.session.begin_nested():
+                            self._apply(op, model, target, decode(model, payload))
+                    except DBAPIError as error:
+                        results.append((id, 'failed', str(error.orig).strip()))
+                    except Rejected as error:
+                        results.append((id, 'failed', str(error)))
+                    else:
+                        results.append((id, 'done', None))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return results
+
+    def _run(self):
+        self._requeue_orphans()
+        while True:
+            rows = self._claim()
+            if not rows:
+                if self.stopping.is_set():
+                    return
+                self.wake.wait(self.poll)
+                self.wake.clear()
+                continue
+            try:
+                results = self._commit(rows)
+            except Exception:
+                # the database is unreachable or the batch broke as a whole:
+                # the writes go back in the queue for the next try
+                self.app.logger.exception('write queue batch of %d failed', len(rows))
+                self._release(rows)
+                if self.stopping.is_set():
+                    return
+                self.stopping.wait(self.poll)
+                continue
+            self._finish(results)
+
+    def close(self):
+        # at exit: lets the worker drain the queue, for a while
+        if self.worker is None or self.pid != os.getpid():
+            return
+        self.stopping.set()
+        self.wake.set()
+        self.worker.join(self.shutdown)
+
+
+queue = None
+
+
+def enabled():
+    return queue is not None
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def init_app(app):
+    global queue
+    # the forms carry a key each, so submitting one twice writes once
+    app.jinja_env.globals.update(new_idempotency_key=new_key)
+    if not app.config.get('WRITE_QUEUE'):
+        return
+    queue = WriteQueue(
+        app, app.config['WRITE_QUEUE_PATH'], app.config['WRITE_QUEUE_BATCH'],
+        app.config['WRITE_QUEUE_POLL_SECONDS'], app.config['WRITE_QUEUE_KEEP_SECONDS'],
+        app.config['WRITE_QUEUE_SHUTDOWN_SECONDS'],
+    )
+    atexit.register(queue.close)
+
+    @app.before_request
+    def start_write_queue():
+        # per process, so a worker forked by serve.py starts its own; drains
+        # writes left from an earlier run
+        queue.start()